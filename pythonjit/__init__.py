@@ -9,19 +9,15 @@ And imports will automatically be cythonized."""
 import sys
 import os
 
-try:
-    import cython
-except ImportError:
-    print("Cython not installed")
-    print("Run `pip install Cython` or `sudo pip install Cython` to get Cython")
-    raise
-
 import _cythonhook
 import _compile
-import _localimporter
+import _database
 import compilepythonjit # necessary for auto-documentation
 
+usage_policy = _cythonhook.usage_policy
+
 SHARED_LIBRARY = _compile.SHARED_LIBRARY
+BUILD_PROFILES = _compile.BUILD_PROFILES
 EXECUTABLE = _compile.EXECUTABLE
 CODE_DIR = os.path.join(os.path.expanduser("~"), "pythonjit", "compiled")
 
@@ -37,9 +33,24 @@ class Not_Compiled_Error(Exception):
 
 _STORAGE = []
 def enable(verbosity=0, version='2', db_name=_cythonhook.DEFAULT_DB,
-           code_dir=CODE_DIR, ignore_compilation_failure=False):
+           code_dir=CODE_DIR, ignore_compilation_failure=False, background=False, jobs=1,
+           strict=False, flush_interval=_cythonhook.FLUSH_INTERVAL,
+           artifact_dir=_cythonhook.ARTIFACT_DIR, wait_for_lock=True,
+           object_cache=_cythonhook.OBJECT_CACHE, bundle_packages=(), compile_policy=None,
+           profile=False, trace_types=False, types_dir=_cythonhook.TYPES_DIR,
+           build_profile=_compile.DEFAULT_PROFILE, compile_command=None, training_command=None,
+           compile_server=None, cache_bundle=None, max_cache_size=None):
     """ usage: enable(verbosity=0, version='2', db_name=_cythonhook.DEFAULT_DB,
-                      code_dir=CODE_DIR, ignore_compilation_failure=False) -> None
+                      code_dir=CODE_DIR, ignore_compilation_failure=False,
+                      background=False, jobs=1, strict=False,
+                      flush_interval=_cythonhook.FLUSH_INTERVAL,
+                      artifact_dir=_cythonhook.ARTIFACT_DIR, wait_for_lock=True,
+                      object_cache=_cythonhook.OBJECT_CACHE, bundle_packages=(),
+                      compile_policy=None, profile=False, trace_types=False,
+                      types_dir=_cythonhook.TYPES_DIR,
+                      build_profile=_compile.DEFAULT_PROFILE, compile_command=None,
+                      training_command=None, compile_server=None,
+                      cache_bundle=None, max_cache_size=None) -> None
 
         Enables automatic cross compilation of imported python modules via Cython.
         This is the primary part of the API offered by the pythonjit package.
@@ -53,7 +64,32 @@ def enable(verbosity=0, version='2', db_name=_cythonhook.DEFAULT_DB,
         version indicates the python version, and should be set to either '2' or '3'. Default is '2'.
         db_name is a filename string for the .db file that tracks when source code changes
         code_dir is a directory string that indicates where to cache compiled files
-        ignore_compilation_failure is a boolean that indicates whether to use a regular interpreted python module if a module cannot be compiled
+        artifact_dir is a directory string that indicates where to store compiled files by build key. Files in code_dir are links to these artifacts, so an unchanged source is only compiled once.
+        ignore_compilation_failure is a boolean that indicates whether to use a regular interpreted python module if a module cannot be compiled. A module that failed is not compiled again until its source or the build configuration changes (see compile_failures).
+        object_cache is a directory string that indicates where to cache compiled files by their generated C code, or None. gcc is not run again when a source change does not change the C code.
+        wait_for_lock is a boolean that indicates what to do when another process is already compiling a module: wait for its compiled version (True), or import the interpreted module (False)
+        background is a boolean that indicates whether to compile modules in worker threads instead of during the import. The import proceeds with the interpreted module.
+        jobs is the number of worker threads used when background is True
+        strict is a boolean that indicates whether to hash every imported source file, instead of only those whose modification time, size or inode changed.
+        bundle_packages is an iterable of package names (e.g. ("xml", "email")). Each of these packages is compiled into a single shared library when it is first imported.
+        compile_policy is None to compile every imported module, or a function called as compile_policy(module_name, usage) that returns True to compile the module. See usage_policy and module_usage.
+        profile is a boolean that indicates whether to measure the CPU time spent in each module with a sampling profiler (main thread only, not available on Windows).
+        trace_types is a boolean that indicates whether to record the types of variables in the module level functions of imported modules. At exit, the observations are written to types_dir as augmenting .pxd files.
+        types_dir is a directory string that indicates where traced types and the generated .pxd files are kept, or None to not use generated declarations.
+        build_profile is the name of the build profile to compile modules with:
+
+            - "debug": no optimization, with debugging information
+            - "default": -O2
+            - "fast": -O3 and link time optimization
+            - "native": like "fast", and tuned for the CPU of this machine
+            - "pgo": like "fast", with profile guided optimization; requires training_command
+
+        compile_command is a command string (see cross_compile) to use instead of the command of build_profile. None uses the build profile.
+        training_command is a shell command that runs a representative workload for the "pgo" profile. The workload should call pythonjit.enable() before importing the module.
+        compile_server is the Unix domain socket of a compile server (see compileserver.py), or None. Modules are compiled in this process when the server cannot be reached.
+        cache_bundle is the file name of a cache bundle made by export_cache_bundle, or None. Modules whose source matches the bundle are loaded from it without compiling anything; raises ValueError if the file is not a cache bundle for this python.
+        max_cache_size is None, or a number of bytes that code_dir and artifact_dir should not grow beyond. The least recently used compiled files are evicted in a background thread (see collect_garbage).
+        flush_interval is the minimum number of seconds between writes of changed cache entries to the database, or None to only write at exit or when disabled.
 
         The Import_Hook created by calling enable() will live in the _STORAGE list in the pythonjit module.
 
@@ -63,8 +99,23 @@ def enable(verbosity=0, version='2', db_name=_cythonhook.DEFAULT_DB,
     else:
         _STORAGE.append(_cythonhook.Import_Hook(version=version, verbosity=verbosity,
                                                 database_name=db_name, code_dir=code_dir,
-                                                ignore_compilation_failure=ignore_compilation_failure))
-        _STORAGE.append(_localimporter.Local_Importer(code_dir))
+                                                ignore_compilation_failure=ignore_compilation_failure,
+                                                background=background, jobs=jobs, strict=strict,
+                                                flush_interval=flush_interval,
+                                                artifact_dir=artifact_dir,
+                                                wait_for_lock=wait_for_lock,
+                                                object_cache=object_cache,
+                                                bundle_packages=bundle_packages,
+                                                compile_policy=compile_policy,
+                                                profile=profile,
+                                                trace_types=trace_types,
+                                                types_dir=types_dir,
+                                                build_profile=build_profile,
+                                                compile_command=compile_command,
+                                                training_command=training_command,
+                                                compile_server=compile_server,
+                                                cache_bundle=cache_bundle,
+                                                max_cache_size=max_cache_size))
 
 def disable():
     """ usage: disable() -> None
@@ -77,15 +128,32 @@ def disable():
     if not any(_STORAGE):
         raise Not_Enabled_Error("pythonjit.disable called when pythonjit not enabled")
     else:
+        _STORAGE[0].close()
         for item in _STORAGE:
             sys.meta_path.remove(item)
         del _STORAGE[:]
 
+def wait_for_compilation():
+    """ usage: wait_for_compilation() -> None
+
+        Blocks until all modules being compiled in the background have finished compiling.
+        Useful for build scripts that enable pythonjit with background=True.
+
+        Raises the first error from a failed background compilation, unless pythonjit was enabled with ignore_compilation_failure=True.
+        Raises Not_Enabled_Error if pythonjit.enable has not been called yet."""
+    if not _STORAGE:
+        raise Not_Enabled_Error("pythonjit.wait_for_compilation called when pythonjit not enabled")
+    _STORAGE[0].wait_for_compilation()
+
 def cross_compile(file_list, output_names, mode=SHARED_LIBRARY, version='2', verbosity=0,
-                  compile_command=_compile.COMPILE_COMMAND):
+                  compile_command=_compile.COMPILE_COMMAND, jobs=1, object_cache=None, bundle=None,
+                  declarations=None, build_profile=None, training_command=None):
     """ usage: cross_compile(file_list, output_names, mode=_compile.SHARED_LIBRARY,
-                             version='2', verbosity=0
-                             compile_command=_compile.COMPILE_COMMAND) => list of compiled file names
+                             version='2', verbosity=0,
+                             compile_command=_compile.COMPILE_COMMAND, jobs=1,
+                             object_cache=None, bundle=None,
+                             declarations=None, build_profile=None,
+                             training_command=None) => list of compiled file names
 
         Cross compiles the .py files specified in file_list to compiled binaries.
         file_list is a list of strings indicating the files to be converted, with the .py file extension
@@ -94,14 +162,151 @@ def cross_compile(file_list, output_names, mode=SHARED_LIBRARY, version='2', ver
         version is optional, and should be a string set to either '2' or '3' to instruct cython that the correct python version is 2 or 3. Default is '2'
         verbosity is optional, and should be set to either 0 or 2; 0 is quiet mode with no output, while 2 provides step-by-step indication of the compilation process. verbosity=1 is reserved for the Import_Hook object. Default is 0
         compile_command is optional, and should be set to a string with 2 format/insertion points that runs a compiler (e.g. gcc) with any relevant flags/switches. The first insertion should be for the file name (something.c), and the second insertion point should be for the executable/library name, *without* the file extension (that will be inserted automatically)
+        jobs is optional, and should be set to the number of worker processes that run cython and the compiler in parallel. 0 uses one worker per CPU. Default is 1. Compiled file names are returned in the same order as file_list either way.
+        object_cache is optional, and should be set to a directory string to skip the compiler when cython generates C code that was compiled before (ignoring comments). Default is None. See object_cache_stats.
+        bundle is optional, and should be set to a file name (without the file extension) to compile all of file_list (e.g. every module of a package) into that single shared library. The modules must have unique names. output_names, mode, jobs and object_cache are not used for bundles, and a list containing the name of the bundle is returned. Default is None.
+        declarations is optional, and should be set to a list of equivalent length of file_list with an augmenting .pxd file name or None for each file (e.g. the .pxd files generated by type tracing). A .pxd file next to a source file is always used when its entry is None. Default is None.
+        build_profile is optional, and should be set to "debug", "default", "fast", "native" or "pgo" to compile with the flags of that build profile (see enable) instead of compile_command. Default is None.
+        training_command is optional, and should be set to a shell command that exercises the compiled files, to compile them with profile guided optimization: the files are compiled with instrumentation to their output names, training_command is run, and they are compiled again with the recorded profile. Required by the "pgo" profile. Default is None.
 
         examples:
 
             cross_compile(["packagehead.py", "library.py"], [None, None],
                           mode=pythonjit.SHARED_LIBRARY, version='3', verbosity=2)
 
-            cross_compile(["main.py"], ["myapp"], mode=pythonjit.EXECUTABLE)"""
-    return _compile.cross_compile(file_list, output_names, mode, version, verbosity, compile_command)
+            cross_compile(["main.py"], ["myapp"], mode=pythonjit.EXECUTABLE)
+
+            cross_compile(file_list, [None] * len(file_list), jobs=8)
+
+            cross_compile(package_files, [None] * len(package_files), bundle="package")
+
+            cross_compile(["numeric.py"], [None], build_profile="pgo", training_command="python benchmark.py")"""
+    return _compile.cross_compile(file_list, output_names, mode, version, verbosity, compile_command,
+                                  jobs, object_cache, bundle, declarations, build_profile,
+                                  training_command)
+
+def object_cache_stats(object_cache=_cythonhook.OBJECT_CACHE):
+    """ usage: object_cache_stats(object_cache=_cythonhook.OBJECT_CACHE) => dict
+
+        Returns the statistics recorded for the object cache in the directory object_cache.
+        The dictionary has the following entries:
+
+            - hits: the number of compilations that reused a cached file instead of running gcc
+            - misses: the number of compilations that ran gcc
+            - compile_seconds: the time spent in gcc for the misses
+            - seconds_saved: the gcc time that the hits avoided"""
+    return _compile.object_cache_stats(object_cache)
+
+def module_usage():
+    """ usage: module_usage() => dict of module_name : usage
+
+        Returns the usage recorded for every module: a dictionary with the number of times the module has been imported (import_count) and the CPU time measured in it (cpu_time, in seconds; only measured when enabled with profile=True).
+        Useful for choosing the thresholds of a compile policy.
+
+        Raises Not_Enabled_Error if pythonjit.enable has not been called yet."""
+    if not _STORAGE:
+        raise Not_Enabled_Error("Must enable pythonjit before db can be accessed")
+    hook = _STORAGE[0]
+    hook.record_cpu_time()
+    return dict((module_name, dict(usage)) for module_name, usage in hook.usage.items())
+
+def import_overhead(count=10):
+    """ usage: import_overhead(count=10) => dict
+
+        Returns the time the import hook has spent in this process since pythonjit was enabled.
+        The dictionary has the following entries:
+
+            - imports: the number of imports the hook was asked to find (modules already in sys.modules are not asked for)
+            - seconds: the total time spent in the hook
+            - compile_seconds: the part of seconds spent compiling modules during imports
+            - overhead_seconds: seconds without compile_seconds, i.e. the time the hook adds to imports that do not compile anything
+            - per_import: overhead_seconds divided by imports
+            - slowest: the count modules the hook spent the most time on, as a list of (module_name, seconds)
+
+        The totals of every process are also added to the statistics returned by stats (hook_calls, hook_seconds and hook_compile_seconds).
+        benchmarkstartup.py measures the overhead at startup with a cold and a warm cache.
+
+        Raises Not_Enabled_Error if pythonjit.enable has not been called yet."""
+    if not _STORAGE:
+        raise Not_Enabled_Error("pythonjit.import_overhead called when pythonjit not enabled")
+    return _STORAGE[0].import_overhead(count)
+
+def stats(db_name=_cythonhook.DEFAULT_DB):
+    """ usage: stats(db_name=_cythonhook.DEFAULT_DB) => dict
+
+        Returns the compile telemetry recorded in the cache database db_name. Pending changes are written to the database first if pythonjit is enabled with the same database. Processes that only load compiled modules keep their counters until they compile something or have counted _cythonhook.DEFERRED_IMPORTS imports, so the hits of short warm processes are not recorded.
+        The dictionary has the following entries:
+
+            - hits, misses and stale: the number of imports that found an up to date compiled module, that found none, and that found one for an older version of the source or build configuration
+            - hit_rate: hits divided by the number of imports
+            - artifact_hits: the number of times a compiled file was reused from the artifact store instead of compiling
+            - compiles and compile_failures: the number of compilations that ran, and that failed
+            - digest_checks, digests_computed and digest_seconds: the number of source digest checks, how many of them hashed the source file, and the time they took
+            - dependency_scans: the number of times the .pxd, .pxi and header files that a module depends on were found and hashed again, because one of them changed or none were recorded
+            - hook_calls, hook_seconds and hook_compile_seconds: the number of imports the import hook was asked to find, the time spent in the hook, and the part of that time spent compiling (see import_overhead)
+            - gc_runs and gc_bytes_reclaimed: the number of garbage collections of the cache, and the bytes they reclaimed (see collect_garbage)
+            - modules: a dictionary of module_name : stats of its latest compilation, with the total_seconds taken, the time spent copying the source (pyx_seconds), in cython (cython_seconds), in gcc (gcc_seconds) and in the pgo training command (training_seconds), the size in bytes of the generated C code (c_size) and of the compiled file (library_size), object_cache_hits, artifact_key and compiled_at
+
+        compilereport.py prints a report of these statistics."""
+    return _query_database(_cythonhook.compile_stats, db_name)
+
+def compile_failures(db_name=_cythonhook.DEFAULT_DB):
+    """ usage: compile_failures(db_name=_cythonhook.DEFAULT_DB) => dict of module_name : failure
+
+        Returns the modules that failed to compile, as recorded in the cache database db_name. A module that failed is not compiled again until its source or the build configuration changes.
+        Each failure is a dictionary with the following entries:
+
+            - stage: "cython" or "compiler"
+            - message: the message of the Cython_Conversion_Error or Compilation_Error
+            - output: the error output of cython or the compiler
+            - source_file, source_digest and artifact_key: the source and build key that failed
+            - failed_at: the time.time() of the failure
+
+        compilefailures.py lists (and clears) the recorded failures."""
+    return _query_database(_cythonhook.compile_failures, db_name)
+
+def export_cache_bundle(filename, db_name=_cythonhook.DEFAULT_DB, code_dir=CODE_DIR,
+                        artifact_dir=_cythonhook.ARTIFACT_DIR):
+    """ usage: export_cache_bundle(filename, db_name=_cythonhook.DEFAULT_DB, code_dir=CODE_DIR,
+                                   artifact_dir=_cythonhook.ARTIFACT_DIR) => number of modules
+
+        Writes the compiled modules of a cache to the cache bundle filename: a single archive with the compiled files and, for each module, the digest of the source file it was compiled from. The bundle is tagged with the python ABI and platform it was made on.
+        db_name is the cache database whose modules are exported, and code_dir and artifact_dir are the directories their compiled files are in (see enable). Pending changes are written to the database first if pythonjit is enabled with the same database.
+        Packages compiled into a bundle (see bundle_packages) are left out.
+
+        The bundle is used by passing it to enable as the cache_bundle argument on another machine (e.g. a deployment target without a compiler). exportcache.py runs this function from the command line.
+        Returns the number of modules in the bundle. """
+    return _query_database(lambda database: _cythonhook.export_cache_bundle(filename, database, code_dir,
+                                                                           artifact_dir), db_name)
+
+def collect_garbage(db_name=_cythonhook.DEFAULT_DB, code_dir=CODE_DIR, artifact_dir=_cythonhook.ARTIFACT_DIR,
+                    max_cache_size=None):
+    """ usage: collect_garbage(db_name=_cythonhook.DEFAULT_DB, code_dir=CODE_DIR,
+                               artifact_dir=_cythonhook.ARTIFACT_DIR, max_cache_size=None) => dict or None
+
+        Removes the files of the cache that are no longer needed, and returns a report of what was removed.
+        Compiled files in code_dir whose source file no longer exists (orphans) or has changed since it was compiled (stale) are removed, together with their entries in the cache database db_name, as are stored compiled files in artifact_dir that are no longer used (artifacts) and temporary files left behind by interrupted compilations (temporary_files). If max_cache_size is a number of bytes, the compiled files that were used least recently are then removed until the cache is no larger than max_cache_size (evicted). Modules whose compiled files were removed are compiled again the next time they are imported.
+        Files modified in the last hour are only removed if their source file no longer exists, because other processes may still be recording them.
+
+        The dictionary has the number of files removed for each of orphans, stale, artifacts, temporary_files and evicted, the number of bytes_reclaimed, the cache_size in bytes that remains, and the modules whose entries were removed (removed_entries).
+        Returns None if another process is collecting garbage in code_dir. gccache.py runs this function from the command line. """
+    remove_file = None
+    if _STORAGE and _STORAGE[0].database.database_name == db_name:
+        remove_file = _STORAGE[0].remove_compiled # keeps the compiled files that this process uses
+    return _query_database(lambda database: _cythonhook.collect_cache_garbage(database, code_dir, artifact_dir,
+                                                                             max_cache_size, remove_file),
+                           db_name)
+
+def _query_database(query, db_name):
+    """ Returns query(database) for the cache database db_name. Pending changes are written to the database first if pythonjit is enabled with the same database. """
+    if _STORAGE and _STORAGE[0].database.database_name == db_name:
+        _STORAGE[0].flush()
+        return query(_STORAGE[0].database)
+    database = _database.Cache_Database(database_name=db_name)
+    try:
+        return query(database)
+    finally:
+        database.delete()
 
 def get_file_path(module_name):
     """ usage: get_file_path(module_name) => file_path
@@ -114,9 +319,8 @@ def get_file_path(module_name):
     Raises Not_Enabled_Error if pythonjit.enable has not been called yet."""
     if not _STORAGE:
         raise Not_Enabled_Error("Must enable pythonjit before db can be accessed")
-    db = _STORAGE[0].database
-    return db.query("Source_Info", retrieve_fields=("source_file", ),
-                                   where={"module_name" : module_name}) or ''
+    entry = _STORAGE[0].lookup(module_name)
+    return entry["source_file"] if entry else ''
 
 # it would be nice to alias the requisite functionality from cython so that cython does not need to be imported
 # would need to also alias cythons types to use these, otherwise you'd have to import cython anyways
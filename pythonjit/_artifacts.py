@@ -0,0 +1,98 @@
+""" Content addressed storage for compiled modules.
+
+Compiled modules are stored under a build key: a hash of the module's source digest, the module name, the Cython version, the python ABI, the compile command and the cython directives.
+Identical sources built with the same toolchain share one artifact, no matter where the source file lives, while a change to any part of the toolchain produces a new key (and therefore a rebuild).
+
+`Import_Hook` links artifacts into `code_dir` at the path that mirrors the source file.
+
+This module is a utility used by the library, and is not intended to be used in any other capacity."""
+import os
+import sys
+import errno
+import shutil
+import hashlib
+import platform
+
+try:
+    import cython
+except ImportError: # compiled modules can still be loaded from a cache bundle (see _cachebundle)
+    cython = None
+
+__all__ = ("ARTIFACT_DIR", "CYTHON_VERSION", "Artifact_Store", "build_key", "python_abi", "file_digest")
+
+ARTIFACT_DIR = os.path.join(os.path.expanduser("~"), "pythonjit", "artifacts")
+DIGEST_CHUNK_SIZE = 1024 * 1024
+
+CYTHON_VERSION = cython.__version__ if cython is not None else None
+PYTHON_ABI = '-'.join((platform.python_implementation(), '.'.join(str(item) for item in sys.version_info[:2]),
+                       "maxunicode={}".format(sys.maxunicode), "maxsize={}".format(sys.maxsize),
+                       sys.platform, platform.machine()))
+
+def file_digest(_path):
+    """ Returns the sha256 hex digest of the file indicated by _path. The file is read in chunks of DIGEST_CHUNK_SIZE bytes.
+        Source files, augmenting .pxd files and their dependencies are all hashed with this function. """
+    digest = hashlib.sha256()
+    with open(_path, 'rb') as _file:
+        for chunk in iter(lambda: _file.read(DIGEST_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def python_abi():
+    """ usage: python_abi() => str
+
+        Returns a string that identifies the python ABI that compiled modules are built against.
+        The string is computed once, when this module is imported, because build_key is called on every import. """
+    return PYTHON_ABI
+
+def build_key(source_digest, module_name, version, mode, compile_command, declarations_digest=None,
+              profile=None, dependencies_digest=None):
+    """ usage: build_key(source_digest, module_name, version, mode, compile_command,
+                         declarations_digest=None, profile=None, dependencies_digest=None) => str
+
+        Returns the key that the compiled version of a module is stored under.
+        The key covers everything that affects the compiled file: the source, the module name (which names the init function), the Cython version, the python ABI, the compile command, the cython directives (version and mode), the digest of the augmenting .pxd file, if there is one, the build profile (see _compile.profile_signature) and the digest of the files the module depends on, if there are any (see _dependencies.dependencies_digest). """
+    configuration = (source_digest, module_name, CYTHON_VERSION, python_abi(),
+                     compile_command, mode, "language_level={}".format(version))
+    if declarations_digest is not None:
+        configuration += ("declarations={}".format(declarations_digest), )
+    if profile is not None:
+        configuration += ("profile={}".format(profile), )
+    if dependencies_digest is not None:
+        configuration += ("dependencies={}".format(dependencies_digest), )
+    return hashlib.sha256('\0'.join(str(item) for item in configuration)).hexdigest()
+
+def make_directory(directory):
+    """ Creates directory (and any missing parent directories) if it does not exist yet. """
+    try:
+        os.makedirs(directory)
+    except OSError as error:
+        if error.errno != errno.EEXIST or not os.path.isdir(directory):
+            raise
+
+class Artifact_Store(object):
+    """ A directory of compiled files named after their build keys. """
+
+    def __init__(self, directory=ARTIFACT_DIR):
+        self.directory = directory
+
+    def get_path(self, key, extension):
+        """ Returns the path of the artifact for key, without checking whether it exists. """
+        return os.path.join(self.directory, key[:2], "{}.{}".format(key, extension))
+
+    def contains(self, key, extension):
+        """ Returns True if an artifact for key exists. """
+        return os.path.isfile(self.get_path(key, extension))
+
+    def link(self, artifact, output_file):
+        """ Makes output_file refer to artifact, replacing output_file if it exists.
+
+            A hard link is used where possible, and a copy otherwise. output_file is replaced with a rename, so it is never observed half written. """
+        make_directory(os.path.dirname(output_file))
+        temporary_file = "{}.{}.tmp".format(output_file, os.getpid())
+        try:
+            os.link(artifact, temporary_file)
+        except (AttributeError, OSError): # no os.link on windows with python 2, or a different file system
+            shutil.copy2(artifact, temporary_file)
+        if os.name == "nt" and os.path.exists(output_file):
+            os.remove(output_file)
+        os.rename(temporary_file, output_file)
@@ -0,0 +1,50 @@
+""" Provides a [module loader](https://www.python.org/dev/peps/pep-0302/) for compiled modules, and for bundles: shared libraries that contain several compiled modules (see `_compile.compile_bundle`).
+
+`Import_Hook` adds every compiled module that it finds up to date to a `Bundle_Importer`, and returns it as the loader, so the compiled file is loaded directly instead of being searched for again by the default import machinery.
+
+Python 2 remembers extension modules by file name, so loading a second module out of the same file name returns a copy of the first one. Each module of a bundle is therefore given its own file name, which is a hard link to the bundle (see `Import_Hook`). The dynamic loader recognizes that the links are the same file, so the bundle is only opened and mapped into memory once.
+
+This module is a utility used by the library, and is not intended to be used in any other capacity."""
+import sys
+import imp
+
+__all__ = ("Bundle_Importer", )
+
+class Bundle_Importer(object):
+    """ Finds and loads the compiled modules that were added with add_module.
+
+        Package modules are created with a __path__ before their initialization function runs, so that relative imports and imports of submodules work while the package is initializing. """
+
+    def __init__(self):
+        self.modules = dict()
+
+    def add_module(self, module_name, filename, package_path=None):
+        """ usage: add_module(module_name, filename, package_path=None) => None
+
+            Makes module_name load from the compiled file or bundle indicated by filename.
+            package_path should be the __path__ list of the module if it is a package, and None otherwise. """
+        self.modules[module_name] = (filename, package_path)
+
+    def remove_module(self, module_name):
+        """ Stops serving module_name. Does nothing if module_name was not added. """
+        self.modules.pop(module_name, None)
+
+    def find_module(self, module_name, path=None):
+        if module_name in self.modules:
+            return self
+
+    def load_module(self, module_name):
+        if module_name in sys.modules:
+            return sys.modules[module_name]
+        filename, package_path = self.modules[module_name]
+        module = imp.new_module(module_name)
+        module.__file__ = filename
+        module.__loader__ = self
+        if package_path is not None:
+            module.__path__ = list(package_path)
+        sys.modules[module_name] = module # the initialization function fills in this module
+        try:
+            return imp.load_dynamic(module_name, filename)
+        except:
+            sys.modules.pop(module_name, None)
+            raise
@@ -0,0 +1,117 @@
+""" Cache bundles: a single archive with the compiled modules of a cache, for machines that have no compiler.
+
+A cache bundle is an uncompressed zip archive. Its index.json member records the python ABI and platform the modules were compiled for, and for every module its source digest, build key and the source file it was compiled from. The compiled files are stored under artifacts/ by build key.
+
+`export_bundle` writes a bundle from the manifest (the Source_Info table) and the compiled files of a cache. On the target machine, `Import_Hook` is given the bundle (see `pythonjit.enable`). When an imported module's source file has the digest recorded in the bundle, its compiled file is extracted into the Artifact_Store and linked into code_dir, and the module is never compiled. Only the index and the compiled files of imported modules are read from the archive.
+
+This module is a utility used by the library, and is not intended to be used in any other capacity."""
+import os
+import json
+import thread
+import zipfile
+import platform
+
+import _artifacts
+
+__all__ = ("BUNDLE_FORMAT", "INDEX_NAME", "Cache_Bundle", "export_bundle")
+
+BUNDLE_FORMAT = 1
+INDEX_NAME = "index.json"
+
+def artifact_name(artifact_key, library_type):
+    """ Returns the name of the archive member that holds the compiled file for artifact_key. """
+    return "artifacts/{}.{}".format(artifact_key, library_type)
+
+def export_bundle(filename, manifest, compiled_files, library_type):
+    """ usage: export_bundle(filename, manifest, compiled_files, library_type) => number of modules
+
+        Writes a cache bundle to filename.
+        manifest is a dictionary of module_name : Source_Info entry (see Import_Hook.load_manifest).
+        compiled_files is a function that accepts a module_name and its entry, and returns a list of the files that may hold its compiled version, in order of preference (e.g. the file in code_dir and the artifact in the Artifact_Store).
+        library_type is the file extension of the compiled files.
+
+        Modules without a compiled file are left out. Returns the number of modules in the bundle. """
+    modules = dict()
+    temporary_name = "{}.{}.tmp".format(filename, os.getpid())
+    with zipfile.ZipFile(temporary_name, 'w', zipfile.ZIP_STORED, allowZip64=True) as archive:
+        for module_name, entry in sorted(manifest.items()):
+            artifact_key = entry.get("artifact_key")
+            if not artifact_key or not entry.get("source_digest"):
+                continue
+            for compiled_file in compiled_files(module_name, entry):
+                if os.path.isfile(compiled_file):
+                    break
+            else:
+                continue
+            member = artifact_name(artifact_key, library_type)
+            if member not in archive.NameToInfo: # modules of a package bundle share one artifact
+                archive.write(compiled_file, member)
+            modules[module_name] = {"source_digest" : entry["source_digest"], "artifact_key" : artifact_key,
+                                    "source_file" : entry.get("source_file")}
+        index = {"format" : BUNDLE_FORMAT, "python_abi" : _artifacts.python_abi(),
+                 "platform" : platform.platform(), "cython_version" : _artifacts.CYTHON_VERSION,
+                 "library_type" : library_type, "modules" : modules}
+        archive.writestr(INDEX_NAME, json.dumps(index, sort_keys=True))
+    if os.name == "nt" and os.path.exists(filename):
+        os.remove(filename)
+    os.rename(temporary_name, filename)
+    return len(modules)
+
+class Cache_Bundle(object):
+    """ usage: Cache_Bundle(filename, library_type) => cache_bundle
+
+        A cache bundle (see export_bundle), opened for reading.
+        Only the index is read when it is opened; compiled files are read when they are extracted.
+
+        Raises ValueError if the file is not a cache bundle, or if it was made for another python ABI or another type of compiled file. """
+
+    def __init__(self, filename, library_type):
+        self.filename = filename
+        self.library_type = library_type
+        self.lock = thread.allocate_lock()
+        try:
+            self.archive = zipfile.ZipFile(filename)
+            index = json.loads(self.archive.read(INDEX_NAME))
+        except (zipfile.BadZipfile, KeyError, ValueError):
+            raise ValueError("{} is not a cache bundle".format(filename))
+        if index.get("format") != BUNDLE_FORMAT:
+            raise ValueError("{} has an unsupported cache bundle format: {}".format(filename, index.get("format")))
+        if index["python_abi"] != _artifacts.python_abi() or index["library_type"] != library_type:
+            raise ValueError("{} was made for {} ({} files), not {} ({} files)".format(filename, index["python_abi"],
+                             index["library_type"], _artifacts.python_abi(), library_type))
+        self.modules = index["modules"]
+        self.artifact_keys = set(entry["artifact_key"] for entry in self.modules.values())
+        self.cython_version = index["cython_version"]
+
+    def lookup(self, module_name, source_digest):
+        """ Returns the build key of the compiled version of module_name in the bundle, or None if the bundle does not have module_name compiled from a source with the digest source_digest. """
+        entry = self.modules.get(module_name)
+        if entry is None or entry["source_digest"] != source_digest:
+            return None
+        return entry["artifact_key"]
+
+    def __contains__(self, artifact_key):
+        return artifact_key in self.artifact_keys
+
+    def extract(self, artifact_key, artifact):
+        """ usage: extract(artifact_key, artifact) => bool
+
+            Writes the compiled file for artifact_key to the file artifact (e.g. in an Artifact_Store). The file is written under a temporary name and renamed into place.
+            Returns False if the bundle does not have artifact_key. """
+        if artifact_key not in self.artifact_keys:
+            return False
+        _artifacts.make_directory(os.path.dirname(artifact))
+        temporary_name = "{}.{}-{}.tmp".format(artifact, os.getpid(), thread.get_ident())
+        with self.lock: # the archive reads from one position in the file
+            data = self.archive.read(artifact_name(artifact_key, self.library_type))
+        with open(temporary_name, 'wb') as _file:
+            _file.write(data)
+        os.chmod(temporary_name, 0o755)
+        if os.name == "nt" and os.path.exists(artifact):
+            os.remove(artifact)
+        os.rename(temporary_name, artifact)
+        return True
+
+    def close(self):
+        """ Closes the archive. """
+        self.archive.close()
@@ -1,125 +1,503 @@
-""" Handles the process of using cython and gcc to cross compile .py files into .pyx, then into .c, then into .so/.pyd/.exe.
+""" Handles the process of using cython and gcc to cross compile .py files into .c, then into .so/.pyd/.exe.
 
 While this module does expose one function that is intended to be available to end users, that function is aliased in the `pythonjit` module.
 
 This module is not part of the exposed API, and users should access the `cross_compile` functionality through `pythonjit`."""
 import os
-from sys import platform
+import re
+import sys
+import json
+import thread
+import timeit
+import traceback
+import StringIO
+import hashlib
+import platform
 import tempfile
+import shutil
+import subprocess
+import multiprocessing
+import distutils.sysconfig
 
-__all__ = ("SHARED_LIBRARY", "EXECUTABLE", "cross_compile")
+import _artifacts
+import _filelock
 
-SHARED_LIBRARY = "pyd" if "win" in platform else "so"
+__all__ = ("SHARED_LIBRARY", "EXECUTABLE", "BUILD_PROFILES", "cross_compile", "compile_bundle",
+           "build_command")
+
+SHARED_LIBRARY = (distutils.sysconfig.get_config_var("EXT_SUFFIX") or
+                  distutils.sysconfig.get_config_var("SO"))[1:]
 EXECUTABLE = "exe"
-COMPILE_COMMAND = "gcc {} -IC:\Python27\include -LC:\Python27\libs\ -lpython27 -o {}." if "win" in platform else "gcc {} -pthread -fPIC -fwrapv -O2 -fno-strict-aliasing -I /usr/include/python2.7 -lpython2.7 -lpthread -lm -lutil -ldl -o {}."
 
-class Compilation_Error(Exception):
+# compiler flags of each build profile; see build_command
+BUILD_PROFILES = {"debug" : "-O0 -g",
+                  "default" : "-O2",
+                  "fast" : "-O3 -flto",
+                  "native" : "-O3 -flto -march=native",
+                  "pgo" : "-O3 -flto"}
+DEFAULT_PROFILE = "default"
+PGO_GENERATE = " -fprofile-generate={}"
+PGO_USE = " -fprofile-use={} -fprofile-correction -Wno-missing-profile"
+
+def build_command(profile=DEFAULT_PROFILE):
+    """ usage: build_command(profile=DEFAULT_PROFILE) => compile command
+
+        Returns a compile command (see ccompile) that compiles with the flags of the named build profile:
+
+            - debug: no optimization, with debugging information
+            - default: -O2
+            - fast: -O3 with link time optimization
+            - native: like fast, and tuned for the CPU of the machine (the compiled files may not run on other machines)
+            - pgo: like fast, with profile guided optimization when a training command is supplied (see cross_compile)
+
+        The python include and library directories are taken from sysconfig.
+        Raises ValueError for an unknown profile."""
+    try:
+        flags = BUILD_PROFILES[profile]
+    except KeyError:
+        raise ValueError("Unknown build profile '{}'; the profiles are {}".format(profile, ', '.join(sorted(BUILD_PROFILES))))
+    include_dir = distutils.sysconfig.get_python_inc()
+    library = "python" + distutils.sysconfig.get_config_var("VERSION").replace('.', '' if sys.platform == "win32" else '.')
+    if sys.platform == "win32":
+        library_dir = os.path.join(sys.exec_prefix, "libs")
+        return "gcc {} " + flags + " -I" + include_dir + " -L" + library_dir + " -l" + library + " -o {}."
+    library_dir = distutils.sysconfig.get_config_var("LIBDIR")
+    return ("gcc {} -pthread -fPIC -fwrapv -fno-strict-aliasing " + flags + " -I " + include_dir +
+            " -L " + library_dir + " -l" + library + " -lpthread -lm -lutil -ldl -o {}.")
+
+def cpu_signature():
+    """ Returns a string that identifies the model and features of the CPU, for build profiles that tune for it. """
+    try:
+        with open("/proc/cpuinfo", 'r') as _file:
+            lines = [line for line in _file if line.startswith(("model name", "flags"))][:2]
+    except IOError:
+        lines = [platform.processor()]
+    return hashlib.sha256(platform.machine() + ''.join(lines)).hexdigest()[:16]
+
+def profile_signature(profile, training_command=None):
+    """ usage: profile_signature(profile, training_command=None) => str
+
+        Returns a string that identifies the output of a build profile, for build keys.
+        This is the name of the profile, plus the CPU for the native profile and the training command for profile guided optimization. """
+    signature = profile
+    if profile == "native":
+        signature += " cpu=" + cpu_signature()
+    if training_command:
+        signature += " training=" + training_command
+    return signature
+
+COMPILE_COMMAND = build_command(DEFAULT_PROFILE)
+
+# entries of the stats dictionary filled in by cross_compile
+COMPILE_STATS = ("pyx_seconds", "cython_seconds", "gcc_seconds", "training_seconds", "c_size", "library_size",
+                 "object_cache_hits")
+
+TEMPORARY_PREFIX = "pythonjit"
+CYTHON_LOCK = thread.allocate_lock()
+cython_thread = None
+worker_failed = None # set by _start_worker in the worker processes of cross_compile
+C_COMMENTS_AND_STRINGS = re.compile(r'"(?:\\.|[^"\\\n])*"|\'(?:\\.|[^\'\\\n])*\'|/\*.*?\*/|//[^\n]*', re.S)
+
+class Tool_Error(Exception):
+    """ Base class for errors raised when a tool (cython or the compiler) fails.
+        The error output of the tool is available as the output attribute. """
+
+    def __init__(self, message, output=''):
+        super(Tool_Error, self).__init__(message, output)
+        self.output = output
+
+    def __str__(self):
+        return self.args[0]
+
+class Compilation_Error(Tool_Error):
     """ Raised when a compiler (e.g. gcc) fails to compile a .c file. """
 
-class Cython_Conversion_Error(Exception):
-    """ Raised when cython fails to compile a .pyx file. """
+class Cython_Conversion_Error(Tool_Error):
+    """ Raised when cython fails to compile a python file. """
 
 class Pyx_Conversion_Error(Exception):
     """ Raised when convert_to_pyx is supplied a non-.py file. """
 
 
-def convert_to_pyx(file_list):
-    """ usage: convert_to_pyx(file_list) => list of .pyx file names
+def add_stat(stats, name, value):
+    """ Adds value to the entry name of the stats dictionary, unless stats is None (see cross_compile). """
+    if stats is not None:
+        stats[name] = stats.get(name, 0) + value
+
+def run_command(command, verbosity=0):
+    """ usage: run_command(command, verbosity=0) => (exit status, error output)
+
+        Runs command in a shell and returns its exit status and what it wrote to stderr.
+        The error output is passed on to stderr when verbosity is 2. """
+    process = subprocess.Popen(command, shell=True, stderr=subprocess.PIPE)
+    output = process.communicate()[1]
+    if verbosity > 1 and output:
+        sys.stderr.write(output)
+    return process.returncode, output
+
+class Thread_Output(object):
+    """ usage: Thread_Output(stream) => thread_output
 
-        creates .pyx files from a list of .py files.
+        File-like object that collects what the thread that created it writes in its output attribute (a StringIO), and passes what other threads write on to stream. """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.thread = thread.get_ident()
+        self.output = StringIO.StringIO()
+
+    def write(self, text):
+        if thread.get_ident() == self.thread:
+            self.output.write(text)
+        else:
+            self.stream.write(text)
+
+    def __getattr__(self, attribute):
+        return getattr(self.stream, attribute)
+
+def running_cython():
+    """ Returns True if the calling thread is running the Cython compiler (see run_cython).
+        The compiler imports some of its modules while it runs; import hooks should leave those imports alone. """
+    return cython_thread == thread.get_ident()
+
+def run_cython(filename, c_filename, mode=SHARED_LIBRARY, version='2'):
+    """ usage: run_cython(filename, c_filename, mode=SHARED_LIBRARY, version='2') => (number of errors, error output)
+
+        Converts the python file filename to the C file c_filename with the Cython compiler, without starting a cython process.
+        As with the cython command, the module is named after the package that filename is in, and .pxd files are found relative to the package.
+        mode should be SHARED_LIBRARY or EXECUTABLE; executables get a main function that embeds the python interpreter.
+
+        Cython is imported the first time it is used and stays loaded. Each file is compiled with a new compiler context, because cython caches the declarations of the modules it has seen in the context.
+        The compiler keeps its state in module globals, so only one thread runs it at a time. The errors and warnings it writes to stderr are returned instead. """
+    global cython_thread
+    with CYTHON_LOCK:
+        cython_thread = thread.get_ident()
+        stderr = sys.stderr
+        sys.stderr = thread_output = Thread_Output(stderr)
+        try:
+            from Cython.Compiler import Main, Options
+            embed = Options.embed
+            Options.embed = "main" if mode == EXECUTABLE else None
+            try:
+                options = Main.CompilationOptions(Main.default_options, output_file=c_filename,
+                                                  language_level=int(version))
+                errors = Main.run_pipeline(filename, options).num_errors
+            finally:
+                Options.embed = embed
+        except Exception:
+            thread_output.output.write(traceback.format_exc())
+            errors = 1
+        finally:
+            sys.stderr = stderr
+            cython_thread = None
+    return errors, thread_output.output.getvalue()
+
+def init_name(filename):
+    """ usage: init_name(filename) => str
+
+        Returns the name that cython gives the module initialization function (without the init prefix) of the .py file indicated by filename.
+        This is the module name, or the name of the package directory for an __init__.py file. """
+    name = os.path.splitext(os.path.basename(filename))[0]
+    if name == "__init__":
+        name = os.path.basename(os.path.dirname(os.path.abspath(filename)))
+    return name
+
+def convert_to_pyx(file_list, declarations=None, stats=None):
+    """ usage: convert_to_pyx(file_list, declarations=None, stats=None) => list of (.py file name, source file name, .c file name)
+
+        prepares a list of .py files for cython.
         file_list should be a list of strings of python source files.
+        declarations is an optional list with an augmenting .pxd file name (or None) for each file in file_list. A .pxd file next to a source file (e.g. module.pxd for module.py) is used when no other declarations are supplied for it.
 
-        The "conversion" process consists of making a copy of the supplied file with a .pyx file extension."""
+        Each file is given its own temporary directory, which its .c file is written to. The .c file keeps the name of the module, so that the compiled file is named correctly.
+        Files are compiled where they are, as pure python: names that are reserved in .pyx syntax (such as include, const, signed or double) remain ordinary identifiers, and the module keeps the attribute and keyword argument names its callers use.
+        Cython only applies an augmenting .pxd file that is next to the file it declares, so a file with declarations from elsewhere is copied to the temporary directory, and the .pxd file is copied next to it.
+        The time taken is added to the pyx_seconds entry of the stats dictionary, if one is supplied."""
+    if declarations is None:
+        declarations = [None] * len(file_list)
+    start = timeit.default_timer()
     pyx_files = []
-    for filename in file_list:
-        extension = os.path.splitext(filename)[-1]
+    for filename, pxd_filename in zip(file_list, declarations):
+        name, extension = os.path.splitext(os.path.basename(filename))
         if extension != ".py":
             raise Pyx_Conversion_Error("Cannot convert non-.py file to .pyx '{}' ext {}".format(filename, extension))
-        with open(filename, 'r') as py_file:#, open(pyx_filename, 'w') as pyx_file:
-            pyx_file = tempfile.NamedTemporaryFile(suffix=".pyx")
-            pyx_file.write(py_file.read())
-            pyx_file.flush()
-            pyx_files.append((filename, pyx_file))
+        directory = tempfile.mkdtemp(prefix=TEMPORARY_PREFIX)
+        if name == "__init__": # cython names a package after the directory its __init__ lives in
+            directory = os.path.join(directory, init_name(filename))
+            os.mkdir(directory)
+        source_filename = filename
+        if pxd_filename is not None and (os.path.abspath(pxd_filename) !=
+                                         os.path.abspath(os.path.splitext(filename)[0] + ".pxd")):
+            shutil.copyfile(pxd_filename, os.path.join(directory, name + ".pxd"))
+            source_filename = os.path.join(directory, name + ".py")
+            shutil.copyfile(filename, source_filename)
+        pyx_files.append((filename, source_filename, os.path.join(directory, name + ".c")))
+    add_stat(stats, "pyx_seconds", timeit.default_timer() - start)
     return pyx_files
 
-def convert_to_c(pyx_files, mode, version='2', verbosity=0):
-    """ usage: convert_to_c(file_names, mode, version='2', verbosity=0) => list of .c file names
+def temporary_directory(filename):
+    """ usage: temporary_directory(filename) => directory name
+
+        Returns the temporary directory created by convert_to_pyx that contains filename. """
+    directory = os.path.dirname(filename)
+    if os.path.splitext(os.path.basename(filename))[0] == "__init__":
+        directory = os.path.dirname(directory)
+    return directory
 
-        Converts .pyx files to .c files via cython.
-        file_names should be a list of strings of .pyx file names
+def remove_temporary_files(filename):
+    """ usage: remove_temporary_files(filename) => None
+
+        Removes the temporary directory created by convert_to_pyx that contains filename. """
+    shutil.rmtree(temporary_directory(filename), ignore_errors=True)
+
+def convert_to_c(pyx_files, mode, version='2', verbosity=0, stats=None):
+    """ usage: convert_to_c(file_names, mode, version='2', verbosity=0, stats=None) => list of .c file names
+
+        Converts python files to .c files via cython (see run_cython).
+        file_names should be a list of (.py file name, source file name, .c file name) entries, as returned by convert_to_pyx
         mode should be SHARED_LIBRARY or EXECUTABLE
         version should be either '2' or '3' for python 2 or 3. Defaults to '2'.
-        verbosity should be 0 or 2. 0 is silent, 2 prints filenames as they are converted and any compilation errors. Defaults to 0."""
-    cross_compile = "cython {} --embed" if mode == 'exe' else "cython {}"
-    cross_compile += " -{}".format(version)
+        verbosity should be 0 or 2. 0 is silent, 2 prints filenames as they are converted and any compilation errors. Defaults to 0.
+        The error output of cython is available as the output attribute of the Cython_Conversion_Error raised when a file fails to convert.
+        stats is an optional dictionary; the time spent in cython and the size of the generated C code are added to its cython_seconds and c_size entries."""
     c_files = []
+    for py_filename, filename, c_file in pyx_files:
+        start = timeit.default_timer()
+        errors, output = run_cython(filename, c_file, mode, version)
+        add_stat(stats, "cython_seconds", timeit.default_timer() - start)
+        if verbosity > 1 and output:
+            sys.stderr.write(output)
 
-    for py_filename, pyx_file in pyx_files:
-        filename = pyx_file.name
-        command = cross_compile.format(pyx_file.name)
-
-        if verbosity < 2:
-            temp = tempfile.NamedTemporaryFile()
-            command += " 2> {}".format(temp.name)
-        error_code = os.system(command)
-        if verbosity < 2:
-            temp.close()
-
-        assert filename[-3:] == 'pyx'
-        pyx_file.close() # deletes temporary file
-        if error_code > 0:
-            c_file = os.path.splitext(filename)[0] + ".c"
-            os.remove(c_file)
-            raise Cython_Conversion_Error("Failed to process '{}'".format(py_filename))
+        if filename != py_filename:
+            os.remove(filename)
+        if errors or not os.path.isfile(c_file):
+            remove_temporary_files(c_file)
+            raise Cython_Conversion_Error("Failed to process '{}'".format(py_filename), output)
         else:
-            c_file =  os.path.splitext(filename)[0] + '.c'
+            add_stat(stats, "c_size", os.path.getsize(c_file))
             c_files.append((py_filename, c_file))
             if verbosity > 1:
                 print "{} cross compiled successfully to {}".format(py_filename, c_file)
     return c_files
 
+def normalize_c(source):
+    """ usage: normalize_c(source) => str
+
+        Returns the C code in source without comments, trailing whitespace and blank lines.
+        Cython quotes the python source in comments, so editing python comments or whitespace (without moving code to other lines) produces the same normalized C. """
+    source = C_COMMENTS_AND_STRINGS.sub(lambda match: match.group(0) if match.group(0)[0] in "\"'" else ' ', source)
+    return '\n'.join(line.rstrip() for line in source.splitlines() if line.strip())
+
+def object_cache_key(c_source, compile_command):
+    """ usage: object_cache_key(c_source, compile_command) => str
+
+        Returns the key that the compiled version of c_source is stored under in an object cache. """
+    return hashlib.sha256(normalize_c(c_source) + '\0' + compile_command).hexdigest()
+
+def update_object_cache_stats(object_cache, hits=0, misses=0, compile_seconds=0.0, seconds_saved=0.0):
+    """ Adds to the hit/miss counts and compiler timings recorded in the stats file of object_cache. """
+    stats_file = os.path.join(object_cache, "stats")
+    with _filelock.File_Lock(stats_file + ".lock"):
+        stats = object_cache_stats(object_cache)
+        stats["hits"] += hits
+        stats["misses"] += misses
+        stats["compile_seconds"] += compile_seconds
+        stats["seconds_saved"] += seconds_saved
+        with open(stats_file + ".tmp", 'w') as _file:
+            json.dump(stats, _file)
+        if os.name == "nt" and os.path.exists(stats_file):
+            os.remove(stats_file)
+        os.rename(stats_file + ".tmp", stats_file)
+
+def object_cache_stats(object_cache):
+    """ usage: object_cache_stats(object_cache) => dict
+
+        Returns the statistics recorded for the object cache in the directory object_cache:
+
+            - hits: the number of times the compiler was not run because the normalized C was in the cache
+            - misses: the number of times the compiler was run
+            - compile_seconds: the total time spent in the compiler on misses
+            - seconds_saved: the total compiler time that hits avoided (the time the cached entries originally took)"""
+    try:
+        with open(os.path.join(object_cache, "stats"), 'r') as _file:
+            return json.load(_file)
+    except (IOError, ValueError):
+        return {"hits" : 0, "misses" : 0, "compile_seconds" : 0.0, "seconds_saved" : 0.0}
+
+def compile_mode(mode):
+    """ Returns the end of a compile command for mode: the file extension of the output file, followed by -shared for shared libraries. """
+    return mode if mode == EXECUTABLE else mode + " -shared"
+
 def ccompile(file_list, output_names, mode=SHARED_LIBRARY, verbosity=0,
-             compile_command=COMPILE_COMMAND):
+             compile_command=COMPILE_COMMAND, object_cache=None, stats=None):
     """ usage: ccompile(file_list, output_names, mode=SHARED_LIBRARY, verbosity=0,
-                        compile_command=COMPILE_COMMAND) => list of file names
+                        compile_command=COMPILE_COMMAND, object_cache=None,
+                        stats=None) => list of file names
 
         Compiles .c files into .so/.pyd/.exe files via `gcc`.
         file_list should be a list of .c file names
-        output_names should be a list of file names, or a list of None of the same length as file_list to name the compiled files after the .c files.
+        output_names should be a list of file names, or a list of None of the same length as file_list to name the compiled files after the .py files.
         mode should be set to SHARED_LIBRARY or EXECUTABLE to compile. Defaults to SHARED_LIBRARY
         verbosity should be set to 0 or 2. 0 is silent, 2 prints filenames as they are compiled. Defaults to 0.
-        compile_command is the command string to invoke gcc. Defaults to COMPILE_COMMAND. Alternative command strings should accept two format insertions for the source/output file names. The source file that is inserted will include the .c file extension, while the output file that is inserted must not, as it is dynamically determined by the program."""
+        compile_command is the command string to invoke gcc. Defaults to COMPILE_COMMAND. Alternative command strings should accept two format insertions for the source/output file names. The source file that is inserted will include the .c file extension, while the output file that is inserted must not, as it is dynamically determined by the program.
+        object_cache is an optional directory for caching compiled files by their normalized C code (see normalize_c) and compile command. When the same translation unit is compiled again, the cached file is copied instead of running the compiler. Hits and misses are counted in the cache (see object_cache_stats). Defaults to None, which disables the cache.
+        stats is an optional dictionary; the time spent in the compiler, the number of object cache hits and the size of the compiled files are added to its gcc_seconds, object_cache_hits and library_size entries."""
 
     if len(file_list) != len(output_names):
         raise ValueError("file_list ({}) and output_names ({}) must be same length".format(len(file_list), len(output_names)))
 
-    compile_mode = (mode + " -shared") if mode in ('pyd', 'so') else mode
-    compile_command = compile_command + compile_mode
+    compile_command = compile_command + compile_mode(mode)
 
     compiled = []
     for filenames, output_filename in zip(file_list, output_names):
         py_filename, filename = filenames
-        if verbosity > 1:
-            print("Compiling: {} ({})".format(filename, py_filename))
         if output_filename is None:
-            output_filename = os.path.splitext(filename)[0]
+            output_filename = os.path.splitext(py_filename)[0]
+        output_file = "{}.{}".format(output_filename, mode)
+
+        if object_cache is not None:
+            with open(filename, 'r') as c_file:
+                c_source = c_file.read()
+            directory_name = os.path.basename(temporary_directory(filename))
+            if directory_name.startswith(TEMPORARY_PREFIX): # cython embeds the (random) path of a copied file for tracebacks
+                c_source = c_source.replace(directory_name, TEMPORARY_PREFIX)
+            key = object_cache_key(c_source, compile_command)
+            cached_file = os.path.join(object_cache, key[:2], "{}.{}".format(key, mode))
+            if os.path.isfile(cached_file):
+                if verbosity > 1:
+                    print("Using cached object for: {} ({})".format(filename, py_filename))
+                remove_temporary_files(filename)
+                shutil.copy2(cached_file, output_file)
+                with open(cached_file + ".time", 'r') as _file:
+                    update_object_cache_stats(object_cache, hits=1, seconds_saved=float(_file.read()))
+                add_stat(stats, "object_cache_hits", 1)
+                add_stat(stats, "library_size", os.path.getsize(output_file))
+                compiled.append(output_file)
+                continue
 
-        error_code = os.system(compile_command.format(filename, output_filename))
+        if verbosity > 1:
+            print("Compiling: {} ({})".format(filename, py_filename))
+        start = timeit.default_timer()
+        error_code, output = run_command(compile_command.format(filename, output_filename), verbosity)
+        compile_seconds = timeit.default_timer() - start
+        add_stat(stats, "gcc_seconds", compile_seconds)
         assert filename[-1] == 'c'
-        os.remove(filename)
+        remove_temporary_files(filename)
         if error_code > 0:
-            raise Compilation_Error("Failed to compile '{}'".format(py_filename))
+            raise Compilation_Error("Failed to compile '{}'".format(py_filename), output)
         else:
             if verbosity > 1:
                 print "{} was compiled successfully".format(py_filename)
-            compiled.append("{}.{}".format(output_filename, mode))
+            add_stat(stats, "library_size", os.path.getsize(output_file))
+            if object_cache is not None:
+                store_object(output_file, cached_file, compile_seconds)
+                update_object_cache_stats(object_cache, misses=1, compile_seconds=compile_seconds)
+            compiled.append(output_file)
+    return compiled
+
+def store_object(compiled_file, cached_file, compile_seconds):
+    """ Copies compiled_file into an object cache as cached_file, along with the time it took to compile.
+        The copy is renamed into place, so other processes never see a partial file. """
+    _artifacts.make_directory(os.path.dirname(cached_file))
+    temporary_file = "{}.{}.tmp".format(cached_file, os.getpid())
+    with open(temporary_file + ".time", 'w') as _file:
+        _file.write(repr(compile_seconds))
+    shutil.copy2(compiled_file, temporary_file)
+    for suffix in (".time", ''):
+        if os.name == "nt" and os.path.exists(cached_file + suffix):
+            os.remove(cached_file + suffix)
+        os.rename(temporary_file + suffix, cached_file + suffix)
+
+def pgo_compile(c_files, output_names, mode, verbosity, compile_command, training_command,
+                training_environment=None, stats=None):
+    """ usage: pgo_compile(c_files, output_names, mode, verbosity, compile_command, training_command,
+                           training_environment=None, stats=None) => list of file names
+
+        Compiles .c files with profile guided optimization.
+        c_files should be a list of (.py file name, .c file name) pairs, as returned by convert_to_c. output_names should be a list of output file names (without the file extension).
+
+        The files are first compiled with instrumentation (-fprofile-generate) to their output names. training_command is then run in a shell, with the variables in the training_environment dictionary added to its environment, and should exercise the compiled files the way they will be used. Finally the files are compiled again to the same names, using the recorded profile (-fprofile-use).
+        Compilation_Error is raised if the compiler or the training command fails.
+        stats is an optional dictionary; the time spent in the compiler (both stages), the time spent in the training command and the size of the compiled files are added to its gcc_seconds, training_seconds and library_size entries."""
+    profile_dir = tempfile.mkdtemp(prefix=TEMPORARY_PREFIX)
+    command = compile_command + compile_mode(mode)
+    try:
+        for stage in (PGO_GENERATE, PGO_USE):
+            for (py_filename, filename), output_name in zip(c_files, output_names):
+                if verbosity > 1:
+                    print("Compiling ({}): {} ({})".format(stage.split('=')[0].strip(), filename, py_filename))
+                start = timeit.default_timer()
+                error_code, output = run_command((command + stage.format(profile_dir)).format(filename, output_name),
+                                                 verbosity)
+                add_stat(stats, "gcc_seconds", timeit.default_timer() - start)
+                if error_code > 0:
+                    raise Compilation_Error("Failed to compile '{}'".format(py_filename), output)
+            if stage == PGO_GENERATE:
+                if verbosity > 1:
+                    print("Running training command: {}".format(training_command))
+                environment = dict(os.environ)
+                environment.update(training_environment or dict())
+                start = timeit.default_timer()
+                error_code = subprocess.call(training_command, shell=True, env=environment)
+                add_stat(stats, "training_seconds", timeit.default_timer() - start)
+                if error_code != 0:
+                    raise Compilation_Error("Training command failed: '{}'".format(training_command))
+    finally:
+        for py_filename, filename in c_files:
+            remove_temporary_files(filename)
+        shutil.rmtree(profile_dir, ignore_errors=True)
+    compiled = ["{}.{}".format(output_name, mode) for output_name in output_names]
+    for filename in compiled:
+        add_stat(stats, "library_size", os.path.getsize(filename))
+    return compiled
+
+def compile_bundle(file_list, output_name, version='2', verbosity=0, compile_command=COMPILE_COMMAND,
+                   declarations=None, stats=None):
+    """ usage: compile_bundle(file_list, output_name, version='2', verbosity=0,
+                              compile_command=COMPILE_COMMAND, declarations=None,
+                              stats=None) => compiled file name
+
+        Compiles the .py files in file_list (e.g. every module of a package) into a single shared library named output_name (without the file extension).
+        The library contains the initialization function of every module, so one library can be loaded as any of them (see _bundleimporter.Bundle_Importer). The library is opened and mapped once, however many of its modules are imported.
+
+        The initialization functions are named after the modules, without their packages, so the modules must have unique names (see init_name); ValueError is raised otherwise.
+        declarations is an optional list of augmenting .pxd files (see convert_to_pyx).
+        stats is an optional dictionary that the time taken by each stage and the sizes of the generated and compiled files are added to (see cross_compile)."""
+    names = [init_name(filename) for filename in file_list]
+    duplicates = sorted(set(name for name in names if names.count(name) > 1))
+    if duplicates:
+        raise ValueError("Modules in a bundle must have unique names: {}".format(', '.join(duplicates)))
+    pyx_files = convert_to_pyx(file_list, declarations, stats)
+    try:
+        c_files = convert_to_c(pyx_files, SHARED_LIBRARY, version, verbosity, stats)
+    except Cython_Conversion_Error:
+        for py_filename, filename, c_file in pyx_files:
+            remove_temporary_files(c_file) # the .c file and any copied source are in the temporary directory
+        raise
+    if verbosity > 1:
+        print("Compiling bundle: {} ({} modules)".format(output_name, len(c_files)))
+    command = compile_command + compile_mode(SHARED_LIBRARY)
+    start = timeit.default_timer()
+    error_code, output = run_command(command.format(' '.join(filename for py_filename, filename in c_files), output_name),
+                                     verbosity)
+    add_stat(stats, "gcc_seconds", timeit.default_timer() - start)
+    for py_filename, filename in c_files:
+        remove_temporary_files(filename)
+    if error_code > 0:
+        raise Compilation_Error("Failed to compile bundle '{}'".format(output_name), output)
+    compiled = "{}.{}".format(output_name, SHARED_LIBRARY)
+    add_stat(stats, "library_size", os.path.getsize(compiled))
     return compiled
 
 def cross_compile(file_list, output_names, mode=SHARED_LIBRARY, version='2', verbosity=0,
-                  compile_command=COMPILE_COMMAND):
+                  compile_command=COMPILE_COMMAND, jobs=1, object_cache=None, bundle=None,
+                  declarations=None, build_profile=None, training_command=None, training_environment=None,
+                  stats=None):
     """ usage: cross_compile(file_list, output_names, mode=_compile.SHARED_LIBRARY,
-                             version='2', verbosity=0
-                             compile_command=_compile.COMPILE_COMMAND) => list of compiled file names
+                             version='2', verbosity=0,
+                             compile_command=_compile.COMPILE_COMMAND, jobs=1,
+                             object_cache=None, bundle=None,
+                             declarations=None, build_profile=None, training_command=None,
+                             training_environment=None, stats=None) => list of compiled file names
 
         Cross compiles the .py files specified in file_list to compiled binaries.
         file_list is a list of strings indicating the files to be converted, with the .py file extension
@@ -128,13 +506,97 @@ def cross_compile(file_list, output_names, mode=SHARED_LIBRARY, version='2', ver
         version is optional, and should be a string set to either '2' or '3' to instruct cython that the correct python version is 2 or 3. Default is '2'
         verbosity is optional, and should be set to either 0 or 2; 0 is quiet mode with no output, while 2 provides step-by-step indication of the compilation process. verbosity=1 is reserved for the Import_Hook object. Default is 0
         compile_command is optional, and should be set to a string with 2 format/insertion points that runs a compiler (e.g. gcc) with any relevant flags/switches. The first insertion should be for the file name (something.c), and the second insertion point should be for the executable/library name, *without* the file extension (that will be inserted automatically)
+        jobs is optional, and should be set to the number of worker processes used to run cython and the compiler. Each file goes through the whole pipeline in one worker. 0 uses one worker per CPU. Default is 1, which compiles the files one at a time in the current process
+        object_cache is optional, and should be set to a directory to reuse compiled files when cython generates the same C code again (see ccompile). Default is None, which always runs the compiler
+        bundle is optional, and should be set to a file name (without the file extension) to compile every file in file_list into that one shared library (see compile_bundle). output_names, mode, jobs, object_cache and training_command are not used for bundles, and a list containing the name of the bundle is returned. Default is None, which compiles each file separately
+        declarations is optional, and should be set to a list of equivalent length of file_list with an augmenting .pxd file name (or None) for each file, e.g. as generated by type tracing. A .pxd file next to a source file is used when the entry is None. Default is None
+        build_profile is optional, and should be set to the name of a build profile (one of BUILD_PROFILES: "debug", "default", "fast", "native" or "pgo") to compile with the command from build_command(build_profile) instead of compile_command. Default is None, which uses compile_command
+        training_command is optional, and should be set to a shell command that runs a representative workload with the compiled files. When it is set, the files are compiled with profile guided optimization (see pgo_compile): compiled with instrumentation to their output names, trained by running training_command, and compiled again with the recorded profile. The "pgo" profile requires a training_command. jobs and object_cache are not used for profile guided optimization. Default is None
+        training_environment is optional, and should be set to a dictionary of environment variables to set for training_command. Default is None
+        stats is optional, and should be set to a dictionary that the cost of the compilation is added to, with an entry for each of COMPILE_STATS that applies: the seconds spent copying the source files (pyx_seconds), in cython (cython_seconds), in the compiler (gcc_seconds) and in the training command (training_seconds), the size in bytes of the generated C code (c_size) and of the compiled files (library_size), and the number of files taken from the object cache (object_cache_hits). The entries are totals over file_list. Default is None
+
+        The compiled file names are returned in the same order as file_list, regardless of the value of jobs.
+        If any file fails to compile, the files that have not started compiling yet are skipped, and the Cython_Conversion_Error or Compilation_Error of the first file (in file_list order) that failed is raised.
 
         examples:
 
             cross_compile(["packagehead.py", "library.py"], [None, None],
                           mode=pythonjit.SHARED_LIBRARY, version='3', verbosity=2)
 
-            cross_compile(["main.py"], ["myapp"], mode=pythonjit.EXECUTABLE)"""
-    pyx_files = convert_to_pyx(file_list)
-    c_files = convert_to_c(pyx_files, mode, version, verbosity)
-    return ccompile(c_files, output_names, mode, verbosity)
+            cross_compile(["main.py"], ["myapp"], mode=pythonjit.EXECUTABLE)
+
+            cross_compile(file_list, [None] * len(file_list), jobs=0)
+
+            cross_compile(package_files, [None] * len(package_files), bundle="package")
+
+            cross_compile(["numeric.py"], [None], build_profile="pgo", training_command="python benchmark.py")"""
+    if len(file_list) != len(output_names):
+        raise ValueError("file_list ({}) and output_names ({}) must be same length".format(len(file_list), len(output_names)))
+    if declarations is None:
+        declarations = [None] * len(file_list)
+    if build_profile is not None:
+        compile_command = build_command(build_profile)
+        if build_profile == "pgo" and not training_command:
+            raise ValueError("The pgo build profile requires a training_command")
+    if training_command and bundle is None:
+        output_names = [output_name or os.path.splitext(filename)[0] for
+                        filename, output_name in zip(file_list, output_names)]
+        c_files = convert_to_c(convert_to_pyx(file_list, declarations, stats), mode, version, verbosity, stats)
+        return pgo_compile(c_files, output_names, mode, verbosity, compile_command, training_command,
+                           training_environment, stats)
+    if bundle is not None:
+        return [compile_bundle(file_list, bundle, version, verbosity, compile_command, declarations, stats)]
+    if jobs < 1:
+        jobs = multiprocessing.cpu_count()
+    jobs = min(jobs, len(file_list))
+    if jobs < 2:
+        pyx_files = convert_to_pyx(file_list, declarations, stats)
+        c_files = convert_to_c(pyx_files, mode, version, verbosity, stats)
+        return ccompile(c_files, output_names, mode, verbosity, compile_command, object_cache, stats)
+
+    arguments = [(filename, output_name, mode, version, verbosity, compile_command, object_cache, pxd_filename) for
+                 filename, output_name, pxd_filename in zip(file_list, output_names, declarations)]
+    failed = multiprocessing.Event()
+    pool = multiprocessing.Pool(jobs, _start_worker, (failed, ))
+    try:
+        results = list(pool.imap(_cross_compile_file, arguments)) # imap preserves the input order
+    except Exception:
+        pool.close() # the workers finish (and clean up) the files they are compiling, and skip the rest
+        raise
+    except:
+        pool.terminate()
+        raise
+    else:
+        pool.close()
+    finally:
+        pool.join()
+    for compiled_file, file_stats in results:
+        for name, value in file_stats.items():
+            add_stat(stats, name, value)
+    return [compiled_file for compiled_file, file_stats in results]
+
+def _start_worker(failed):
+    """ Keeps the event that the worker processes of cross_compile set when a file fails to compile. """
+    global worker_failed
+    worker_failed = failed
+
+def _cross_compile_file(arguments):
+    """ Runs the pyx/cython/compiler pipeline for a single file. Used by the worker processes of cross_compile.
+        Returns the compiled file name and the stats of the compilation, or (None, {}) without compiling once a file has failed to compile in any worker.
+        The temporary files of the file are removed whether or not it compiles. """
+    if worker_failed is not None and worker_failed.is_set():
+        return None, dict()
+    filename, output_name, mode, version, verbosity, compile_command, object_cache, pxd_filename = arguments
+    stats = dict()
+    pyx_files = []
+    try:
+        pyx_files = convert_to_pyx([filename], [pxd_filename], stats)
+        c_files = convert_to_c(pyx_files, mode, version, verbosity, stats)
+        return ccompile(c_files, [output_name], mode, verbosity, compile_command, object_cache, stats)[0], stats
+    except:
+        if worker_failed is not None:
+            worker_failed.set()
+        raise
+    finally:
+        for py_filename, source_filename, c_file in pyx_files:
+            remove_temporary_files(c_file)
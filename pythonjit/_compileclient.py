@@ -0,0 +1,76 @@
+""" The client side of the compile server (see `compileserver.py`).
+
+An `Import_Hook` that is given the socket of a compile server asks the server for the compiled version of a module instead of running cython and the compiler itself. Requests and replies are single lines of JSON, sent over a Unix domain socket, one request per connection.
+
+A request names the module, its source file, the build key the hook expects, the python version and the name of a build profile (see _compile.BUILD_PROFILES). The server compiles with its own command for that profile, and never runs a command supplied by the client; modules built with a custom compile command or with profile guided optimization (which runs a training command) are compiled by the hook itself. The server computes the build key from the source file as it is when the server reads it, builds the artifact if its Artifact_Store does not have it yet, and replies with:
+
+    - artifact_key: the build key the server computed
+    - artifact: the file name of the artifact in the server's Artifact_Store, if it was built
+    - error, stage and output: the message, stage ("cython" or "compiler") and error output of a failed compilation
+
+This module is a utility used by the library, and is not intended to be used in any other capacity."""
+import os
+import json
+import socket
+
+import pythonjit._compile
+
+__all__ = ("SOCKET_PATH", "CONNECT_TIMEOUT", "REPLY_TIMEOUT", "Compile_Client")
+
+SOCKET_PATH = os.path.join(os.path.expanduser("~"), "pythonjit", "compileserver.sock")
+CONNECT_TIMEOUT = 5.0 # seconds to connect and send a request
+REPLY_TIMEOUT = 600.0 # seconds to wait for a reply, which includes the compilation
+
+class Compile_Client(object):
+    """ usage: Compile_Client(socket_path=SOCKET_PATH, version='2', build_profile=_compile.DEFAULT_PROFILE,
+                              connect_timeout=CONNECT_TIMEOUT, reply_timeout=REPLY_TIMEOUT) => compile_client
+
+        Requests compiled modules from the compile server listening on socket_path.
+        version and build_profile (the name of one of _compile.BUILD_PROFILES, other than "pgo") are the build configuration that modules are compiled with.
+        socket.timeout is raised if the server does not accept a request within connect_timeout seconds, or does not reply within reply_timeout seconds. """
+
+    def __init__(self, socket_path=SOCKET_PATH, version='2', build_profile=pythonjit._compile.DEFAULT_PROFILE,
+                 connect_timeout=CONNECT_TIMEOUT, reply_timeout=REPLY_TIMEOUT):
+        self.socket_path = socket_path
+        self.version = version
+        self.build_profile = build_profile
+        self.connect_timeout = connect_timeout
+        self.reply_timeout = reply_timeout
+
+    def request(self, message):
+        """ usage: request(message) => dict
+
+            Sends the dictionary message to the server and returns its reply.
+            Raises socket.error if the server cannot be reached or closes the connection without replying, and socket.timeout if it does not answer in time. """
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            connection.settimeout(self.connect_timeout)
+            connection.connect(self.socket_path)
+            connection.sendall(json.dumps(message) + '\n')
+            connection.settimeout(self.reply_timeout)
+            line = connection.makefile('rb').readline()
+        finally:
+            connection.close()
+        if not line:
+            raise socket.error("The compile server at {} closed the connection".format(self.socket_path))
+        return json.loads(line)
+
+    def request_artifact(self, module_name, _path, artifact_key, declarations=None):
+        """ usage: request_artifact(module_name, _path, artifact_key, declarations=None) => artifact file name or None
+
+            Asks the server for the compiled version of the python file indicated by _path, which the hook stores under artifact_key.
+            declarations is an augmenting .pxd file to compile the module with, or None.
+
+            Returns the file name of the artifact in the server's Artifact_Store, or None if the server computed a different build key (e.g. because the source file changed after it was hashed) or could not build it.
+            Raises Cython_Conversion_Error or Compilation_Error if the module fails to compile, and socket.error if the server cannot be reached. """
+        reply = self.request({"module_name" : module_name, "source_file" : os.path.abspath(_path),
+                              "artifact_key" : artifact_key,
+                              "declarations" : os.path.abspath(declarations) if declarations else None,
+                              "version" : str(self.version), "build_profile" : self.build_profile})
+        if "error" in reply:
+            error_type = (pythonjit._compile.Cython_Conversion_Error if reply["stage"] == "cython" else
+                          pythonjit._compile.Compilation_Error)
+            raise error_type(reply["error"], reply["output"])
+        if reply.get("artifact_key") != artifact_key:
+            return None
+        return reply.get("artifact")
@@ -2,113 +2,765 @@
 
 This is not a public facing module; Users of pythonjit should use `pythonjit.enable` to automatically compile imported modules, or use the `compile.py` program or `pythonjit.cross_compile` function to compile modules without importing them in python (e.g. in order to distribute them).
 
-The `Import_Hook` class inserts itself into `sys.meta_path` when instantiated. When `import` statements are used, `Import_Hook` has the opportunity to locate the file to be imported. It uses this opportunity to locate the .py source code file for the module (if available), and uses `_compile.cross_compile` to compile it to a static library.
+The `Import_Hook` class inserts itself into `sys.meta_path` when instantiated. When `import` statements are used, `Import_Hook` has the opportunity to locate the file to be imported. It uses this opportunity to locate the .py source code file for the module (if available), and uses `_compile.cross_compile` to compile it to a shared library.
 
-After that, its job is done; It passes the responsibility to find and load modules to the next or default finder/loader. That finder/loader will find the compiled version of the imported module, which will be used instead of the source code version of the module."""
+When the compiled version of the module is up to date, `Import_Hook` returns a loader that loads it from its file in code_dir (`_bundleimporter.Bundle_Importer`, which also loads the modules of packages that are compiled into a bundle). Otherwise it passes the responsibility to find and load the module to the next or default finder/loader, which imports the source code version of the module."""
 import imp
+import re
 import sys
 import hashlib
 import os
-import errno
+import time
+import atexit
+import itertools
+import timeit
+import thread
+import socket
+import threading
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 
 import pythonjit._compile
 import pythonjit._database
+import pythonjit._artifacts
+import pythonjit._filelock
+import pythonjit._bundleimporter
+import pythonjit._compileclient
+import pythonjit._cachebundle
+import pythonjit._dependencies
+import pythonjit._pathcache
+import pythonjit._profiler
+import pythonjit._typetrace
 
-__all__ = ["Import_Hook", "DEFAULT_DB"]
+__all__ = ["Import_Hook", "DEFAULT_DB", "usage_policy", "compile_stats", "compile_failures", "file_digest",
+           "export_cache_bundle", "collect_cache_garbage", "scan_dependencies"]
 
+FLUSH_INTERVAL = 10.0
+DEFERRED_IMPORTS = 1000 # imports counted before their counts are written without a compilation (see Import_Hook.flush)
 DEFAULT_DB =  os.path.join(os.path.expanduser("~"), "pythonjit", "cache.db")
 CODE_DIR = os.path.join(os.path.expanduser("~"), "pythonjit", "compiled")
+ARTIFACT_DIR = pythonjit._artifacts.ARTIFACT_DIR
+OBJECT_CACHE = os.path.join(os.path.expanduser("~"), "pythonjit", "objects")
+TYPES_DIR = pythonjit._typetrace.TYPES_DIR
+TRAINING_MODULE = "PYTHONJIT_PGO_MODULE"
+TRAINING_LIBRARY = "PYTHONJIT_PGO_LIBRARY"
+TRAINING_SOURCE = "PYTHONJIT_PGO_SOURCE"
+MODULE_NAME = re.compile(r"[A-Za-z_][A-Za-z0-9_]*$")
+GC_STAMP = ".gc" # in code_dir; locked during a garbage collection, and touched when one finishes
+GC_INTERVAL = 3600.0
+GC_GRACE_PERIOD = 3600.0
+LAST_USED_RESOLUTION = 3600.0
+# the events counted in the Cache_Counters table; see compile_stats
+CACHE_COUNTERS = ("hits", "misses", "stale", "artifact_hits", "compiles", "compile_failures",
+                  "digest_checks", "digests_computed", "digest_seconds", "dependency_scans", "hook_calls", "hook_seconds",
+                  "hook_compile_seconds", "gc_runs", "gc_bytes_reclaimed")
 
 class Import_Hook(object):
     """ This object is instantiated when pythonjit.enable is called, and inserts itself into `sys.meta_path` as the first entry when instantiated.
 
         When a module is imported, this object is tasked with finding the module. This object will find the source code for the module, and cross compile it if necessary.
 
-        This object does not participate in the module loading part of the import process. After the source file is cross compiled, it is left to other finders/loaders to load. The default loader will opt to load a compiled .so/.pyd over a .py file if it is available"""
+        Compiled files are kept in an Artifact_Store under a build key that covers the source, its dependencies and the toolchain (see build_key), and linked into code_dir. Up to date modules are loaded by bundle_importer; other modules are left to the default finders/loaders, which import the source code.
+        The cache database is read into the manifest when the hook is created; changes are buffered and written in one transaction by flush.
+
+        The keyword arguments are those of pythonjit.enable; see its documentation."""
 
     def __init__(self, version=2, verbosity=0, database_name=DEFAULT_DB,
-                 code_dir=CODE_DIR, ignore_compilation_failure=False):
+                 code_dir=CODE_DIR, ignore_compilation_failure=False,
+                 background=False, jobs=1, strict=False, flush_interval=FLUSH_INTERVAL,
+                 artifact_dir=ARTIFACT_DIR, wait_for_lock=True, object_cache=OBJECT_CACHE,
+                 bundle_packages=(), compile_policy=None, profile=False, trace_types=False,
+                 types_dir=TYPES_DIR, build_profile=pythonjit._compile.DEFAULT_PROFILE,
+                 compile_command=None, training_command=None, compile_server=None, cache_bundle=None,
+                 max_cache_size=None):
         if str(version) not in ('2', '3'):
             raise ValueError("Invalid version {}".format(version))
+        self.cache_bundle = None
+        if cache_bundle is not None:
+            self.cache_bundle = pythonjit._cachebundle.Cache_Bundle(cache_bundle, pythonjit._compile.SHARED_LIBRARY)
         sys.meta_path.insert(0, self)
         self.version = version
         self.verbosity = verbosity
         self.library_type = pythonjit._compile.SHARED_LIBRARY
         self.database = pythonjit._database.Cache_Database(database_name=database_name)
         self.code_dir = code_dir
+        self.artifacts = pythonjit._artifacts.Artifact_Store(artifact_dir)
+        if build_profile == "pgo" and not training_command:
+            raise ValueError("The pgo build profile requires a training_command")
+        self.build_profile = build_profile
+        self.compile_command = compile_command or pythonjit._compile.build_command(build_profile)
+        self.training_command = training_command if build_profile == "pgo" else None
+        self.profile_signature = pythonjit._compile.profile_signature(build_profile, self.training_command)
+        self.object_cache = object_cache
+        self.compile_client = None
+        if compile_server is not None and compile_command is None and build_profile != "pgo":
+            self.compile_client = pythonjit._compileclient.Compile_Client(compile_server, version, build_profile)
         self.ignore_compilation_failure = ignore_compilation_failure
+        self.background = background
+        self.strict = strict
+        self.wait_for_lock = wait_for_lock
+        self.jobs = jobs
+        self.bundle_packages = tuple(bundle_packages)
+        self.bundles = dict()
+        self.bundle_importer = pythonjit._bundleimporter.Bundle_Importer()
+        self.path_cache = pythonjit._pathcache.Path_Cache()
+        self.training_module = os.environ.get(TRAINING_MODULE)
+        if self.training_module is not None: # running the training command of a pgo build
+            source_file = os.environ[TRAINING_SOURCE]
+            package_path = [os.path.dirname(source_file)] if os.path.basename(source_file) == "__init__.py" else None
+            self.bundle_importer.add_module(self.training_module, os.environ[TRAINING_LIBRARY], package_path)
+        self.pool = None
+        self.pending = dict()
+        self.errors = []
+        self.flush_interval = flush_interval
+        self.manifest = self.load_manifest()
+        self.dirty = set()
+        self.dirty_dependencies = set()
+        self.failures = self.load_failures()
+        self.dirty_failures = set()
+        self.compile_policy = compile_policy
+        self.usage = self.load_usage()
+        self.dirty_usage = set()
+        self.deferred_imports = 0
+        self.counters = dict()
+        self.compile_stats = dict()
+        self.stats_lock = thread.allocate_lock()
+        self.hook_calls = 0
+        self.hook_seconds = 0.0
+        self.hook_compile_seconds = 0.0
+        self.module_overhead = dict()
+        self.flushed_overhead = (0, 0.0, 0.0)
+        self.profiler = None
+        if profile:
+            self.profiler = pythonjit._profiler.Sampling_Profiler()
+            self.profiler.start()
+        self.types_dir = types_dir
+        self.typed_modules = set()
+        if types_dir is not None and os.path.isdir(types_dir):
+            self.typed_modules.update(os.path.splitext(filename)[0] for
+                                      filename in os.listdir(types_dir) if filename.endswith(".pxd"))
+        self.tracer = None
+        if trace_types:
+            self.tracer = pythonjit._typetrace.Type_Tracer(modules=set())
+            self.tracer.start()
+        self.in_use = set()
+        self.gc_lock = thread.allocate_lock()
+        self.removed_entries = set()
+        self.max_cache_size = max_cache_size
+        self.collector = None
+        if max_cache_size is not None and collection_due(code_dir):
+            manifest = dict((module_name, dict(entry)) for module_name, entry in self.manifest.items())
+            self.collector = threading.Thread(target=self.collect_garbage, args=(manifest, ))
+            self.collector.daemon = True
+            self.collector.start()
+        self.last_flush = timeit.default_timer()
+        atexit.register(self.close)
 
     def find_module(self, module_name, path):
+        """ Finds the specified module and cross compiles it if necessary (see check_module).
+            The time taken is added to the import overhead of the hook (see import_overhead).
+            Modules imported by the Cython compiler while it compiles a module are left to the default import machinery. """
+        if pythonjit._compile.running_cython():
+            return None
+        start = timeit.default_timer()
+        try:
+            return self.check_module(module_name, path)
+        finally:
+            seconds = timeit.default_timer() - start
+            self.hook_calls += 1
+            self.hook_seconds += seconds
+            self.module_overhead[module_name] = self.module_overhead.get(module_name, 0.0) + seconds
+
+    def check_module(self, module_name, path):
         """ Finds the specified module and cross compiles it if necessary.
 
-            Uses a database to determine when source files change to determine whether the binaries should be re-compiled. """
-        modules = module_name.split('.')
-        end_of_modules = len(modules) - 1
-        for count, module in enumerate(modules):
+            Uses a database to determine when source files change to determine whether the binaries should be re-compiled.
+            Returns the loader for the module if the hook loads it (compiled modules and bundles), and None otherwise. """
+        if self.training_module is not None:
+            return self.bundle_importer.find_module(module_name, path)
+        if self.pending:
+            self.collect_compiled()
+        if self.bundle_packages:
+            package = self.find_bundle_package(module_name)
+            if package is not None:
+                if package not in self.bundles and module_name == package:
+                    start = timeit.default_timer()
+                    self.bundles[package] = self.load_bundle(package, path)
+                    self.hook_compile_seconds += timeit.default_timer() - start
+                if self.bundle_importer.find_module(module_name, path) is not None:
+                    return self.bundle_importer
+                # modules that are not in the bundle are compiled on their own
+        _path = self.path_cache.find_module(module_name.rsplit('.', 1)[-1], path)
+        if _path is None:
+            return None
+        _path = self.find_source_file(_path)
+        if _path is None:
+            return None
+        _path = os.path.abspath(_path) # recorded as the source_file, which must not depend on the working directory
+        compiled_library_exists = self.find_compiled_file(_path) is not None
+        self.record_import(module_name)
+        old_info, source_digest, signature = self.check_source(module_name, _path)
+        old_digest = old_info["source_digest"] if old_info else None
+        old_signature = source_signature_of(old_info)
+        old_source_file = old_info.get("source_file") if old_info else None # update_db replaces it in old_info
+        try_compiling = False
+        cache_result = "hits"
+        bundled_key = None
+        if self.cache_bundle is not None:
+            bundled_key = self.cache_bundle.lookup(module_name, source_digest)
+        if bundled_key is not None:
+            declarations, dependencies, artifact_key = None, [], bundled_key
+        else:
+            declarations = self.find_declarations(module_name, source_digest)
+            dependencies = self.check_dependencies(_path, old_info, declarations)
+            artifact_key = self.build_key(module_name, source_digest, declarations, dependencies)
+        old_dependencies = old_info.get("dependencies", []) if old_info else []
+        if not old_digest:
+            if self.verbosity > 1:
+                print("Old digest not found")
+            try_compiling = True
+            cache_result = "misses"
+        elif source_digest != old_digest:
+            if self.verbosity > 1:
+                print("Digest mismatch, code changed")
+            try_compiling = True
+            cache_result = "stale"
+        elif artifact_key != old_info.get("artifact_key"):
+            if self.verbosity > 1:
+                print("Dependencies changed" if [dependency[:2] for dependency in dependencies] !=
+                      [dependency[:2] for dependency in old_dependencies] else "Build configuration changed")
+            try_compiling = True
+            cache_result = "stale"
+        else:
+            if self.verbosity > 1:
+                print("Digests match")
+            if signature != old_signature or dependencies != old_dependencies: # e.g. touched; record it so the next check can skip hashing
+                self.update_db(module_name, source_digest, _path, signature, artifact_key, dependencies)
+        if not compiled_library_exists:
+            if self.verbosity > 1:
+                print("Compiled version does not exist yet")
+            try_compiling = True
+            if cache_result == "hits":
+                cache_result = "misses"
+        elif (not try_compiling and old_source_file != _path and
+              not self.is_linked(_path, artifact_key)):
+            # the manifest entry was recorded for the same module in another checkout; the compiled file for this path may be older
+            if self.verbosity > 1:
+                print("Compiled version is not the one for this source")
+            try_compiling = True
+            cache_result = "stale"
+        self.count(cache_result)
+        up_to_date = not try_compiling
+        compiled = False
+
+        if try_compiling and self.known_failure(module_name, artifact_key, defer=self.background):
+            if self.verbosity > 1:
+                print("Not compiling {}; it failed to compile before".format(module_name))
+            try_compiling = False
+
+        if try_compiling and bundled_key is None and pythonjit._artifacts.CYTHON_VERSION is None:
+            if self.verbosity > 1:
+                print("Not compiling {}; Cython is not installed".format(module_name))
+            try_compiling = False
+
+        if try_compiling and bundled_key is None and not self.should_compile(module_name):
+            if self.verbosity > 1:
+                print("Not compiling {}; it does not meet the compile policy".format(module_name))
+            try_compiling = False
+
+        if try_compiling:
+            if self.background:
+                self.compile_in_background(module_name, _path, source_digest, signature, artifact_key,
+                                           declarations, dependencies)
+            else:
+                if self.verbosity:
+                    print("{}: {}".format("Extracting from the cache bundle" if bundled_key is not None else
+                                          "Cross compiling", module_name))
+                start = timeit.default_timer()
+                try:
+                    compiled = self.cross_compile(_path, artifact_key, declarations, module_name, source_digest)
+                    if compiled:
+                        self.update_db(module_name, source_digest, _path, signature, artifact_key, dependencies)
+                finally:
+                    self.hook_compile_seconds += timeit.default_timer() - start
+
+        if up_to_date or compiled:
+            self.record_use(module_name)
+            return self.load_compiled(module_name, _path)
+        self.bundle_importer.remove_module(module_name)
+        if self.tracer is not None: # only the interpreted module can be traced
+            self.tracer.modules.add(module_name)
+        return None
+
+    def load_compiled(self, module_name, _path):
+        """ Adds the compiled file in code_dir for the python file indicated by _path to bundle_importer, and returns bundle_importer, which loads module_name from it. """
+        package_path = [os.path.dirname(_path)] if os.path.basename(_path) == "__init__.py" else None
+        self.bundle_importer.add_module(module_name, "{}.{}".format(self.get_output_path(_path), self.library_type),
+                                        package_path)
+        return self.bundle_importer
+
+    def check_source(self, module_name, _path):
+        """ usage: check_source(module_name, _path) => (old_info, source_digest, signature)
+
+            Returns the manifest entry for module_name (or None), the current digest of the source file indicated by _path and its current (mtime, size, inode) signature.
+            The file is only hashed if its signature differs from the one in the manifest, or if strict is True. """
+        start = timeit.default_timer()
+        old_info = self.lookup(module_name)
+        signature = source_signature(_path)
+        if self.verbosity > 1:
+            print("Checking digest for {}".format(module_name))
+        if (old_info and old_info["source_digest"] and signature == source_signature_of(old_info) and
+            not self.strict):
+            if self.verbosity > 1:
+                print("Source file not modified since last check")
+            source_digest = old_info["source_digest"]
+        else:
+            source_digest = self.obtain_source_digest(_path)
+            self.count("digests_computed")
+        self.count("digest_checks")
+        self.count("digest_seconds", timeit.default_timer() - start)
+        return old_info, source_digest, signature
+
+    def find_bundle_package(self, module_name):
+        """ Returns the entry of bundle_packages that module_name is (or belongs to), or None. """
+        for package in self.bundle_packages:
+            if module_name == package or module_name.startswith(package + '.'):
+                return package
+
+    def load_bundle(self, package, path):
+        """ usage: load_bundle(package, path) => list of module names, or None
+
+            Compiles the modules of package into a single shared library (see _compile.compile_bundle), unless the Artifact_Store already has it, and adds them to bundle_importer.
+            The bundle is linked into code_dir once for every module, at the path that mirrors the module's source file.
+            path is the path argument of find_module for package.
+
+            Modules whose initialization function would have the same name as that of another module in the package are left out of the bundle, and are compiled on their own when they are imported.
+            Returns the names of the modules in the bundle, or None if package is not a package with source files, or if the bundle is not in place (see cross_compile). A bundle that failed to compile before is not compiled again until one of its sources changes (see known_failure). """
+        try:
+            _file, package_dir, description = imp.find_module(package.rsplit('.', 1)[-1], path)
+        except ImportError:
+            return None
+        if _file is not None:
+            _file.close()
+        if description[2] != imp.PKG_DIRECTORY or not os.path.isfile(os.path.join(package_dir, "__init__.py")):
+            return None
+        members = []
+        init_names = set()
+        for module_name, _path in find_package_sources(package, os.path.abspath(package_dir)):
+            name = pythonjit._compile.init_name(_path)
+            if name in init_names:
+                if self.verbosity > 1:
+                    print("Leaving {} out of the {} bundle; another module is named {}".format(module_name, package, name))
+                continue
+            init_names.add(name)
+            members.append((module_name, _path) + self.check_source(module_name, _path))
+
+        digest = hashlib.sha256()
+        declarations = []
+        dependencies = dict()
+        for module_name, _path, old_info, source_digest, signature in members:
+            digest.update("{} {}\n".format(module_name, source_digest))
+            declarations.append(self.find_declarations(module_name, source_digest))
+            if declarations[-1] is not None:
+                digest.update("declarations {}\n".format(self.obtain_source_digest(declarations[-1])))
+            dependencies[module_name] = self.check_dependencies(_path, old_info, declarations[-1])
+            if dependencies[module_name]:
+                digest.update("dependencies {}\n".format(pythonjit._dependencies.dependencies_digest(dependencies[module_name])))
+        artifact_key = self.build_key(package + "[bundle]", digest.hexdigest())
+        artifact = self.artifacts.get_path(artifact_key, self.library_type)
+        if not os.path.isfile(artifact):
+            if self.known_failure(package + "[bundle]", artifact_key):
+                if self.verbosity > 1:
+                    print("Not compiling the {} bundle; it failed to compile before".format(package))
+                return None
+            if self.verbosity:
+                print("Cross compiling bundle: {} ({} modules)".format(package, len(members)))
+            stats = dict()
+            start = timeit.default_timer()
+            try:
+                built = build_artifact([member[1] for member in members], artifact, self.version,
+                                       self.verbosity, self.compile_command, wait=self.wait_for_lock,
+                                       bundle=True, declarations=declarations, stats=stats)
+            except (pythonjit._compile.Cython_Conversion_Error, pythonjit._compile.Compilation_Error) as error:
+                self.record_failure(package + "[bundle]", package_dir, digest.hexdigest(), artifact_key, error)
+                if not self.ignore_compilation_failure:
+                    raise
+                return None
+            if not built:
+                if self.verbosity:
+                    print("The {} bundle is being compiled by another process".format(package))
+                return None
+            if stats:
+                self.record_compile(package + "[bundle]", artifact_key, timeit.default_timer() - start, stats)
+            self.clear_failure(package + "[bundle]")
+        else:
+            self.count("artifact_hits")
+
+        for module_name, _path, old_info, source_digest, signature in members:
+            output_file = "{}.{}".format(self.get_output_path(_path), self.library_type)
+            if (not old_info or old_info.get("artifact_key") != artifact_key or
+                not os.path.isfile(output_file)):
+                self.artifacts.link(artifact, output_file)
+            if (not old_info or old_info.get("artifact_key") != artifact_key or
+                old_info["source_digest"] != source_digest or source_signature_of(old_info) != signature or
+                old_info.get("dependencies", []) != dependencies[module_name]):
+                self.update_db(module_name, source_digest, _path, signature, artifact_key, dependencies[module_name])
+            else:
+                self.record_use(module_name)
+            package_path = [os.path.dirname(_path)] if os.path.basename(_path) == "__init__.py" else None
+            self.bundle_importer.add_module(module_name, output_file, package_path)
+        return [member[0] for member in members]
+
+    def find_declarations(self, module_name, source_digest):
+        """ Returns the augmenting .pxd file in types_dir for module_name, or None if there is none for the source with the digest source_digest. """
+        if module_name not in self.typed_modules:
+            return None
+        return pythonjit._typetrace.find_declarations(self.types_dir, module_name, source_digest)
+
+    def check_dependencies(self, _path, old_info, declarations=None):
+        """ usage: check_dependencies(_path, old_info, declarations=None) => list of (file name, digest, signature)
+
+            Returns the files that the compiled version of the python file indicated by _path depends on (see scan_dependencies), with their digests and (mtime, size, inode) signatures.
+            old_info is the manifest entry of the module, or None. The dependencies it records are returned if none of their signatures changed, which costs a stat call per dependency. Otherwise, or if strict is True, the dependencies are found and hashed again.
+            A module without an augmenting .pxd file next to it has no dependencies, and costs no stat call. Neither does a module compiled with declarations from types_dir, which Cython uses instead of that file. """
+        pxd_file = os.path.splitext(os.path.abspath(_path))[0] + ".pxd"
+        if declarations is not None or not self.path_cache.exists(pxd_file):
+            return []
+        recorded = old_info.get("dependencies") if old_info else None
+        if recorded and not self.strict and any(dependency[0] == pxd_file for dependency in recorded):
             try:
-                _file, _path, description = imp.find_module(module, path)
-            except ImportError:
+                if all(source_signature(filename) == signature for filename, digest, signature in recorded):
+                    return recorded
+            except OSError: # a dependency was removed
                 pass
+        self.count("dependency_scans")
+        return scan_dependencies(_path)
+
+    def build_key(self, module_name, source_digest, declarations=None, dependencies=()):
+        """ Returns the key that the compiled version of module_name is stored under in the Artifact_Store.
+            declarations is the augmenting .pxd file the module is compiled with, if any.
+            dependencies is a list of (file name, digest, signature) for the files the module depends on (see check_dependencies). """
+        declarations_digest = None
+        if declarations is not None:
+            declarations_digest = self.obtain_source_digest(declarations)
+        return pythonjit._artifacts.build_key(source_digest, module_name, self.version,
+                                              self.library_type, self.compile_command,
+                                              declarations_digest, self.profile_signature,
+                                              pythonjit._dependencies.dependencies_digest(dependencies))
+
+    def import_overhead(self, count=10):
+        """ usage: import_overhead(count=10) => dict
+
+            Returns the time this hook has spent in find_module since it was created:
+
+                - imports: the number of calls to find_module
+                - seconds: the total time spent in find_module
+                - compile_seconds: the part of seconds spent compiling modules (and bundles) during imports
+                - overhead_seconds: seconds without compile_seconds; the time the hook adds to imports that do not compile anything
+                - per_import: overhead_seconds divided by imports
+                - slowest: the count modules that took the longest in find_module, as a list of (module_name, seconds) """
+        overhead_seconds = self.hook_seconds - self.hook_compile_seconds
+        slowest = sorted(self.module_overhead.items(), key=lambda item: item[1], reverse=True)[:count]
+        return {"imports" : self.hook_calls, "seconds" : self.hook_seconds,
+                "compile_seconds" : self.hook_compile_seconds, "overhead_seconds" : overhead_seconds,
+                "per_import" : overhead_seconds / self.hook_calls if self.hook_calls else 0.0,
+                "slowest" : slowest}
+
+    def load_failures(self):
+        """ Returns a dictionary of module_name : Compile_Failures entry for every row of the Compile_Failures table.
+            Each entry is a dictionary of field name : value. """
+        fields = [field.split()[0] for field in self.database.database_structure["Compile_Failures"]]
+        return dict((row[0], dict(zip(fields[1:], row[1:]))) for
+                    row in self.database.query_all("Compile_Failures", fields))
+
+    def known_failure(self, module_name, artifact_key, defer=False):
+        """ Returns True if module_name failed to compile with the build key artifact_key before, and ignore_compilation_failure is True.
+            Raises the recorded error instead if ignore_compilation_failure is False, unless defer is True: the error is then added to errors, to be raised by wait_for_compilation like the errors of background compilations, and True is returned so that the module is imported interpreted.
+            Returns False if there is no recorded failure for artifact_key. """
+        entry = self.failures.get(module_name)
+        if entry is None or entry["artifact_key"] != artifact_key:
+            return False
+        if not self.ignore_compilation_failure:
+            error_type = (pythonjit._compile.Cython_Conversion_Error if entry["stage"] == "cython" else
+                          pythonjit._compile.Compilation_Error)
+            error = error_type(entry["message"], entry["output"])
+            if not defer:
+                raise error
+            self.errors.append(error)
+        return True
+
+    def record_failure(self, module_name, _path, source_digest, artifact_key, error):
+        """ Records that module_name failed to compile with the build key artifact_key, with the Cython_Conversion_Error or Compilation_Error error.
+            Written to the Compile_Failures table by the next flush. """
+        stage = "cython" if isinstance(error, pythonjit._compile.Cython_Conversion_Error) else "compiler"
+        entry = {"artifact_key" : artifact_key, "source_file" : _path, "source_digest" : source_digest,
+                 "stage" : stage, "message" : str(error), "output" : getattr(error, "output", ''),
+                 "failed_at" : time.time()}
+        with self.stats_lock:
+            self.failures[module_name] = entry
+            self.dirty_failures.add(module_name)
+            self.counters["compile_failures"] = self.counters.get("compile_failures", 0) + 1
+
+    def clear_failure(self, module_name):
+        """ Forgets the recorded compilation failure of module_name, if any (e.g. because it compiled since). """
+        if module_name in self.failures:
+            with self.stats_lock:
+                self.failures.pop(module_name, None)
+                self.dirty_failures.add(module_name)
+
+    def count(self, name, value=1):
+        """ Adds value to the cache counter name (one of CACHE_COUNTERS). Written to the database by the next flush. """
+        with self.stats_lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def record_compile(self, module_name, artifact_key, seconds, stats):
+        """ Records the cost of compiling module_name: the total time taken in seconds, and the stats dictionary filled in by _compile.cross_compile.
+            Written to the Compile_Stats table by the next flush. """
+        row = (module_name, artifact_key, time.time(), seconds) + tuple(stats.get(name, 0) for
+                                                                      name in pythonjit._compile.COMPILE_STATS)
+        with self.stats_lock:
+            self.compile_stats[module_name] = row
+            self.counters["compiles"] = self.counters.get("compiles", 0) + 1
+
+    def compile_in_background(self, module_name, _path, source_digest, signature, artifact_key,
+                              declarations=None, dependencies=()):
+        """ Submits the python file indicated by _path to the worker pool.
+            The database is updated by collect_compiled once the compilation finishes. """
+        if module_name in self.pending:
+            return
+        if self.pool is None:
+            self.pool = ThreadPool(self.jobs)
+        if self.verbosity:
+            print("Cross compiling in background: {}".format(module_name))
+        result = self.pool.apply_async(self.cross_compile, (_path, artifact_key, declarations, module_name,
+                                                            source_digest))
+        self.pending[module_name] = (result, source_digest, _path, signature, artifact_key, dependencies)
+
+    def collect_compiled(self, block=False):
+        """ Updates the database for background compilations that have finished.
+            If block is True, waits for all pending compilations to finish first.
+
+            Failed compilations are stored in the errors attribute. """
+        for module_name, (result, source_digest, _path, signature, artifact_key, dependencies) in self.pending.items():
+            if block:
+                result.wait()
+            elif not result.ready():
+                continue
+            del self.pending[module_name]
+            try:
+                compiled = result.get()
+            except Exception as error:
+                if self.verbosity:
+                    print("Failed to compile {}: {}".format(module_name, error))
+                self.errors.append(error)
             else:
-                compiled_file = self.find_compiled_file(_path, module)
-                if compiled_file is not None:
-                    compiled_library_exists = True
-                else:
-                    compiled_library_exists = False
+                if compiled:
+                    self.update_db(module_name, source_digest, _path, signature, artifact_key, dependencies)
 
-                _path = self.find_source_file(_path)
-                if _path is None:
-                    continue
+    def wait_for_compilation(self):
+        """ Blocks until all background compilations have finished.
 
-                old_digest = self.database.query("Source_Info", retrieve_fields=("source_digest", ),
-                                                 where={"module_name" : module_name})
-                try_compiling = False
-                if self.verbosity > 1:
-                    print("Checking digest for {}".format(module_name))
-                if old_digest:
-                    source_digest = self.obtain_source_digest(_path)
-                    if source_digest != old_digest:
-                        if self.verbosity > 1:
-                            print("Digest mismatch, code changed")
-                        try_compiling = True
-                    elif self.verbosity > 1:
-                        print("Digests match")
-                else:
-                    if self.verbosity > 1:
-                        print("Old digest not found")
-                    try_compiling = True
-                    source_digest = self.obtain_source_digest(_path)
-                if not compiled_library_exists:
-                    if self.verbosity > 1:
-                        print("Compiled version does not exist yet")
-                    try_compiling = True
-
-                if count == end_of_modules and try_compiling:
-                    if self.verbosity:
-                        print("Cross compiling: {}".format(module_name))
-                    self.cross_compile(_path)
-                    self.update_db(module_name, source_digest, old_digest, _path)
+            Raises the first error encountered by a background compilation unless ignore_compilation_failure is True. """
+        self.collect_compiled(block=True)
+        errors, self.errors = self.errors, []
+        if errors and not self.ignore_compilation_failure:
+            raise errors[0]
 
     def obtain_source_digest(self, _path):
-        """ Returns a hash of the file indicated by _path """
-        with open(_path, 'r') as py_file:
-            source = py_file.read()
-        return hashlib.sha256(source).hexdigest()
-
-    def update_db(self, module_name, source_digest, old_digest, path):
-        """ Updates database with the hash of the source code """
-        if old_digest:
-            if self.verbosity > 1:
-                print("Updating table with source_digest for {}".format(module_name))
-            self.database.update_table("Source_Info", where={"module_name" : module_name},
-                                       arguments={"source_digest" : source_digest,
-                                                  "source_file" : path})
-        else:
-            if self.verbosity > 1:
-                print("Inserting digest into db for {}".format(module_name))
-            self.database.insert_into("Source_Info", values=(module_name,
-                                                             source_digest,
-                                                             path))
+        """ Returns a hash of the file indicated by _path (see file_digest). """
+        return file_digest(_path)
+
+    def load_manifest(self):
+        """ Returns a dictionary of module_name : Source_Info entry for every row of the Source_Info table.
+            Each entry is a dictionary of field name : value. """
+        return load_manifest(self.database)
+
+    def load_usage(self):
+        """ Returns a dictionary of module_name : usage for every row of the Module_Usage table.
+            Each usage is a dictionary with import_count and cpu_time entries. """
+        return dict((module_name, {"import_count" : import_count or 0, "cpu_time" : cpu_time or 0.0}) for
+                    module_name, import_count, cpu_time in
+                    self.database.query_all("Module_Usage", ("module_name", "import_count", "cpu_time")))
+
+    def get_usage(self, module_name):
+        """ Returns the usage recorded for module_name: a dictionary with import_count and cpu_time entries. """
+        return self.usage.setdefault(module_name, {"import_count" : 0, "cpu_time" : 0.0})
+
+    def record_import(self, module_name):
+        """ Adds one to the import count of module_name. Written to the database by the next flush. """
+        self.get_usage(module_name)["import_count"] += 1
+        self.dirty_usage.add(module_name)
+        self.deferred_imports += 1
+
+    def record_cpu_time(self):
+        """ Adds the CPU time measured by the profiler since the last call to the usage of each module. """
+        if self.profiler is not None:
+            for module_name, seconds in self.profiler.collect().items():
+                self.get_usage(module_name)["cpu_time"] += seconds
+                self.dirty_usage.add(module_name)
+
+    def should_compile(self, module_name):
+        """ Returns True if compile_policy allows module_name to be compiled. """
+        if self.compile_policy is None:
+            return True
+        return self.compile_policy(module_name, dict(self.get_usage(module_name)))
+
+    def record_use(self, module_name):
+        """ Sets the last_used time of the manifest entry for module_name to now, unless it was set less than LAST_USED_RESOLUTION seconds ago, so that imports from an unchanged cache do not rewrite the entry every time. """
+        entry = self.manifest.get(module_name)
+        now = time.time()
+        if entry is not None and now - (entry.get("last_used") or 0) >= LAST_USED_RESOLUTION:
+            entry["last_used"] = now
+            self.dirty.add(module_name)
+
+    def use_file(self, filename):
+        """ Marks the compiled file or artifact filename as in use by this process, so that a garbage collection does not remove it (see remove_compiled). """
+        with self.gc_lock:
+            self.in_use.add(filename)
+
+    def remove_compiled(self, filename):
+        """ usage: remove_compiled(filename) => number of bytes freed, or None
+
+            Removes the compiled file or artifact filename for a garbage collection (see collect_garbage), unless this process has looked it up.
+            The directory of filename is listed again when it is next looked in, so that the hook does not find a removed file. """
+        with self.gc_lock:
+            if filename in self.in_use:
+                return None
+            freed = remove_cached_file(filename)
+            self.path_cache.invalidate(os.path.dirname(filename))
+        return freed
+
+    def collect_garbage(self, manifest):
+        """ Runs collect_garbage on manifest (a copy of the manifest) with the max_cache_size of the hook. Runs in a background thread that is started when the hook is created.
+            The Source_Info entries of the removed modules are deleted by the next flush. Does nothing if another process is collecting garbage in code_dir. """
+        pythonjit._artifacts.make_directory(self.code_dir)
+        lock = pythonjit._filelock.File_Lock(os.path.join(self.code_dir, GC_STAMP))
+        if not lock.acquire(blocking=False):
+            return
+        try:
+            report = collect_garbage(manifest, self.code_dir, self.artifacts.directory, self.max_cache_size,
+                                     self.remove_compiled)
+        except EnvironmentError as error:
+            if self.verbosity:
+                print("Cache garbage collection failed: {}".format(error))
+            return
+        finally:
+            os.utime(lock.filename, None)
+            lock.release()
+        with self.stats_lock:
+            self.removed_entries.update(report["removed_entries"])
+        self.count("gc_runs")
+        self.count("gc_bytes_reclaimed", report["bytes_reclaimed"])
+        if self.verbosity:
+            print("Cache garbage collection reclaimed {} bytes; the cache is {} bytes".format(report["bytes_reclaimed"],
+                                                                                           report["cache_size"]))
+
+    def lookup(self, module_name):
+        """ Returns the Source_Info entry for module_name, or None if there is no entry. """
+        return self.manifest.get(module_name)
+
+    def update_db(self, module_name, source_digest, path, signature, artifact_key, dependencies=()):
+        """ Records the hash of the source code, the (mtime, size, inode) signature of the source file, the build key of the compiled file and the files the module depends on (see check_dependencies).
+
+            The entry is written to the manifest and marked to be written to the database by the next flush. """
+        source_mtime, source_size, source_inode = signature
+        if self.verbosity > 1:
+            print("Updating manifest with source_digest for {}".format(module_name))
+        self.clear_failure(module_name)
+        entry = self.manifest.setdefault(module_name, dict())
+        dependencies = list(dependencies)
+        if dependencies != entry.get("dependencies", []):
+            self.dirty_dependencies.add(module_name)
+        entry.update(source_digest=source_digest, source_file=path, source_mtime=source_mtime,
+                     source_size=source_size, source_inode=source_inode, artifact_key=artifact_key,
+                     last_used=time.time(), dependencies=dependencies)
+        self.dirty.add(module_name)
+        if (self.flush_interval is not None and
+            timeit.default_timer() - self.last_flush >= self.flush_interval):
+            self.flush()
+
+    def flush(self, force=True):
+        """ Writes the manifest entries, module dependencies, module usage, compile stats, cache counters and compile failures that changed since the last flush to the database in a single transaction.
+            If force is False, import counts are only written if there is a compile_policy or a profiler, if a module was compiled, or once DEFERRED_IMPORTS imports have been counted; otherwise they are kept for the next flush. The cache counters (including the import overhead) are kept as well while nothing else needs to be written, so that a warm start writes nothing. """
+        self.last_flush = timeit.default_timer()
+        self.record_cpu_time()
+        write_usage = (force or self.dirty or self.compile_policy is not None or self.profiler is not None or
+                       self.deferred_imports >= DEFERRED_IMPORTS)
+        with self.stats_lock:
+            if not force and not (self.dirty or self.dirty_dependencies or self.dirty_failures or self.compile_stats or
+                                  self.removed_entries or (write_usage and self.dirty_usage)):
+                return
+            failed = dict((module_name, self.failures.get(module_name)) for module_name in self.dirty_failures)
+            self.dirty_failures.clear()
+            totals = (self.hook_calls, self.hook_seconds, self.hook_compile_seconds)
+            for name, total, flushed in zip(("hook_calls", "hook_seconds", "hook_compile_seconds"), totals,
+                                            self.flushed_overhead):
+                if total != flushed:
+                    self.counters[name] = self.counters.get(name, 0) + total - flushed
+            self.flushed_overhead = totals
+            counters, self.counters = self.counters, dict()
+            stats_rows, self.compile_stats = self.compile_stats.values(), dict()
+            removed = [module_name for module_name in self.removed_entries if module_name not in self.dirty]
+            self.removed_entries.clear()
+        for module_name in removed:
+            self.manifest.pop(module_name, None)
+        if (not self.dirty and not (write_usage and self.dirty_usage) and not counters and not stats_rows and
+            not failed and not removed):
+            return
+        fields = [field.split()[0] for field in self.database.database_structure["Source_Info"]]
+        rows = [(module_name, ) + tuple(self.manifest[module_name].get(field) for field in fields[1:]) for
+                module_name in self.dirty]
+        dependency_rows = [(module_name, filename, digest) + tuple(signature) for module_name in self.dirty_dependencies for
+                           filename, digest, signature in self.manifest[module_name]["dependencies"]]
+        usage_rows = [(module_name, self.usage[module_name]["import_count"], self.usage[module_name]["cpu_time"]) for
+                      module_name in self.dirty_usage] if write_usage else []
+        if self.verbosity > 1:
+            print("Writing {} manifest entries to the database".format(len(rows)))
+        with self.database.transaction():
+            if rows:
+                self.database.insert_or_replace("Source_Info", rows, batch=True)
+            for module_name in self.dirty_dependencies:
+                self.database.delete_from("Source_Dependencies", where={"module_name" : module_name})
+            if dependency_rows:
+                self.database.insert_into("Source_Dependencies", dependency_rows, batch=True)
+            if usage_rows:
+                self.database.insert_or_replace("Module_Usage", usage_rows, batch=True)
+            if stats_rows:
+                self.database.insert_or_replace("Compile_Stats", stats_rows, batch=True)
+            if counters:
+                self.database.add_to_counters(counters)
+            for module_name in removed:
+                self.database.delete_from("Source_Info", where={"module_name" : module_name})
+                self.database.delete_from("Source_Dependencies", where={"module_name" : module_name})
+            failure_fields = [field.split()[0] for field in self.database.database_structure["Compile_Failures"]]
+            for module_name, entry in failed.items():
+                if entry is None:
+                    self.database.delete_from("Compile_Failures", where={"module_name" : module_name})
+                else:
+                    self.database.insert_or_replace("Compile_Failures", (module_name, ) +
+                                                    tuple(entry[field] for field in failure_fields[1:]))
+        self.dirty.clear()
+        self.dirty_dependencies.clear()
+        if write_usage:
+            self.dirty_usage.clear()
+            self.deferred_imports = 0
+
+    def close(self):
+        """ Records finished background compilations, waits for the garbage collection, stops the profiler, saves traced types and flushes the manifest. Called automatically at exit. """
+        self.collect_compiled()
+        if self.collector is not None:
+            self.collector.join()
+        if self.profiler is not None:
+            self.profiler.stop()
+        if self.tracer is not None:
+            self.tracer.stop()
+            for module_name, pxd_file, conflicts in self.tracer.save(self.types_dir):
+                if self.verbosity and pxd_file is not None:
+                    print("Wrote type declarations for {} to {}".format(module_name, pxd_file))
+                if self.verbosity > 1:
+                    for function_name, name, types in conflicts:
+                        print("{}.{}: {} was seen as {}, left untyped".format(module_name, function_name, name, ', '.join(types)))
+        self.flush(force=False)
 
     def find_source_file(self, _path):
         """ Finds a source file for the file indacted by _path.
@@ -123,39 +775,849 @@ class Import_Hook(object):
                 file_name = os.path.join(file_name, "__init__.py")
             else:
                 file_name = '.'.join((file_name, "py"))
-            if not os.path.isfile(file_name):
+            if not self.path_cache.exists(file_name):
                 return None # can't find source, can't cross compile
             _path = file_name
         return _path
 
-    def find_compiled_file(self, _path, module):
-        """ Finds a compiled file for the file indicated by _path. """
-        __path = os.path.splitext(os.path.sep.join((self.code_dir, _path[1:])))[0]
+    def find_compiled_file(self, _path):
+        """ Returns the compiled file in code_dir for the python file indicated by _path, or None if there is none.
+            The file is marked as in use (see use_file). """
+        compiled_file = "{}.{}".format(self.get_output_path(_path), self.library_type)
+        self.use_file(compiled_file)
+        return compiled_file if self.path_cache.exists(compiled_file) else None
+
+    def is_linked(self, _path, artifact_key):
+        """ Returns True if the compiled file in code_dir for the python file indicated by _path is the stored artifact for artifact_key: the same file, or a copy with the same digest. """
+        compiled_file = "{}.{}".format(self.get_output_path(_path), self.library_type)
+        artifact = self.artifacts.get_path(artifact_key, self.library_type)
         try:
-            _file, filepath, _ = imp.find_module(module, [__path])
-        except ImportError:
-            if os.path.split(__path)[-1] == module:
-                filepath = os.path.join(__path, "__init__.so")
+            compiled_stat, artifact_stat = os.stat(compiled_file), os.stat(artifact)
+        except OSError:
+            return False
+        if compiled_stat.st_ino and (compiled_stat.st_ino, compiled_stat.st_dev) == (artifact_stat.st_ino, artifact_stat.st_dev):
+            return True
+        return compiled_stat.st_size == artifact_stat.st_size and file_digest(compiled_file) == file_digest(artifact)
+
+    def get_output_path(self, _path):
+        """ Returns the path (without file extension) in code_dir that the compiled version of the python file indicated by _path is linked to. """
+        return output_path(self.code_dir, _path)
+
+    def cross_compile(self, _path, artifact_key, declarations=None, module_name=None, source_digest=None):
+        """ Cross compiles the python file indicated by _path into a binary, unless the Artifact_Store already has one for artifact_key.
+            declarations is an augmenting .pxd file to compile the module with, or None.
+            module_name is the name of the module, which the training command of the pgo profile needs.
+            source_digest is the digest of the source, which is recorded if the module fails to compile (see record_failure).
+            The artifact is extracted from the cache bundle instead of compiled if the bundle has it.
+            The artifact is then linked to the output path for _path.
+
+            Returns True if the compiled module is in place, or False if it is not (because compilation failed and ignore_compilation_failure is True, or because it was not built; see build). """
+        artifact = self.artifacts.get_path(artifact_key, self.library_type)
+        self.use_file(artifact)
+        if os.path.isfile(artifact):
+            if self.verbosity > 1:
+                print("Using stored artifact {}".format(artifact))
+            self.count("artifact_hits")
+        elif self.cache_bundle is not None and self.cache_bundle.extract(artifact_key, artifact):
+            if self.verbosity > 1:
+                print("Extracted {} from the cache bundle".format(artifact))
+            self.count("artifact_hits")
+        else:
+            try:
+                artifact = self.build(_path, artifact, artifact_key, declarations, module_name)
+            except (pythonjit._compile.Cython_Conversion_Error, pythonjit._compile.Compilation_Error) as error:
+                self.record_failure(module_name or _path, _path, source_digest, artifact_key, error)
+                if not self.ignore_compilation_failure:
+                    raise
+                return False
+            if artifact is None:
+                return False
+        self.link_artifact(_path, artifact)
+        return True
+
+    def build(self, _path, artifact, artifact_key, declarations=None, module_name=None):
+        """ usage: build(_path, artifact, artifact_key, declarations=None, module_name=None) => file name or None
+
+            Compiles the python file indicated by _path to the file artifact in the Artifact_Store (see build_artifact), or asks the compile server for it if compile_server was supplied.
+            The cost of compilations in this process is recorded (see record_compile); the server records its own.
+
+            Returns the file name of the compiled module: artifact, or the artifact in the server's store.
+            Returns None if another process is compiling it and wait_for_lock is False, or if the server did not build it (e.g. because the source changed after it was hashed). """
+        if self.compile_client is not None:
+            try:
+                built = self.compile_client.request_artifact(module_name or _path, _path, artifact_key, declarations)
+            except socket.error as error:
+                if self.verbosity:
+                    print("Compile server unavailable ({}); compiling {} in this process".format(error, _path))
+                if isinstance(error, socket.timeout): # a hung server would hold up every import
+                    self.compile_client = None
             else:
-                return None
+                if built is None and self.verbosity:
+                    print("The compile server did not compile {}".format(_path))
+                return built
+        stats = dict()
+        start = timeit.default_timer()
+        built = build_artifact(_path, artifact, self.version, self.verbosity,
+                               self.compile_command, self.object_cache, self.wait_for_lock,
+                               declarations=declarations, training_command=self.training_command,
+                               module_name=module_name, stats=stats)
+        if not built:
+            if self.verbosity:
+                print("{} is being compiled by another process".format(_path))
+            return None
+        if stats: # empty when another process built the artifact while this one waited
+            self.record_compile(module_name or _path, artifact_key, timeit.default_timer() - start, stats)
+        return artifact
+
+    def link_artifact(self, _path, artifact):
+        """ Links the stored artifact to the output path for the python file indicated by _path. """
+        output_file = "{}.{}".format(self.get_output_path(_path), self.library_type)
+        self.artifacts.link(artifact, output_file)
+        self.path_cache.invalidate(os.path.dirname(output_file))
+
+    def precompile(self, modules, jobs=1):
+        """ usage: precompile(modules, jobs=1) => iterator of (module_name, error, seconds)
+
+            Compiles modules without importing them.
+            modules is an iterable of (module_name, source file path) pairs.
+            jobs is the number of worker processes to compile with; 0 uses one process per CPU.
+
+            Yields a (module_name, error, seconds) entry as each module finishes, in completion order.
+            error is None if the module compiled, otherwise it is the message of the compilation error.
+            The database is updated for each module that compiles successfully, and failures are recorded (see record_failure).
+            Modules that failed to compile before with the same build key are not compiled again; their recorded error is yielded with seconds set to 0.0. """
+        entries = dict()
+        arguments = []
+        for module_name, _path in modules:
+            signature = source_signature(_path)
+            source_digest = self.obtain_source_digest(_path)
+            declarations = self.find_declarations(module_name, source_digest)
+            dependencies = self.check_dependencies(_path, self.lookup(module_name), declarations)
+            artifact_key = self.build_key(module_name, source_digest, declarations, dependencies)
+            artifact = self.artifacts.get_path(artifact_key, self.library_type)
+            failure = self.failures.get(module_name)
+            if failure is not None and failure["artifact_key"] == artifact_key:
+                yield module_name, failure["message"], 0.0
+                continue
+            entries[module_name] = (_path, source_digest, signature, artifact_key, artifact, dependencies)
+            arguments.append((module_name, _path, artifact, self.version, self.verbosity,
+                              self.compile_command, self.object_cache, declarations, self.training_command))
+        if jobs < 1:
+            jobs = multiprocessing.cpu_count()
+        if not arguments:
+            return
+        if jobs == 1 or len(arguments) < 2:
+            pool = None
+            results = itertools.imap(_compile_module, arguments)
         else:
-            _file.close()
-        return filepath
+            pool = multiprocessing.Pool(jobs)
+            results = pool.imap_unordered(_compile_module, arguments)
+        try:
+            for module_name, error, seconds, stats in results:
+                _path, source_digest, signature, artifact_key, artifact, dependencies = entries[module_name]
+                if error is None:
+                    self.link_artifact(_path, artifact)
+                    self.update_db(module_name, source_digest, _path, signature, artifact_key, dependencies)
+                    if stats:
+                        self.record_compile(module_name, artifact_key, seconds, stats)
+                else:
+                    self.record_failure(module_name, _path, source_digest, artifact_key, error)
+                    error = str(error)
+                yield module_name, error, seconds
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+
+file_digest = pythonjit._artifacts.file_digest
+
+def scan_dependencies(_path, declarations=None):
+    """ usage: scan_dependencies(_path, declarations=None) => list of (file name, digest, signature)
+
+        Returns the files that the compiled version of the python file indicated by _path depends on (see _dependencies.find_dependencies), with their digests and (mtime, size, inode) signatures.
+        Only modules with an augmenting .pxd file next to them have dependencies. A module that is compiled with declarations from elsewhere (e.g. from types_dir) has none, because Cython uses those instead of the .pxd file. """
+    pxd_file = os.path.splitext(os.path.abspath(_path))[0] + ".pxd"
+    if declarations is not None or not os.path.isfile(pxd_file):
+        return []
+    return [(filename, file_digest(filename), source_signature(filename)) for
+            filename in pythonjit._dependencies.find_dependencies(pxd_file)]
+
+def source_signature(_path):
+    """ Returns the (mtime, size, inode) of the file indicated by _path.
+        Import_Hook only rehashes a source file when its signature differs from the one in the database. """
+    stat = os.stat(_path)
+    return stat.st_mtime, stat.st_size, stat.st_ino
+
+def usage_policy(min_imports=None, min_cpu_time=None):
+    """ usage: usage_policy(min_imports=None, min_cpu_time=None) => compile policy
+
+        Returns a compile policy for Import_Hook that compiles a module once it has been imported at least min_imports times, or once at least min_cpu_time seconds of CPU time have been measured in it (which requires profile=True).
+        A criterion that is None is not used; with both None, every module is compiled. """
+    def policy(module_name, usage):
+        if min_imports is None and min_cpu_time is None:
+            return True
+        return ((min_imports is not None and usage["import_count"] >= min_imports) or
+                (min_cpu_time is not None and usage["cpu_time"] >= min_cpu_time))
+    return policy
+
+def compile_stats(database):
+    """ usage: compile_stats(database) => dict
 
-    def cross_compile(self, _path):
-        """ Cross compiles the python file indicated by _path into a binary. """
-        assert _path[0] == os.path.sep
-        output_path = os.path.splitext(os.path.sep.join((self.code_dir, _path[1:])))[0]
-        directory = os.path.join(*os.path.split(output_path)[:-1])
+        Returns the statistics recorded in database (a Cache_Database) by Import_Hook:
+
+            - one entry for each of CACHE_COUNTERS: the number of imports that found an up to date compiled module (hits), that found no compiled module (misses) or that found one for an older source or build configuration (stale); the number of compilations that were avoided because the Artifact_Store already had the compiled file (artifact_hits); the number of compilations that ran (compiles) and failed (compile_failures); the number of source digest checks (digest_checks), how many of them hashed the file (digests_computed) and the time they took (digest_seconds); the number of times the dependencies of a module were found and hashed again (dependency_scans); the number of calls to Import_Hook.find_module (hook_calls), the time spent in them (hook_seconds) and the part of that time spent compiling (hook_compile_seconds); the number of garbage collections (gc_runs) and the bytes they reclaimed (gc_bytes_reclaimed)
+            - hit_rate: hits divided by the number of imports checked (0.0 if there were none)
+            - modules: a dictionary of module_name : stats of the latest compilation, with the total_seconds taken, the time spent in each stage (pyx_seconds, cython_seconds, gcc_seconds, training_seconds), the size in bytes of the generated C code (c_size) and compiled file (library_size), object_cache_hits, the artifact_key and the time.time() it was compiled at (compiled_at). Bundles are named after their package followed by [bundle]."""
+    stats = dict((name, 0) for name in CACHE_COUNTERS)
+    stats.update(database.query_all("Cache_Counters", ("name", "value")))
+    for name in CACHE_COUNTERS:
+        if not name.endswith("_seconds"):
+            stats[name] = int(stats[name])
+    lookups = stats["hits"] + stats["misses"] + stats["stale"]
+    stats["hit_rate"] = float(stats["hits"]) / lookups if lookups else 0.0
+    fields = [field.split()[0] for field in database.database_structure["Compile_Stats"]]
+    stats["modules"] = dict((row[0], dict(zip(fields[1:], row[1:]))) for
+                            row in database.query_all("Compile_Stats", fields))
+    return stats
+
+def compile_failures(database):
+    """ usage: compile_failures(database) => dict of module_name : failure
+
+        Returns the compilation failures recorded in database (a Cache_Database) by Import_Hook.
+        Each failure is a dictionary with the artifact_key and source_digest the module failed to compile with, its source_file, the stage that failed ("cython" or "compiler"), the message and error output of the failure and the time.time() it failed at (failed_at).
+        Bundles are named after their package followed by [bundle]. """
+    fields = [field.split()[0] for field in database.database_structure["Compile_Failures"]]
+    return dict((row[0], dict(zip(fields[1:], row[1:]))) for
+                row in database.query_all("Compile_Failures", fields))
+
+def export_cache_bundle(filename, database, code_dir=CODE_DIR, artifact_dir=ARTIFACT_DIR):
+    """ usage: export_cache_bundle(filename, database, code_dir=CODE_DIR, artifact_dir=ARTIFACT_DIR) => number of modules
+
+        Writes the compiled modules recorded in the Source_Info table of database (a Cache_Database) to the cache bundle filename (see _cachebundle.export_bundle).
+        The compiled file of each module is taken from the Artifact_Store in artifact_dir, or from code_dir if the store does not have it.
+        Packages that were compiled into a bundle (see bundle_packages) are left out, because their modules share one library. """
+    library_type = pythonjit._compile.SHARED_LIBRARY
+    manifest = load_manifest(database)
+    key_count = dict()
+    for entry in manifest.values():
+        key_count[entry["artifact_key"]] = key_count.get(entry["artifact_key"], 0) + 1
+    manifest = dict((module_name, entry) for module_name, entry in manifest.items() if
+                    key_count[entry["artifact_key"]] == 1)
+    artifacts = pythonjit._artifacts.Artifact_Store(artifact_dir)
+    def compiled_files(module_name, entry):
+        files = [artifacts.get_path(entry["artifact_key"], library_type)]
+        if entry["source_file"]:
+            files.append("{}.{}".format(output_path(code_dir, entry["source_file"]), library_type))
+        return files
+    return pythonjit._cachebundle.export_bundle(filename, manifest, compiled_files, library_type)
+
+def collect_cache_garbage(database, code_dir=CODE_DIR, artifact_dir=ARTIFACT_DIR, max_cache_size=None,
+                          remove_file=None):
+    """ usage: collect_cache_garbage(database, code_dir=CODE_DIR, artifact_dir=ARTIFACT_DIR, max_cache_size=None,
+                                     remove_file=None) => report or None
+
+        Runs collect_garbage on the manifest in database (a Cache_Database), deletes the Source_Info entries of the modules whose compiled files were removed, and adds to the gc_runs and gc_bytes_reclaimed cache counters.
+        Returns the report of collect_garbage, or None if another process is collecting garbage in code_dir. """
+    pythonjit._artifacts.make_directory(code_dir)
+    lock = pythonjit._filelock.File_Lock(os.path.join(code_dir, GC_STAMP))
+    if not lock.acquire(blocking=False):
+        return None
+    try:
+        report = collect_garbage(load_manifest(database), code_dir, artifact_dir, max_cache_size, remove_file)
+        with database.transaction():
+            for module_name in report["removed_entries"]:
+                database.delete_from("Source_Info", where={"module_name" : module_name})
+                database.delete_from("Source_Dependencies", where={"module_name" : module_name})
+            database.add_to_counters({"gc_runs" : 1, "gc_bytes_reclaimed" : report["bytes_reclaimed"]})
+    finally:
+        os.utime(lock.filename, None)
+        lock.release()
+    return report
+
+def collect_garbage(manifest, code_dir=CODE_DIR, artifact_dir=ARTIFACT_DIR, max_cache_size=None, remove_file=None):
+    """ usage: collect_garbage(manifest, code_dir=CODE_DIR, artifact_dir=ARTIFACT_DIR, max_cache_size=None,
+                               remove_file=None) => report
+
+        Removes the files of a cache that are no longer needed:
+
+            - orphans: compiled files in code_dir whose source file no longer exists
+            - stale: compiled files whose manifest entry records a different digest than that of the current source file
+            - artifacts: files in the Artifact_Store in artifact_dir that are not linked to and that no manifest entry refers to
+            - temporary_files: files left behind by interrupted compilations and links
+
+        Then, while code_dir and the Artifact_Store take up more than max_cache_size bytes, the compiled files that were used least recently are removed together with their artifacts (evicted). A compiled file was last used at the last_used time of its manifest entry, or at its modification time if it has none. Hard links to the same file are counted once.
+        Files modified less than GC_GRACE_PERIOD seconds ago are not removed as stale, unused or least recently used, because another process may be about to link or record them.
+
+        manifest is a dictionary of module_name : Source_Info entry (see load_manifest).
+        remove_file is a function that removes a file and returns the number of bytes freed, or returns None to keep the file (see Import_Hook.remove_compiled). Default is remove_cached_file.
+
+        Returns a dictionary with the number of files removed for each of the reasons above, the number of bytes_reclaimed, the cache_size in bytes that remains, and the names of the modules whose manifest entries should be deleted (removed_entries): those whose compiled file was removed or whose source file no longer exists. """
+    remove_file = remove_file or remove_cached_file
+    extension = '.' + pythonjit._compile.SHARED_LIBRARY
+    now = time.time()
+    report = dict((name, 0) for name in ("orphans", "stale", "artifacts", "temporary_files", "evicted", "bytes_reclaimed"))
+    removed_entries = set()
+    owners = dict()
+    last_used = dict()
+    for module_name, entry in manifest.items():
+        if entry.get("source_file") and os.path.isabs(entry["source_file"]):
+            owners[output_path(code_dir, entry["source_file"]) + extension] = module_name
+            if not os.path.isfile(entry["source_file"]):
+                removed_entries.add(module_name)
+        last_used[entry.get("artifact_key")] = max(last_used.get(entry.get("artifact_key")), entry.get("last_used"))
+
+    def remove(filename, reason, module_name=None):
         try:
-            os.makedirs(directory)
-        except OSError as error:
-            if error.errno != errno.EEXIST or not os.path.isdir(directory):
-                raise
+            freed = remove_file(filename)
+            if freed is None:
+                return False
+            if os.path.exists(filename + ".lock"): # the build lock of an artifact
+                os.remove(filename + ".lock")
+        except OSError: # e.g. removed by another process
+            return False
+        report[reason] += 1
+        report["bytes_reclaimed"] += freed
+        if module_name is not None:
+            removed_entries.add(module_name)
+        return True
+
+    files = dict() # (device, inode) : [last used, size, modified recently, [(filename, module_name)]]
+    for filename in find_files(code_dir):
+        try:
+            stat = os.stat(filename)
+        except OSError: # e.g. a temporary file that was renamed
+            continue
+        recent = now - stat.st_mtime < GC_GRACE_PERIOD
+        if filename.endswith(".tmp"):
+            if not recent:
+                remove(filename, "temporary_files")
+            continue
+        if not filename.endswith(extension):
+            continue
+        module_name = owners.get(filename)
+        entry = manifest.get(module_name)
+        source_file = os.path.sep + os.path.relpath(filename, code_dir)[:-len(extension)] + ".py"
+        if not os.path.isfile(source_file):
+            remove(filename, "orphans", module_name)
+            continue
+        if entry is not None and not recent and source_changed(entry, source_file):
+            remove(filename, "stale", module_name)
+            continue
+        group = files.setdefault((stat.st_dev, stat.st_ino), [0, stat.st_size, False, []])
+        group[0] = max(group[0], entry.get("last_used") if entry and entry.get("last_used") else stat.st_mtime)
+        group[2] = group[2] or recent
+        group[3].append((filename, module_name))
+
+    referenced = set(entry.get("artifact_key") for module_name, entry in manifest.items() if
+                     module_name not in removed_entries)
+    for filename in find_files(artifact_dir):
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            continue
+        recent = now - stat.st_mtime < GC_GRACE_PERIOD
+        if filename.endswith(".tmp"):
+            if not recent:
+                remove(filename, "temporary_files")
+            continue
+        if not filename.endswith(extension):
+            continue
+        group = files.get((stat.st_dev, stat.st_ino))
+        if group is None:
+            artifact_key = os.path.basename(filename)[:-len(extension)]
+            if stat.st_nlink == 1 and artifact_key not in referenced and not recent:
+                remove(filename, "artifacts")
+                continue
+            group = files[(stat.st_dev, stat.st_ino)] = [last_used.get(artifact_key) or stat.st_mtime,
+                                                         stat.st_size, recent, []]
+        group[3].append((filename, None))
+
+    cache_size = sum(group[1] for group in files.values())
+    if max_cache_size is not None and cache_size > max_cache_size:
+        for used, size, recent, filenames in sorted(files.values()):
+            if cache_size <= max_cache_size:
+                break
+            if recent:
+                continue
+            if all(remove(filename, "evicted", module_name) for filename, module_name in filenames):
+                cache_size -= size
+    report["cache_size"] = cache_size
+    report["removed_entries"] = sorted(removed_entries)
+    return report
+
+def collection_due(code_dir, interval=GC_INTERVAL):
+    """ Returns True if no garbage collection of code_dir has finished in the last interval seconds. """
+    try:
+        return time.time() - os.path.getmtime(os.path.join(code_dir, GC_STAMP)) >= interval
+    except OSError:
+        return True
+
+def remove_cached_file(filename):
+    """ Removes filename, and returns the number of bytes freed: the size of the file, or 0 if there are other links to it. """
+    stat = os.stat(filename)
+    os.remove(filename)
+    return stat.st_size if stat.st_nlink == 1 else 0
+
+def find_files(directory):
+    """ Yields the file names of the files in directory and its subdirectories, except the GC_STAMP. """
+    for directory, directories, filenames in os.walk(directory):
+        for filename in filenames:
+            if filename != GC_STAMP:
+                yield os.path.join(directory, filename)
+
+def source_changed(entry, source_file):
+    """ Returns True if the digest of source_file differs from the one recorded in the manifest entry. The file is only hashed if its signature differs from the recorded one. """
+    if source_signature(source_file) == source_signature_of(entry):
+        return False
+    return file_digest(source_file) != entry["source_digest"]
+
+def load_manifest(database):
+    """ Returns a dictionary of module_name : Source_Info entry for every row of the Source_Info table of database (a Cache_Database).
+        Each entry is a dictionary of field name : value, with a dependencies entry that lists the (file name, digest, signature) of the module's rows in the Source_Dependencies table. """
+    fields = [field.split()[0] for field in database.database_structure["Source_Info"]]
+    manifest = dict((row[0], dict(zip(fields[1:], row[1:]), dependencies=[])) for
+                    row in database.query_all("Source_Info", fields))
+    for module_name, filename, digest, mtime, size, inode in database.query_all("Source_Dependencies"):
+        if module_name in manifest:
+            manifest[module_name]["dependencies"].append((filename, digest, (mtime, size, inode)))
+    for entry in manifest.values():
+        entry["dependencies"].sort()
+    return manifest
+
+def output_path(code_dir, _path):
+    """ Returns the path (without file extension) in code_dir that the compiled version of the python file indicated by _path is linked to. """
+    _path = os.path.abspath(_path)
+    return os.path.splitext(os.path.sep.join((code_dir, _path[1:])))[0]
+
+def source_signature_of(entry):
+    """ Returns the (mtime, size, inode) signature recorded in a manifest entry, or None if entry is None. """
+    if not entry:
+        return None
+    return entry["source_mtime"], entry["source_size"], entry["source_inode"]
+
+def find_package_sources(package, package_dir):
+    """ usage: find_package_sources(package, package_dir) => list of (module_name, source file path)
+
+        Returns the python source files of the package named package that lives in package_dir, including those of its subpackages.
+        Packages are named after the package rather than the __init__ module. Files that are not valid module names are skipped. """
+    sources = []
+    for directory, directories, filenames in os.walk(package_dir):
+        relative = os.path.relpath(directory, package_dir)
+        prefix = package if relative == os.curdir else '.'.join([package] + relative.split(os.path.sep))
+        directories[:] = sorted(name for name in directories if
+                                MODULE_NAME.match(name) and
+                                os.path.isfile(os.path.join(directory, name, "__init__.py")))
+        for filename in sorted(filenames):
+            name, extension = os.path.splitext(filename)
+            if extension != ".py" or not MODULE_NAME.match(name):
+                continue
+            module_name = prefix if name == "__init__" else "{}.{}".format(prefix, name)
+            sources.append((module_name, os.path.join(directory, filename)))
+    return sources
+
+def build_artifact(_path, artifact, version, verbosity, compile_command, object_cache=None, wait=True,
+                   bundle=False, declarations=None, training_command=None, module_name=None, stats=None):
+    """ usage: build_artifact(_path, artifact, version, verbosity, compile_command,
+                              object_cache=None, wait=True, bundle=False,
+                              declarations=None, training_command=None,
+                              module_name=None, stats=None) => bool
+
+        Compiles the python file indicated by _path to the file artifact, unless artifact already exists.
+        declarations is an augmenting .pxd file to compile the module with, or None.
+        When bundle is True, _path is a list of python files that are compiled into the single library artifact (see _compile.compile_bundle), and declarations is a list with a .pxd file or None for each of them.
+        When training_command is set, the module named module_name is compiled with profile guided optimization (see _compile.pgo_compile). The training command can find the instrumented library through the environment variables named by TRAINING_MODULE, TRAINING_LIBRARY and TRAINING_SOURCE.
+        stats is an optional dictionary that the cost of the compilation is added to (see _compile.cross_compile). It is left unchanged if artifact was built by another process.
+
+        Only one process builds a given artifact at a time. If another process is building it, this waits for that process to finish when wait is True, and returns False otherwise.
+        The compiled file is written under a temporary name and renamed to artifact, so artifact is never observed half written.
+
+        Returns True when artifact exists. """
+    if os.path.isfile(artifact):
+        return True
+    pythonjit._artifacts.make_directory(os.path.dirname(artifact))
+    lock = pythonjit._filelock.File_Lock(artifact + ".lock")
+    if not lock.acquire(blocking=False):
+        if not wait:
+            return False
+        if verbosity > 1:
+            print("Waiting for another process to compile {}".format(_path))
+        lock.acquire()
+    try:
+        if not os.path.isfile(artifact): # the process that held the lock may have built it
+            base, extension = os.path.splitext(artifact)
+            temporary_name = "{}.{}-{}.tmp".format(base, os.getpid(), thread.get_ident())
+            renamed = False
+            try:
+                if bundle:
+                    compiled = pythonjit._compile.compile_bundle(_path, temporary_name, version=version,
+                                                                 verbosity=verbosity,
+                                                                 compile_command=compile_command,
+                                                                 declarations=declarations, stats=stats)
+                else:
+                    training_environment = None
+                    if training_command:
+                        training_environment = {TRAINING_MODULE : module_name,
+                                                TRAINING_LIBRARY : temporary_name + extension,
+                                                TRAINING_SOURCE : os.path.abspath(_path)}
+                    compiled = pythonjit._compile.cross_compile([_path], [temporary_name],
+                                                                version=version, verbosity=verbosity,
+                                                                compile_command=compile_command,
+                                                                object_cache=object_cache,
+                                                                declarations=[declarations],
+                                                                training_command=training_command,
+                                                                training_environment=training_environment,
+                                                                stats=stats)[0]
+                if os.name == "nt" and os.path.exists(artifact):
+                    os.remove(artifact)
+                os.rename(compiled, artifact)
+                renamed = True
+            finally:
+                if not renamed and os.path.exists(temporary_name + extension):
+                    os.remove(temporary_name + extension)
+    finally:
+        lock.release()
+    return True
+
+def _compile_module(arguments):
+    """ Compiles a single module into the Artifact_Store for Import_Hook.precompile. Runs in a worker process.
+        Modules whose artifact already exists are not compiled again.
+        Returns (module_name, error or None, seconds taken, stats of the compilation)."""
+    (module_name, _path, artifact, version, verbosity, compile_command, object_cache, declarations,
+     training_command) = arguments
+    stats = dict()
+    start = timeit.default_timer()
+    try:
+        build_artifact(_path, artifact, version, verbosity, compile_command, object_cache,
+                       declarations=declarations, training_command=training_command,
+                       module_name=module_name, stats=stats)
+    except (pythonjit._compile.Cython_Conversion_Error,
+            pythonjit._compile.Compilation_Error) as error:
+        return module_name, error, timeit.default_timer() - start, stats
+    return module_name, None, timeit.default_timer() - start, stats
+
+
+def _test_directory(files=None):
+    """ Returns a new temporary directory for the tests below, with the files in the files dictionary (name : contents) written to it. """
+    import tempfile
+    directory = tempfile.mkdtemp()
+    for name, contents in (files or dict()).items():
+        with open(os.path.join(directory, name), 'w') as _file:
+            _file.write(contents)
+    return directory
+
+def test_build_artifact():
+    """ Unit test for build_artifact: only one of the threads that build the same artifact compiles it """
+    import shutil
+    directory = _test_directory({"single_flight.py" : "def f(x):\n    return x + 1\n"})
+    try:
+        _path = os.path.join(directory, "single_flight.py")
+        artifact = os.path.join(directory, "artifacts", "key." + pythonjit._compile.SHARED_LIBRARY)
+        lock = pythonjit._filelock.File_Lock(artifact + ".lock")
+        pythonjit._artifacts.make_directory(os.path.dirname(artifact))
+        with lock:
+            assert not build_artifact(_path, artifact, '2', 0, pythonjit._compile.COMPILE_COMMAND, wait=False)
+        assert not os.path.exists(artifact)
+
+        results = []
+        def build():
+            stats = dict()
+            results.append((build_artifact(_path, artifact, '2', 0, pythonjit._compile.COMPILE_COMMAND, stats=stats), stats))
+        threads = [threading.Thread(target=build) for count in range(4)]
+        for thread_ in threads:
+            thread_.start()
+        for thread_ in threads:
+            thread_.join()
+        assert all(built for built, stats in results), results
+        assert len([stats for built, stats in results if stats]) == 1, "compiled more than once"
+        assert os.path.isfile(artifact)
+        assert not [filename for filename in os.listdir(os.path.dirname(artifact)) if filename.endswith(".tmp")]
+    finally:
+        shutil.rmtree(directory)
+
+def _test_hook(directory, **kwargs):
+    """ Returns an Import_Hook with its whole cache in directory, for the tests below. Close it with _close_test_hook. """
+    for name, default in (("database_name", "cache.db"), ("code_dir", "compiled"), ("artifact_dir", "artifacts")):
+        kwargs.setdefault(name, os.path.join(directory, default))
+    kwargs.setdefault("object_cache", None)
+    kwargs.setdefault("types_dir", None)
+    kwargs.setdefault("flush_interval", None)
+    return Import_Hook(**kwargs)
+
+def _close_test_hook(hook):
+    """ Closes hook and removes it from sys.meta_path, as pythonjit.disable does. """
+    hook.close()
+    sys.meta_path.remove(hook)
+    atexit._exithandlers.remove((hook.close, (), {}))
+    hook.database.delete()
+
+def test_known_failure():
+    """ Unit test for recorded compilation failures: a module that failed is not compiled again until its build key changes """
+    import shutil
+    directory = _test_directory({"failing.py" : "x = (\n"})
+    try:
+        hook = _test_hook(directory, ignore_compilation_failure=True)
+        assert hook.check_module("failing", [directory]) is None
+        assert hook.counters["compile_failures"] == 1
+        assert hook.check_module("failing", [directory]) is None
+        assert hook.counters["compile_failures"] == 1, "compiled a known failure again"
+        _close_test_hook(hook)
+
+        hook = _test_hook(directory)
         try:
-            compiled = pythonjit._compile.cross_compile([_path], output_names=[output_path],
-                                                        version=self.version,
-                                                        verbosity=self.verbosity)
+            hook.check_module("failing", [directory])
         except pythonjit._compile.Cython_Conversion_Error:
-            if not self.ignore_compilation_failure:
-                raise
+            pass
+        else:
+            raise AssertionError("the recorded failure was not raised")
+        assert "compile_failures" not in hook.counters, "compiled a known failure again"
+        _close_test_hook(hook)
+
+        hook = _test_hook(directory, ignore_compilation_failure=True, build_profile="debug")
+        assert hook.check_module("failing", [directory]) is None
+        assert hook.counters["compile_failures"] == 1, "a new build key did not compile again"
+        _close_test_hook(hook)
+    finally:
+        shutil.rmtree(directory)
+
+def test_dependencies():
+    """ Unit test for dependency tracking: changing a file that a module's .pxd file includes compiles that module again, and no others """
+    import shutil
+    directory = _test_directory({"dependent.py" : "def f(x):\n    return x + 1\n",
+                                 "dependent.pxd" : "include \"shared.pxi\"\n",
+                                 "shared.pxi" : "# version 1\n",
+                                 "independent.py" : "def g(x):\n    return x * 2\n"})
+    try:
+        hook = _test_hook(directory)
+        for module_name in ("dependent", "independent"):
+            assert hook.check_module(module_name, [directory]) is not None
+        assert hook.counters["compiles"] == 2
+        assert [dependency[0] for dependency in hook.lookup("dependent")["dependencies"]] == [
+               os.path.join(directory, "dependent.pxd"), os.path.join(directory, "shared.pxi")]
+        _close_test_hook(hook)
+
+        with open(os.path.join(directory, "shared.pxi"), 'w') as _file:
+            _file.write("# version 2, which is longer\n")
+        hook = _test_hook(directory)
+        for module_name in ("dependent", "independent"):
+            assert hook.check_module(module_name, [directory]) is not None
+        assert hook.counters["compiles"] == 1, hook.counters
+        assert hook.counters["stale"] == 1 and hook.counters["hits"] == 1, hook.counters
+        _close_test_hook(hook)
+    finally:
+        shutil.rmtree(directory)
+
+def test_collect_garbage():
+    """ Unit test for collect_garbage: orphans are removed, and the least recently used compiled files are evicted while the cache is too large """
+    import shutil
+    directory = _test_directory({"old.py" : "x = 1\n", "new.py" : "x = 2\n"})
+    try:
+        code_dir = os.path.join(directory, "compiled")
+        artifacts = pythonjit._artifacts.Artifact_Store(os.path.join(directory, "artifacts"))
+        extension = '.' + pythonjit._compile.SHARED_LIBRARY
+        long_ago = time.time() - 2 * GC_GRACE_PERIOD
+        manifest = dict()
+        for module_name, artifact_key, last_used in (("old", "aa01", long_ago), ("new", "bb02", time.time()),
+                                                     ("removed", "cc03", time.time())):
+            _path = os.path.join(directory, module_name + ".py")
+            compiled_file = output_path(code_dir, _path) + extension
+            pythonjit._artifacts.make_directory(os.path.dirname(compiled_file))
+            with open(compiled_file, 'wb') as _file:
+                _file.write("\x00" * 1000)
+            os.utime(compiled_file, (long_ago, long_ago))
+            artifact = artifacts.get_path(artifact_key, pythonjit._compile.SHARED_LIBRARY)
+            pythonjit._artifacts.make_directory(os.path.dirname(artifact))
+            os.link(compiled_file, artifact)
+            entry = {"source_file" : _path, "artifact_key" : artifact_key, "last_used" : last_used,
+                     "source_digest" : None, "source_mtime" : None, "source_size" : None, "source_inode" : None}
+            if os.path.isfile(_path):
+                entry["source_digest"] = file_digest(_path)
+                entry["source_mtime"], entry["source_size"], entry["source_inode"] = source_signature(_path)
+            manifest[module_name] = entry
+
+        report = collect_garbage(manifest, code_dir, artifacts.directory, max_cache_size=1500)
+        assert report["orphans"] == 1 and report["evicted"] == 2 and report["stale"] == 0, report
+        assert report["removed_entries"] == ["old", "removed"], report
+        assert report["cache_size"] == 1000, report
+        assert os.path.isfile(output_path(code_dir, os.path.join(directory, "new.py")) + extension)
+        assert not os.path.exists(output_path(code_dir, os.path.join(directory, "old.py")) + extension)
+        assert not os.path.exists(artifacts.get_path("aa01", pythonjit._compile.SHARED_LIBRARY))
+    finally:
+        shutil.rmtree(directory)
+
+def test_cache_bundle():
+    """ Unit test for cache bundles: a cache exported by export_cache_bundle is used by a hook with an empty cache without compiling anything """
+    import shutil
+    directory = _test_directory({"bundled.py" : "def f(x):\n    return x + 1\n"})
+    try:
+        hook = _test_hook(directory)
+        assert hook.check_module("bundled", [directory]) is not None
+        _close_test_hook(hook)
+        database = pythonjit._database.Cache_Database(database_name=os.path.join(directory, "cache.db"))
+        bundle_file = os.path.join(directory, "cache.bundle")
+        assert export_cache_bundle(bundle_file, database, os.path.join(directory, "compiled"),
+                                   os.path.join(directory, "artifacts")) == 1
+        database.delete()
+
+        bundle = pythonjit._cachebundle.Cache_Bundle(bundle_file, pythonjit._compile.SHARED_LIBRARY)
+        assert bundle.lookup("bundled", file_digest(os.path.join(directory, "bundled.py"))) is not None
+        assert bundle.lookup("bundled", "another digest") is None
+        bundle.close()
+        try:
+            pythonjit._cachebundle.Cache_Bundle(os.path.join(directory, "bundled.py"), pythonjit._compile.SHARED_LIBRARY)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError("opened a file that is not a cache bundle")
+
+        target = os.path.join(directory, "target")
+        os.mkdir(target)
+        hook = _test_hook(target, cache_bundle=bundle_file)
+        loader = hook.check_module("bundled", [directory])
+        assert loader is not None
+        assert hook.counters["artifact_hits"] == 1 and "compiles" not in hook.counters, hook.counters
+        try:
+            assert loader.load_module("bundled").f(1) == 2
+        finally:
+            sys.modules.pop("bundled", None)
+        _close_test_hook(hook)
+        hook.cache_bundle.close()
+    finally:
+        shutil.rmtree(directory)
+
+def test_source_signature():
+    """ Unit test for the stat fast path: a source file is only hashed when its (mtime, size, inode) signature changed """
+    import shutil
+    directory = _test_directory({"signed.py" : "x = 1\n"})
+    try:
+        _path = os.path.join(directory, "signed.py")
+        hook = _test_hook(directory)
+        assert hook.check_module("signed", [directory]) is not None
+        _close_test_hook(hook)
+
+        hook = _test_hook(directory)
+        assert hook.check_module("signed", [directory]) is not None
+        assert "digests_computed" not in hook.counters, hook.counters
+        mtime = os.path.getmtime(_path)
+        os.utime(_path, (mtime + 10, mtime + 10))
+        assert hook.check_module("signed", [directory]) is not None
+        assert hook.counters["digests_computed"] == 1 and hook.counters["hits"] == 2, hook.counters
+        assert hook.check_module("signed", [directory]) is not None
+        assert hook.counters["digests_computed"] == 1, "the new signature was not recorded"
+        _close_test_hook(hook)
+
+        with open(_path, 'w') as _file:
+            _file.write("x = 2\n")
+        os.utime(_path, (mtime + 20, mtime + 20))
+        hook = _test_hook(directory)
+        assert hook.check_module("signed", [directory]) is not None
+        assert hook.counters["stale"] == 1 and hook.counters["compiles"] == 1, hook.counters
+        _close_test_hook(hook)
+    finally:
+        shutil.rmtree(directory)
+
+def test_manifest():
+    """ Unit test for the manifest: entries are buffered in memory until flush, and read back by the next hook """
+    import shutil
+    directory = _test_directory({"manifested.py" : "x = 1\n"})
+    try:
+        hook = _test_hook(directory)
+        assert hook.check_module("manifested", [directory]) is not None
+        assert hook.lookup("manifested")["source_file"] == os.path.join(directory, "manifested.py")
+        assert hook.database.query_all("Source_Info") == [], "written before flush"
+        hook.flush()
+        assert [row[0] for row in hook.database.query_all("Source_Info")] == ["manifested"]
+        _close_test_hook(hook)
+
+        hook = _test_hook(directory)
+        assert hook.lookup("manifested") is not None
+        assert hook.check_module("manifested", [directory]) is not None
+        assert hook.counters["hits"] == 1 and "compiles" not in hook.counters, hook.counters
+        _close_test_hook(hook)
+    finally:
+        shutil.rmtree(directory)
+
+def test_artifact_store():
+    """ Unit test for the Artifact_Store: the same source in another checkout is linked instead of compiled, and another build configuration is compiled """
+    import shutil
+    directory = _test_directory()
+    try:
+        checkouts = [os.path.join(directory, name) for name in ("first", "second")]
+        for checkout in checkouts:
+            os.mkdir(checkout)
+            with open(os.path.join(checkout, "checked_out.py"), 'w') as _file:
+                _file.write("x = 1\n")
+        hook = _test_hook(directory)
+        for checkout in checkouts:
+            assert hook.check_module("checked_out", [checkout]) is not None
+            assert hook.find_compiled_file(os.path.join(checkout, "checked_out.py")) is not None
+        assert hook.counters["compiles"] == 1 and hook.counters["artifact_hits"] == 1, hook.counters
+        _close_test_hook(hook)
+
+        hook = _test_hook(directory, build_profile="debug")
+        assert hook.check_module("checked_out", [checkouts[1]]) is not None
+        assert hook.counters["stale"] == 1 and hook.counters["compiles"] == 1, hook.counters
+        _close_test_hook(hook)
+    finally:
+        shutil.rmtree(directory)
+
+def test_object_cache():
+    """ Unit test for the object cache: gcc is not run again for a source change that does not change the generated C code """
+    import shutil
+    directory = _test_directory({"commented.py" : "# first comment\nx = 1\n"})
+    try:
+        object_cache = os.path.join(directory, "objects")
+        hook = _test_hook(directory, object_cache=object_cache)
+        assert hook.check_module("commented", [directory]) is not None
+        with open(os.path.join(directory, "commented.py"), 'w') as _file:
+            _file.write("# second, longer comment\nx = 1\n")
+        assert hook.check_module("commented", [directory]) is not None
+        assert hook.counters["compiles"] == 2, hook.counters
+        stats = pythonjit._compile.object_cache_stats(object_cache)
+        assert stats["misses"] == 1 and stats["hits"] == 1, stats
+        _close_test_hook(hook)
+    finally:
+        shutil.rmtree(directory)
+
+def test_deferred_usage():
+    """ Unit test for flush: a warm start that compiles nothing writes nothing, unless import counts are needed or DEFERRED_IMPORTS were counted """
+    import shutil
+    directory = _test_directory({"counted.py" : "x = 1\n"})
+    def import_count():
+        return hook.database.query("Module_Usage", ("import_count", ), where={"module_name" : "counted"})
+    try:
+        hook = _test_hook(directory)
+        assert hook.check_module("counted", [directory]) is not None
+        hook.flush(force=False)
+        assert import_count() == 1
+        _close_test_hook(hook)
+
+        hook = _test_hook(directory)
+        assert hook.check_module("counted", [directory]) is not None
+        hook.flush(force=False)
+        assert import_count() == 1, "a warm start wrote its import counts"
+        assert hook.database.query("Cache_Counters", ("value", ), where={"name" : "hits"}) == [], "a warm start wrote its counters"
+        hook.deferred_imports = DEFERRED_IMPORTS - 1
+        assert hook.check_module("counted", [directory]) is not None
+        hook.flush(force=False)
+        assert import_count() == 3, import_count()
+        _close_test_hook(hook)
+
+        hook = _test_hook(directory, compile_policy=lambda module_name, usage: True)
+        assert hook.check_module("counted", [directory]) is not None
+        hook.flush(force=False)
+        assert import_count() == 4, import_count()
+        _close_test_hook(hook)
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    test_build_artifact()
+    test_known_failure()
+    test_dependencies()
+    test_collect_garbage()
+    test_cache_bundle()
+    test_source_signature()
+    test_manifest()
+    test_artifact_store()
+    test_object_cache()
+    test_deferred_usage()
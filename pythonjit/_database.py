@@ -7,6 +7,7 @@ This is a stripped down copy of pride.components.database. There are features pr
 This module is a utility used by the library, and is not intended to be used in any other capacity."""
 import sqlite3
 import contextlib
+import threading
 import os
 import atexit
 
@@ -37,18 +38,23 @@ def create_where_string(where):
 class Database(object):
     """ An object with methods for dispatching sqlite3 commands.
         Database objects may be simpler and safer then directly working with sqlite3 queries.
-        Note that database methods commit automatically when the auto_commit attribute is set to True (defaults to True)."""
+        Note that database methods commit automatically when the auto_commit attribute is set to True (defaults to True), except inside a transaction (see transaction).
+
+        Each thread that uses a Database object gets its own sqlite3 connection and cursor (see connection), so threads neither share a cursor nor join each other's transactions.
+        Writes take the database's write lock when their transaction begins (BEGIN IMMEDIATE). A connection that finds the database locked by another connection waits up to timeout seconds for it instead of failing."""
     IntegrityError = sqlite3.IntegrityError
 
-    defaults = {"database_name" : '', "connection" : None,
-                "cursor" : None, "text_factory" : str, "auto_commit" : True,
-                "return_cursor" : False}
+    defaults = {"database_name" : '', "text_factory" : str, "auto_commit" : True,
+                "return_cursor" : False, "timeout" : 30.0}
 
     database_structure = {}
     primary_key = {}
 
     def __init__(self, **kwargs):
         super(Database, self).__init__()
+        self.local = threading.local()
+        self.connections = []
+        self.connections_lock = threading.Lock()
         attributes = self.defaults.copy()
         attributes.update(kwargs)
         for attribute, value in attributes.items():
@@ -61,25 +67,57 @@ class Database(object):
         else:
             directory = os.path.join(*os.path.split(self.database_name)[:-1])
 
-        if not os.path.isdir(directory):
+        if directory and not os.path.isdir(directory):
             os.mkdir(directory)
-        self.connection, self.cursor = self.open_database(self.database_name,
-                                                          self.text_factory)
         atexit.register(self.delete)
 
+        # tables are only created (which takes the write lock) when they are missing, so that processes that open the database at the same time do not wait for each other
         for table, structure in self.database_structure.items():
-            self.create_table(table, structure)
+            existing_fields = set(row[1] for row in self.table_info(table).fetchall())
+            if not existing_fields:
+                self.create_table(table, structure)
+            if any(field.split()[0] not in existing_fields for field in structure):
+                self.add_missing_fields(table, structure)
+
+    @property
+    def connection(self):
+        """ The sqlite3 connection of the current thread, which is opened (see open_database) the first time the thread uses the database. """
+        try:
+            return self.local.connection
+        except AttributeError:
+            self.local.connection, self.local.cursor = self.open_database(self.database_name, self.text_factory)
+            with self.connections_lock:
+                self.connections.append(self.local.connection)
+            return self.local.connection
+
+    @property
+    def cursor(self):
+        """ The sqlite3 cursor of the current thread. """
+        self.connection
+        return self.local.cursor
+
+    @cursor.setter
+    def cursor(self, cursor):
+        self.connection
+        self.local.cursor = cursor
 
     def open_database(self, database_name, text_factory=None):
         """ Opens database_name and obtain a sqlite3 connection and cursor.
-            Database objects call this implicitly when initializing.
-            Database objects wrap the connection and store the cursor
-            as Database.cursor. """
-        connection = sqlite3.connect(database_name)
+            Database objects call this implicitly the first time each thread uses the database,
+            and store the connection and cursor as Database.connection and Database.cursor.
+            The connection waits up to timeout seconds for a lock held by another connection, and
+            begins write transactions with BEGIN IMMEDIATE. """
+        connection = sqlite3.connect(database_name, timeout=self.timeout, isolation_level="IMMEDIATE",
+                                     check_same_thread=False) # so that delete can close every thread's connection
         if text_factory:
             connection.text_factory = text_factory
         return connection, connection.cursor()
 
+    def commit_statement(self):
+        """ Commits the statement that was just executed, unless auto_commit is False or the current thread is in a transaction. """
+        if self.auto_commit and not getattr(self.local, "in_transaction", False):
+            self.connection.commit()
+
     def create_table(self, table_name, fields, if_not_exists=True):
         """ Creates a table in the underlying sqlite3 database.
             fields is an iterable containing field names. The if_not_exists
@@ -90,8 +128,7 @@ class Database(object):
                                               table_name, ', '.join(fields))
         result = self.cursor.execute(query)
 
-        if self.auto_commit:
-            self.connection.commit()
+        self.commit_statement()
         if table_name not in self.database_structure:
             self.database_structure[table_name] = fields
             for field in fields:
@@ -100,6 +137,15 @@ class Database(object):
                     break
         return result
 
+    def add_missing_fields(self, table_name, fields):
+        """ Adds any of the fields that are missing from an existing table,
+            e.g. when the table was created by an older version of the
+            database structure. Missing fields are appended as columns. """
+        existing_fields = set(row[1] for row in self.table_info(table_name).fetchall())
+        for field in fields:
+            if field.split()[0] not in existing_fields:
+                self.alter_table(table_name, "ADD", field)
+
     def query(self, table_name, retrieve_fields=tuple(), where=None,
               group_by=None, having=None, order_by=None, distinct=True):
         """ Retrieves information from the named database table.
@@ -148,6 +194,14 @@ class Database(object):
                     result = result[0]
             return result
 
+    def query_all(self, table_name, retrieve_fields=tuple()):
+        """ Retrieves every row of the named database table.
+            Unlike query, the result is always a list of tuples,
+            even when the table holds zero or one rows. """
+        retrieve_fields = ", ".join(retrieve_fields or (field.split()[0] for
+                                    field in self.database_structure.get(table_name, [])))
+        return self.cursor.execute("SELECT {} FROM {}".format(retrieve_fields, table_name)).fetchall()
+
     def insert_into(self, table_name, values, columns=None, batch=False):
         """ Inserts values into the specified table. The values must
             be the correct type and the correct amount. Value types
@@ -161,8 +215,7 @@ class Database(object):
             cursor = self.cursor.execute(query, values)
         #primary_key = values[[value for value in values if "primary_key" in value.lower()][0].split()[0]
         #self.in_memory[table_name][primary_key] = values
-        if self.auto_commit:
-            self.connection.commit()
+        self.commit_statement()
         return cursor
 
     def update_table(self, table_name, where=None, arguments=None):
@@ -184,8 +237,7 @@ class Database(object):
         query = "UPDATE {} SET {} {}".format(table_name, assignment_string, condition_string)
         values = _values + values
         cursor = self.cursor.execute(query, values)
-        if self.auto_commit:
-            self.connection.commit()
+        self.commit_statement()
         return cursor
 
     def delete_from(self, table_name, where=None):
@@ -197,24 +249,48 @@ class Database(object):
             condition_string, values = create_where_string(where)
             query = "DELETE FROM {} {}".format(table_name, condition_string)
             cursor = self.cursor.execute(query, values)
-            if self.auto_commit:
-                self.connection.commit()
+            self.commit_statement()
             return cursor
 
-    def insert_or_replace(self, table_name, new_values):
-        query = "INSERT OR REPLACE INTO {} VALUES ({})".format(table_name, ', '.join('?' for value in new_values))
-        cursor = self.cursor.execute(query, new_values)
-        if self.auto_commit:
-            self.connection.commit()
+    def insert_or_replace(self, table_name, new_values, batch=False):
+        """ Inserts new_values into the specified table, replacing any entry
+            with the same primary key. If batch is True, new_values is a
+            sequence of rows that are all inserted or replaced. """
+        query = "INSERT OR REPLACE INTO {} VALUES ({})".format(table_name, ', '.join('?' for value in
+                                                                            (new_values[0] if batch else new_values)))
+        if batch:
+            cursor = self.cursor.executemany(query, new_values)
+        else:
+            cursor = self.cursor.execute(query, new_values)
+        self.commit_statement()
         return cursor
 
+    @contextlib.contextmanager
+    def transaction(self):
+        """ Context manager that groups the statements executed inside it by the current thread into one transaction.
+            Statements are not committed one by one for the duration; the transaction is committed
+            when the block exits normally and rolled back if it raises. A transaction entered
+            inside another one is part of the outer transaction. """
+        if getattr(self.local, "in_transaction", False):
+            yield self
+            return
+        self.local.in_transaction = True
+        try:
+            yield self
+        except:
+            self.connection.rollback()
+            raise
+        else:
+            self.connection.commit()
+        finally:
+            self.local.in_transaction = False
+
     def drop_table(self, table_name):
         """ Removes a table from the underlying sqlite3 database. Note
             that this will remove all entries in the specified table, and
             the data cannot be recovered."""
-        self.cursor.execute("DROP TABLE {}", (table_name, ))
-        if self.auto_commit:
-            self.connection.commit()
+        self.cursor.execute("DROP TABLE {}".format(table_name))
+        self.commit_statement()
 
     def alter_table(self, table_name, mode, argument):
         """ Alters the specified table. Available modes are
@@ -229,8 +305,7 @@ class Database(object):
             raise ValueError("alter_table mode '{}' not supported".format(mode))
         command = "ALTER TABLE {} {} {}".format(table_name, insert, argument)
         self.cursor.execute(command)
-        if self.auto_commit:
-            self.connection.commit()
+        self.commit_statement()
 
     def table_info(self, table_name):
         """ Returns a generator which yields field information for the
@@ -250,18 +325,98 @@ class Database(object):
             return False
 
     def delete(self):
-        self.connection.close()
+        """ Closes the connections of every thread. """
+        with self.connections_lock:
+            for connection in self.connections:
+                connection.close()
+            del self.connections[:]
+        self.local = threading.local()
         if self.delete in atexit._exithandlers:
             atexit._exithandlers.remove(self.delete)
 
 
 class Cache_Database(Database):
-    """ Database with the table structure expected by Import_Hook. """
+    """ Database with the table structure expected by Import_Hook.
+
+        Source_Dependencies records the files that the compiled version of each module depends on besides its source file (see _dependencies), with their digests and (mtime, size, inode) signatures.
+        Compile_Progress is the checkpoint used by compilestdlib to resume an interrupted run.
+        Module_Usage records how many times each module was imported and how much CPU time was spent in it, for compile policies.
+        Compile_Stats records the cost of the latest compilation of each module, and Cache_Counters holds running totals of cache hits, misses and other events (see add_to_counters).
+        Compile_Failures records the latest failed compilation of each module, so that it is not retried until its build key changes.
+        Benchmark_Results keeps every result of benchmarksuite, so that results for the same build profile can be compared over time.
+
+        The database is used in WAL mode, so that processes that read it (e.g. every process that enables pythonjit) do not wait for a process that is writing to it, and writers do not wait for readers. benchmarkconcurrency.py measures many processes using one database at the same time. """
 
     database_structure = {"Source_Info" : ("module_name TEXT PRIMARY_KEY UNIQUE",
                                             "source_digest BLOB",
-                                            "source_file TEXT")}
-    primary_key = {"Source_Info" : "module_name"}
+                                            "source_file TEXT",
+                                            "source_mtime REAL",
+                                            "source_size INTEGER",
+                                            "source_inode INTEGER",
+                                            "artifact_key TEXT",
+                                            "last_used REAL"),
+                          "Source_Dependencies" : ("module_name TEXT",
+                                                   "dependency_file TEXT",
+                                                   "dependency_digest BLOB",
+                                                   "dependency_mtime REAL",
+                                                   "dependency_size INTEGER",
+                                                   "dependency_inode INTEGER"),
+                          "Compile_Progress" : ("module_name TEXT PRIMARY_KEY UNIQUE",
+                                                "source_digest BLOB",
+                                                "status TEXT",
+                                                "compile_time REAL"),
+                          "Module_Usage" : ("module_name TEXT PRIMARY_KEY UNIQUE",
+                                            "import_count INTEGER",
+                                            "cpu_time REAL"),
+                          "Compile_Stats" : ("module_name TEXT PRIMARY_KEY UNIQUE",
+                                             "artifact_key TEXT",
+                                             "compiled_at REAL",
+                                             "total_seconds REAL",
+                                             "pyx_seconds REAL",
+                                             "cython_seconds REAL",
+                                             "gcc_seconds REAL",
+                                             "training_seconds REAL",
+                                             "c_size INTEGER",
+                                             "library_size INTEGER",
+                                             "object_cache_hits INTEGER"),
+                          "Cache_Counters" : ("name TEXT PRIMARY_KEY UNIQUE",
+                                              "value REAL"),
+                          "Compile_Failures" : ("module_name TEXT PRIMARY_KEY UNIQUE",
+                                                "artifact_key TEXT",
+                                                "source_file TEXT",
+                                                "source_digest BLOB",
+                                                "stage TEXT",
+                                                "message TEXT",
+                                                "output TEXT",
+                                                "failed_at REAL"),
+                          "Benchmark_Results" : ("benchmark TEXT",
+                                                 "build_profile TEXT",
+                                                 "toolchain TEXT",
+                                                 "recorded_at REAL",
+                                                 "interpreted_median REAL",
+                                                 "interpreted_spread REAL",
+                                                 "compiled_median REAL",
+                                                 "compiled_spread REAL",
+                                                 "speedup REAL")}
+    primary_key = {"Source_Info" : "module_name", "Compile_Progress" : "module_name",
+                   "Module_Usage" : "module_name", "Compile_Stats" : "module_name",
+                   "Cache_Counters" : "name", "Compile_Failures" : "module_name"}
+
+    def open_database(self, database_name, text_factory=None):
+        """ Opens database_name like Database.open_database, and switches it to WAL mode. """
+        connection, cursor = super(Cache_Database, self).open_database(database_name, text_factory)
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL") # WAL keeps the database consistent; a power loss may only lose the latest transactions
+        return connection, cursor
+
+    def add_to_counters(self, counters):
+        """ Adds the values in the counters dictionary (name : number) to the Cache_Counters table.
+            Counters are added to rather than replaced, so processes that share the database do not overwrite each other's counts. """
+        rows = [(name, ) for name in counters]
+        self.cursor.executemany("INSERT OR IGNORE INTO Cache_Counters VALUES (?, 0)", rows)
+        self.cursor.executemany("UPDATE Cache_Counters SET value = value + ? WHERE name = ?",
+                                [(value, name) for name, value in counters.items()])
+        self.commit_statement()
 
 
 def test_db():
@@ -281,5 +436,48 @@ def test_db():
     test.insert_or_replace("Test", ("no_duplicates", '1'))
     test.query("Test", retrieve_fields=("test_name", "test_data"), where={"test_name" : "no_duplicates"})
 
+def test_cache_db():
+    """ Unit test for Cache_Database: WAL mode, per-thread connections, nested transactions and concurrent writers """
+    import shutil
+    import tempfile
+    directory = tempfile.mkdtemp()
+    try:
+        test = Cache_Database(database_name=os.path.join(directory, "test_cache.db"))
+        assert test.cursor.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+        connections = []
+        thread = threading.Thread(target=lambda: connections.append(test.connection))
+        thread.start()
+        thread.join()
+        assert connections[0] is not test.connection
+        assert len(test.connections) == 2, test.connections
+
+        try:
+            with test.transaction():
+                test.add_to_counters({"hits" : 1})
+                with test.transaction():
+                    test.add_to_counters({"hits" : 1})
+                raise ValueError()
+        except ValueError:
+            pass
+        assert test.query("Cache_Counters", where={"name" : "hits"}) == [], "transaction was not rolled back"
+
+        other = Cache_Database(database_name=test.database_name)
+        def add_counts(database):
+            for count in range(50):
+                with database.transaction():
+                    database.add_to_counters({"hits" : 1})
+        threads = [threading.Thread(target=add_counts, args=(database, )) for database in (test, test, other, other)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert test.query("Cache_Counters", retrieve_fields=("value", ), where={"name" : "hits"}) == 200
+        other.delete()
+        test.delete()
+    finally:
+        shutil.rmtree(directory)
+
 if __name__ == "__main__":
     test_db()
+    test_cache_db()
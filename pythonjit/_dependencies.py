@@ -0,0 +1,115 @@
+""" Finds the files that the compiled version of a module depends on besides its source file.
+
+Cython compiles a python module with its augmenting .pxd file (module.pxd next to module.py). The .pxd file may cimport the declarations of other modules (their .pxd files), include .pxi files and declare functions from C headers, and each of those files may depend on more files in turn. When one of them changes, the module has to be compiled again even though its own source did not change, or its compiled version may give wrong answers or crash.
+
+`find_dependencies` finds these files the way Cython does, by scanning for cimport, include and `cdef extern from` statements in the style of `Cython.Build.Dependencies`, without importing Cython. `Import_Hook` records the dependencies of each module with their digests, and makes the digests part of the build key of the module (see `dependencies_digest`), so that the modules that depend on a changed file are compiled again, and no others.
+
+The declarations that come with Cython (libc, cpython, ...) are covered by the Cython version in the build key, and are not found as dependencies. cimports, includes and headers that are not found are left out.
+
+This module is a utility used by the library, and is not intended to be used in any other capacity."""
+import os
+import re
+import sys
+import hashlib
+
+__all__ = ("find_dependencies", "immediate_dependencies", "dependencies_digest")
+
+COMMENT = re.compile(r"#[^\n]*")
+DEPENDENCY = re.compile(r"^[ \t]*(?:from[ \t]+(?P<package>\.*[\w.]*)[ \t]+cimport[ \t]+(?P<names>[^\n]+)|"
+                        r"cimport[ \t]+(?P<modules>[^\n]+)|"
+                        r"include[ \t]+['\"](?P<include>[^'\"]+)['\"]|"
+                        r"cdef[ \t]+extern[ \t]+from[ \t]+['\"](?P<header>[^'\"]+)['\"])", re.M)
+
+def find_dependencies(pxd_file, path=None):
+    """ usage: find_dependencies(pxd_file, path=None) => sorted list of file names
+
+        Returns pxd_file (the augmenting .pxd file of a module), and the .pxd, .pxi and header files that it depends on, directly or through the files it depends on (see immediate_dependencies).
+        path is the list of directories that cimports and includes are searched for in after the directory of the top level package; sys.path if None. """
+    dependencies = set()
+    pending = [os.path.abspath(pxd_file)]
+    while pending:
+        filename = pending.pop()
+        if filename in dependencies:
+            continue
+        dependencies.add(filename)
+        if os.path.splitext(filename)[1] in (".pxd", ".pxi"):
+            pending.extend(immediate_dependencies(filename, path))
+    return sorted(dependencies)
+
+def immediate_dependencies(filename, path=None):
+    """ usage: immediate_dependencies(filename, path=None) => list of file names
+
+        Returns the files that the .pxd or .pxi file filename cimports, includes or declares externs from.
+        cimported modules are searched for in the directory that the top level package of filename is in, and then in path (sys.path if None). Included files and headers are searched for in the directory of filename first. """
+    with open(filename, 'r') as _file:
+        text = COMMENT.sub('', _file.read())
+    directory = os.path.dirname(filename)
+    search_path = [package_root(directory)] + [os.path.abspath(entry) for entry in
+                                               (sys.path if path is None else path) if
+                                               isinstance(entry, basestring)]
+    found = []
+    for match in DEPENDENCY.finditer(text):
+        if match.group("package") is not None:
+            package = match.group("package")
+            if package.startswith('.'):
+                package = relative_module(directory, package)
+            for name in split_names(match.group("names")):
+                # "from package cimport module" cimports package/module.pxd, or a name declared in package.pxd
+                found.append(find_pxd("{}.{}".format(package, name), search_path) or find_pxd(package, search_path))
+        elif match.group("modules") is not None:
+            found.extend(find_pxd(module, search_path) for module in split_names(match.group("modules")))
+        else:
+            found.append(find_file(match.group("include") or match.group("header"), [directory] + search_path))
+    return [dependency for dependency in found if dependency is not None]
+
+def split_names(names):
+    """ Returns the module names in the text after a cimport keyword, without "as" clauses and parentheses. """
+    names = names.strip().strip("()")
+    return [name.split()[0] for name in names.split(',') if name.strip()]
+
+def package_root(directory):
+    """ Returns the directory that the top level package of the package in directory is in, or directory if it is not a package. """
+    while (os.path.isfile(os.path.join(directory, "__init__.py")) or
+           os.path.isfile(os.path.join(directory, "__init__.pxd"))):
+        directory = os.path.dirname(directory)
+    return directory
+
+def relative_module(directory, module):
+    """ Returns the full name of module (a relative module name such as .module or ..package.module) as seen from the package in directory. """
+    level = len(module) - len(module.lstrip('.'))
+    parts = []
+    while (os.path.isfile(os.path.join(directory, "__init__.py")) or
+           os.path.isfile(os.path.join(directory, "__init__.pxd"))):
+        directory, name = os.path.split(directory)
+        parts.insert(0, name)
+    parts = parts[:len(parts) - level + 1]
+    return '.'.join(parts + [module.lstrip('.')] if module.lstrip('.') else parts)
+
+def find_pxd(module, search_path):
+    """ Returns the .pxd file of the dotted module name module (module.pxd, or the __init__.pxd file of a package) in the first directory of search_path that has it, or None. """
+    parts = module.split('.')
+    for directory in search_path:
+        base = os.path.join(directory, *parts)
+        for filename in (base + ".pxd", os.path.join(base, "__init__.pxd")):
+            if os.path.isfile(filename):
+                return filename
+    return None
+
+def find_file(name, search_path):
+    """ Returns the file name in the first directory of search_path that has a file called name, or None. """
+    for directory in search_path:
+        filename = os.path.join(directory, name)
+        if os.path.isfile(filename):
+            return os.path.abspath(filename)
+    return None
+
+def dependencies_digest(digests):
+    """ usage: dependencies_digest(digests) => str or None
+
+        Returns one digest for the dependencies of a module. digests is an iterable with a (file name, digest, ...) entry for each dependency.
+        Only the base names of the files are part of the digest, so that a module whose dependencies are in another checkout or virtualenv has the same digest.
+        Returns None if digests is empty. """
+    lines = sorted("{} {}\n".format(os.path.basename(entry[0]), entry[1]) for entry in digests)
+    if not lines:
+        return None
+    return hashlib.sha256(''.join(lines)).hexdigest()
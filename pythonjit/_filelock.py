@@ -0,0 +1,100 @@
+""" Provides an inter-process lock based on lock files.
+
+Import_Hook uses these locks so that only one process compiles a given module at a time, e.g. when many workers of a pre-forking server import the same freshly deployed module.
+
+This module is a utility used by the library, and is not intended to be used in any other capacity."""
+import time
+import errno
+
+try:
+    import fcntl
+except ImportError: # windows
+    fcntl = None
+    import msvcrt
+
+__all__ = ("File_Lock", )
+
+class File_Lock(object):
+    """ An exclusive lock held on the file indicated by filename.
+
+        The lock is released when release is called, when the File_Lock is garbage collected, or when the process exits.
+        Usable as a context manager, which acquires the lock (blocking) on entry and releases it on exit. """
+
+    poll_interval = .05
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._file = None
+
+    def acquire(self, blocking=True):
+        """ usage: acquire(blocking=True) => bool
+
+            Acquires the lock. If blocking is False, returns False immediately if another process holds the lock.
+            Returns True when the lock has been acquired. """
+        if self._file is None:
+            self._file = open(self.filename, 'a+')
+        if fcntl is not None:
+            try:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except IOError as error:
+                if error.errno not in (errno.EAGAIN, errno.EACCES):
+                    raise
+                return False
+            return True
+        else:
+            self._file.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(self._file.fileno(), msvcrt.LK_NBLCK, 1)
+                except IOError:
+                    if not blocking:
+                        return False
+                    time.sleep(self.poll_interval)
+                else:
+                    return True
+
+    def release(self):
+        """ Releases the lock. Does nothing if the lock is not held. """
+        if self._file is not None:
+            if fcntl is not None:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+            else:
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, _type, value, traceback):
+        self.release()
+
+    def __del__(self):
+        if self._file is not None:
+            self._file.close()
+
+
+def test_file_lock():
+    """ Unit test for File_Lock objects """
+    import os
+    import tempfile
+    filename = tempfile.mktemp(suffix=".lock")
+    try:
+        first = File_Lock(filename)
+        second = File_Lock(filename)
+        assert first.acquire(blocking=False)
+        assert not second.acquire(blocking=False), "two holders of one lock"
+        first.release()
+        assert second.acquire(blocking=False)
+        second.release()
+        with first:
+            assert not second.acquire(blocking=False)
+        assert second.acquire(blocking=False)
+        second.release()
+    finally:
+        os.remove(filename)
+
+if __name__ == "__main__":
+    test_file_lock()
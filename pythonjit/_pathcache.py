@@ -0,0 +1,113 @@
+""" Provides a cache of directory listings for finding modules, in the style of importlib's FileFinder.
+
+imp.find_module tries every file name a module could have (a package directory, .so, module.so, .py, .pyc) in every directory of the path, which costs several stat calls per directory for every import. `Path_Cache` keeps a listing of each directory with the directory's modification time, and finds modules by looking their file names up in the listings. A directory is listed again when its modification time changes, so files created by other processes (or by the compile server) are found, at the cost of one stat call per directory instead of one per file name.
+
+`Import_Hook` also invalidates the directories it links compiled files into, because a file can be added within the resolution of the modification time.
+
+This module is a utility used by the library, and is not intended to be used in any other capacity."""
+import os
+import sys
+import imp
+
+__all__ = ("Path_Cache", )
+
+class Path_Cache(object):
+    """ usage: Path_Cache() => path_cache
+
+        Finds module files (see find_module) and checks whether files exist (see exists) using cached directory listings. """
+
+    def __init__(self):
+        self.listings = dict()
+        self.suffixes = [suffix for suffix, mode, kind in imp.get_suffixes()]
+        self.package_files = ["__init__" + suffix for suffix, mode, kind in imp.get_suffixes() if
+                              kind in (imp.PY_SOURCE, imp.PY_COMPILED)]
+
+    def listdir(self, directory):
+        """ Returns the set of names in directory, which is listed again only if its modification time changed since it was last listed.
+            The set is empty if directory does not exist or is not a directory. """
+        try:
+            mtime = os.stat(directory or os.curdir).st_mtime
+        except OSError:
+            mtime = None
+        try:
+            listed_mtime, names = self.listings[directory]
+        except KeyError:
+            pass
+        else:
+            if listed_mtime == mtime:
+                return names
+        try:
+            names = frozenset(os.listdir(directory or os.curdir))
+        except OSError:
+            names = frozenset()
+        self.listings[directory] = (mtime, names)
+        return names
+
+    def exists(self, filename):
+        """ Returns True if the listing of the directory of filename has the name of filename. """
+        directory, name = os.path.split(filename)
+        return name in self.listdir(directory)
+
+    def find_module(self, module, path=None):
+        """ usage: find_module(module, path=None) => file name or None
+
+            Returns the file name that imp.find_module(module, path) finds: the directory of a package, or the file of a module.
+            Returns None if no directory of path (sys.path if path is None) has the module, and for built in and frozen modules. """
+        if path is None:
+            if imp.is_builtin(module) or imp.is_frozen(module):
+                return None
+            path = sys.path
+        for directory in path:
+            if not isinstance(directory, basestring):
+                continue
+            names = self.listdir(directory)
+            if module in names:
+                package = os.path.join(directory, module)
+                package_names = self.listdir(package)
+                if any(name in package_names for name in self.package_files):
+                    return package
+            for suffix in self.suffixes:
+                if module + suffix in names:
+                    return os.path.join(directory, module + suffix)
+        return None
+
+    def invalidate(self, directory=None):
+        """ Forgets the listing of directory, or of every directory if directory is None, so that it is listed again when it is next asked for. """
+        if directory is None:
+            self.listings.clear()
+        else:
+            self.listings.pop(directory, None)
+
+
+def test_path_cache():
+    """ Unit test for Path_Cache objects """
+    import shutil
+    import tempfile
+    directory = tempfile.mkdtemp()
+    try:
+        open(os.path.join(directory, "first.py"), 'w').close()
+        os.mkdir(os.path.join(directory, "package"))
+        open(os.path.join(directory, "package", "__init__.py"), 'w').close()
+        path_cache = Path_Cache()
+        assert path_cache.find_module("first", [directory]) == os.path.join(directory, "first.py")
+        assert path_cache.find_module("package", [directory]) == os.path.join(directory, "package")
+        assert path_cache.find_module("second", [directory]) is None
+        assert path_cache.find_module("os") is not None
+
+        mtime = os.stat(directory).st_mtime
+        open(os.path.join(directory, "second.py"), 'w').close()
+        os.utime(directory, (mtime + 10, mtime + 10))
+        assert path_cache.find_module("second", [directory]) == os.path.join(directory, "second.py"), "not listed again after the directory changed"
+
+        os.remove(os.path.join(directory, "second.py"))
+        os.utime(directory, (mtime + 20, mtime + 20))
+        assert path_cache.find_module("second", [directory]) is None, "not listed again after the directory changed"
+
+        names = path_cache.listdir(directory)
+        path_cache.invalidate(directory)
+        assert path_cache.listdir(directory) is not names
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    test_path_cache()
@@ -0,0 +1,52 @@
+""" Provides a sampling profiler that measures how much CPU time is spent in each module.
+
+`Import_Hook` uses it (when enabled with `profile=True`) to record the CPU time of modules in the cache database, so that a compile policy can compile only the modules that dominate the runtime.
+
+The profiler uses `signal.setitimer(signal.ITIMER_PROF, ...)`, so it is only available on platforms that have setitimer (not Windows), and only samples the main thread.
+A sample is attributed to the module of the innermost python frame. Compiled modules do not create python frames, so their time is attributed to the interpreted code that called them.
+
+This module is a utility used by the library, and is not intended to be used in any other capacity."""
+import signal
+import collections
+
+__all__ = ("Sampling_Profiler", "SAMPLE_INTERVAL")
+
+SAMPLE_INTERVAL = .01
+
+class Sampling_Profiler(object):
+    """ Counts the module that is executing every interval seconds of CPU time. """
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        if not hasattr(signal, "setitimer"):
+            raise ValueError("Profiling requires signal.setitimer, which is not available on this platform")
+        self.interval = interval
+        self.samples = collections.defaultdict(int)
+        self.previous_handler = None
+        self.running = False
+
+    def start(self):
+        """ Starts sampling. Must be called from the main thread. """
+        if not self.running:
+            self.previous_handler = signal.signal(signal.SIGPROF, self.sample)
+            signal.siginterrupt(signal.SIGPROF, False) # restart system calls that a sample interrupts, instead of failing with EINTR
+            signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+            self.running = True
+
+    def stop(self):
+        """ Stops sampling and restores the SIGPROF handler that was installed before start was called. """
+        if self.running:
+            signal.setitimer(signal.ITIMER_PROF, 0, 0)
+            signal.signal(signal.SIGPROF, self.previous_handler or signal.SIG_DFL)
+            self.running = False
+
+    def sample(self, signal_number, frame):
+        if frame is not None:
+            self.samples[frame.f_globals.get("__name__")] += 1
+
+    def collect(self):
+        """ usage: collect() => dict of module_name : seconds
+
+            Returns the CPU time measured for each module since the last call to collect. """
+        samples, self.samples = self.samples, collections.defaultdict(int)
+        return dict((module_name, count * self.interval) for
+                    module_name, count in samples.items() if module_name is not None)
@@ -0,0 +1,256 @@
+""" Records the types of the arguments, local variables and return values of functions while they run interpreted, and turns them into Cython declarations.
+
+The declarations are written as [augmenting .pxd files](http://docs.cython.org/en/latest/src/tutorial/pure.html#augmenting-pxd), which type module level functions without changes to their source code:
+
+    cimport cython
+
+    @cython.locals(total=cython.double, index=cython.long)
+    cpdef double function(long count, double scale=*) except? -1
+
+Only the types that have a direct C equivalent are declared (int as long, float as double and bool as bint). A variable that was observed with more than one type is flagged in the .pxd file and left untyped.
+Only module level functions are declared; methods, generators, functions that take *args or **kwargs and functions that contain nested functions (including lambdas and generator expressions) are skipped, because Cython does not support them as cpdef functions.
+
+Observations are kept in a .json file per module in the types directory and merged across runs, as long as the source of the module does not change. The .pxd file names the digest of the source it was generated from, so that declarations for an older version of the source are never used (see find_declarations).
+
+Declared types are assumptions about future calls: e.g. a variable that was only ever seen holding small integers becomes a C long, which wraps around instead of becoming a python long.
+
+This module is a utility used by the library, and is not intended to be used in any other capacity."""
+import os
+import sys
+import json
+import threading
+import collections
+import distutils.sysconfig
+
+import _artifacts
+import _filelock
+
+__all__ = ("Type_Tracer", "TYPES_DIR", "find_declarations", "generate_declarations")
+
+TYPES_DIR = os.path.join(os.path.expanduser("~"), "pythonjit", "types")
+C_TYPES = {"int" : "long", "float" : "double", "bool" : "bint"}
+EXCEPTION_VALUES = {"long" : " except? -1", "double" : " except? -1", "bint" : " except *"} # so exceptions propagate
+DIGEST_PREFIX = "# source_digest "
+CO_VARARGS, CO_VARKEYWORDS, CO_GENERATOR = 0x04, 0x08, 0x20
+STANDARD_LIBRARY = distutils.sysconfig.get_python_lib(standard_lib=True)
+SITE_PACKAGES = distutils.sysconfig.get_python_lib()
+
+def type_name(value):
+    """ Returns the name of the type of value, qualified by its module unless it is a builtin type. """
+    _type = type(value)
+    if _type.__module__ == "__builtin__":
+        return _type.__name__
+    return "{}.{}".format(_type.__module__, _type.__name__)
+
+class Type_Tracer(object):
+    """ Observes the types in module level functions while they run, via sys.settrace.
+
+        modules is a set of module names to trace. Modules inside the listed packages are traced as well. If modules is None, every module outside of the standard library is traced.
+        The set may be added to while the tracer is running (Import_Hook adds modules as they are imported).
+
+        Tracing slows down the traced functions considerably, and only sees interpreted code. """
+
+    def __init__(self, modules=None):
+        self.modules = modules
+        self.targets = dict()
+        self.observations = dict()
+        self.sources = dict()
+        self.raised = set()
+        self.previous_tracer = None
+        self.running = False
+
+    def start(self):
+        """ Starts tracing the current thread and threads started afterwards. """
+        if not self.running:
+            self.previous_tracer = sys.gettrace()
+            sys.settrace(self.trace_call)
+            threading.settrace(self.trace_call)
+            self.running = True
+
+    def stop(self):
+        """ Stops tracing. Restores the trace function of the current thread that was installed when start was called. """
+        if self.running:
+            sys.settrace(self.previous_tracer)
+            threading.settrace(None)
+            self.running = False
+
+    def is_traced_module(self, module_name, filename):
+        """ Returns True if the functions of module_name (whose source is the file filename) should be traced. """
+        if module_name is None or module_name == "__main__" or module_name.split('.', 1)[0] == "pythonjit":
+            return False
+        if self.modules is None:
+            return not (filename.startswith(STANDARD_LIBRARY) and not filename.startswith(SITE_PACKAGES))
+        if module_name in self.modules:
+            return True
+        package = module_name
+        while '.' in package:
+            package = package.rsplit('.', 1)[0]
+            if package in self.modules:
+                return True
+        return False
+
+    def get_target(self, frame):
+        """ Returns the observations for the function running in frame, or None if it is not traced. """
+        code = frame.f_code
+        try:
+            return self.targets[code]
+        except KeyError:
+            pass
+        target = None
+        module_name = frame.f_globals.get("__name__")
+        function = frame.f_globals.get(code.co_name)
+        if (getattr(function, "func_code", None) is code and
+            not code.co_flags & (CO_VARARGS | CO_VARKEYWORDS | CO_GENERATOR) and
+            not code.co_cellvars and not code.co_freevars and
+            not any(hasattr(constant, "co_code") for constant in code.co_consts) and
+            self.is_traced_module(module_name, code.co_filename)):
+            functions = self.observations.setdefault(module_name, dict())
+            target = functions[code.co_name] = {"arguments" : list(code.co_varnames[:code.co_argcount]),
+                                                "defaults" : len(function.func_defaults or ()),
+                                                "variables" : collections.defaultdict(set),
+                                                "returns" : set()}
+            self.sources.setdefault(module_name, code.co_filename)
+        self.targets[code] = target
+        return target
+
+    def trace_call(self, frame, event, argument):
+        if event != "call":
+            return None
+        target = self.get_target(frame)
+        if target is None:
+            return None
+        variables = target["variables"]
+        _locals = frame.f_locals
+        for name in target["arguments"]:
+            variables[name].add(type_name(_locals[name]))
+        return self.trace_line
+
+    def trace_line(self, frame, event, argument):
+        if event == "exception":
+            self.raised.add(frame)
+            return self.trace_line
+        target = self.targets[frame.f_code]
+        variables = target["variables"]
+        for name, value in frame.f_locals.items():
+            variables[name].add(type_name(value))
+        if event == "line":
+            self.raised.discard(frame) # the exception was handled
+        elif event == "return":
+            if frame in self.raised: # returning because of an exception; there is no return value
+                self.raised.discard(frame)
+            else:
+                target["returns"].add(type_name(argument))
+        return self.trace_line
+
+    def save(self, types_dir=TYPES_DIR):
+        """ usage: save(types_dir=TYPES_DIR) => list of (module_name, .pxd file name or None, conflicts)
+
+            Merges the observations into the .json file of each traced module in types_dir, and writes the .pxd file generated from the merged observations.
+            Observations recorded for a different version of a module's source are discarded.
+            conflicts is a list of (function name, variable name, types) entries for the variables that were left untyped because they were seen with several types. The return value of a function is named "return"."""
+        _artifacts.make_directory(types_dir)
+        saved = []
+        for module_name, functions in sorted(self.observations.items()):
+            source_file = self.sources[module_name]
+            if not os.path.isfile(source_file):
+                continue
+            source_digest = _artifacts.file_digest(source_file)
+            json_file = os.path.join(types_dir, module_name + ".json")
+            pxd_file = os.path.join(types_dir, module_name + ".pxd")
+            with _filelock.File_Lock(json_file + ".lock"):
+                record = load_record(json_file)
+                if record.get("source_digest") != source_digest:
+                    record = {"source_digest" : source_digest, "functions" : dict()}
+                for function_name, target in functions.items():
+                    entry = record["functions"].setdefault(function_name,
+                                                           {"arguments" : target["arguments"],
+                                                            "defaults" : target["defaults"],
+                                                            "variables" : dict(), "returns" : []})
+                    for name, types in target["variables"].items():
+                        entry["variables"][name] = sorted(set(entry["variables"].get(name, ())) | types)
+                    entry["returns"] = sorted(set(entry["returns"]) | target["returns"])
+                declarations, conflicts = generate_declarations(module_name, record)
+                write_file(json_file, json.dumps(record, indent=1, sort_keys=True))
+                if declarations is not None:
+                    write_file(pxd_file, declarations)
+                elif os.path.exists(pxd_file):
+                    os.remove(pxd_file)
+            saved.append((module_name, pxd_file if declarations is not None else None, conflicts))
+        self.observations.clear()
+        self.targets.clear()
+        return saved
+
+def load_record(json_file):
+    """ Returns the observations stored in json_file, or an empty dictionary if there are none. """
+    try:
+        with open(json_file, 'r') as _file:
+            return json.load(_file)
+    except (IOError, ValueError):
+        return dict()
+
+def write_file(filename, data):
+    """ Writes data to filename under a temporary name and renames it into place. """
+    temporary_file = "{}.{}.tmp".format(filename, os.getpid())
+    with open(temporary_file, 'w') as _file:
+        _file.write(data)
+    if os.name == "nt" and os.path.exists(filename):
+        os.remove(filename)
+    os.rename(temporary_file, filename)
+
+def c_type(types):
+    """ Returns the C type for a set of observed type names, or None if there is not exactly one type or it has no C equivalent. """
+    if len(types) == 1:
+        return C_TYPES.get(list(types)[0])
+
+def generate_declarations(module_name, record):
+    """ usage: generate_declarations(module_name, record) => (.pxd source, conflicts)
+
+        Returns the source of an augmenting .pxd file for the observations in record (None if there is nothing to declare), and the variables that were seen with conflicting types (see Type_Tracer.save). """
+    lines = ["# Cython declarations for {}, generated by pythonjit from traced types.".format(module_name),
+             DIGEST_PREFIX + record["source_digest"]]
+    declarations = []
+    conflicts = []
+    for function_name, entry in sorted(record["functions"].items()):
+        variables = entry["variables"]
+        for name, types in sorted(variables.items()):
+            if len(types) > 1:
+                conflicts.append((function_name, name, types))
+        if len(entry["returns"]) > 1:
+            conflicts.append((function_name, "return", entry["returns"]))
+
+        arguments = entry["arguments"]
+        first_default = len(arguments) - entry["defaults"]
+        signature = []
+        for index, name in enumerate(arguments):
+            _type = c_type(variables.get(name, ()))
+            signature.append("{}{}{}".format(_type + ' ' if _type else '', name, "=*" if index >= first_default else ''))
+        _locals = ["{}=cython.{}".format(name, c_type(types)) for name, types in sorted(variables.items()) if
+                   name not in arguments and c_type(types)]
+        return_type = c_type(entry["returns"])
+        if not _locals and not return_type and not any(c_type(variables.get(name, ())) for name in arguments):
+            continue
+        declarations.append('')
+        if _locals:
+            declarations.append("@cython.locals({})".format(", ".join(_locals)))
+        declarations.append("cpdef {}{}({}){}".format(return_type + ' ' if return_type else '', function_name,
+                                                      ", ".join(signature), EXCEPTION_VALUES.get(return_type, '')))
+    if not declarations:
+        return None, conflicts
+    for function_name, name, types in conflicts:
+        lines.append("# {}: {} was seen as {}, left untyped".format(function_name, name, ', '.join(types)))
+    lines.append("cimport cython")
+    return '\n'.join(lines + declarations) + '\n', conflicts
+
+def find_declarations(types_dir, module_name, source_digest):
+    """ usage: find_declarations(types_dir, module_name, source_digest) => .pxd file name or None
+
+        Returns the .pxd file in types_dir for module_name, if it was generated from the source with the digest source_digest. """
+    pxd_file = os.path.join(types_dir, module_name + ".pxd")
+    try:
+        with open(pxd_file, 'r') as _file:
+            _file.readline()
+            digest_line = _file.readline()
+    except IOError:
+        return None
+    if digest_line.strip() == (DIGEST_PREFIX + source_digest).strip():
+        return pxd_file
@@ -6,21 +6,88 @@ API = {"pythonjit.enable" : {"arguments" : None,
                              "keywords" : {"version" : "str", "verbosity" : "int",
                                            "db_name" : "filename str",
                                            "code_dir" : "directory str",
-                                           "ignore_compilation_failure" : "bool"},
+                                           "ignore_compilation_failure" : "bool",
+                                           "background" : "bool",
+                                           "jobs" : "int",
+                                           "strict" : "bool",
+                                           "flush_interval" : "float",
+                                           "artifact_dir" : "directory str",
+                                           "wait_for_lock" : "bool",
+                                           "object_cache" : "directory str",
+                                           "bundle_packages" : "iterable of str",
+                                           "compile_policy" : "callable",
+                                           "profile" : "bool",
+                                           "trace_types" : "bool",
+                                           "types_dir" : "directory str",
+                                           "build_profile" : "str",
+                                           "compile_command" : "str",
+                                           "training_command" : "str",
+                                           "compile_server" : "filename str",
+                                           "cache_bundle" : "filename str",
+                                           "max_cache_size" : "int"},
                              "returns" : None,
-                             "exceptions" : ("Multiple_Enable_Error", )},
+                             "exceptions" : ("Multiple_Enable_Error", "ValueError")},
        "pythonjit.disable" : {"arguments" : None,
                               "returns" : None,
                               "exceptions" : "Not_Enabled_Error"},
+       "pythonjit.wait_for_compilation" : {"arguments" : None,
+                                           "returns" : None,
+                                           "exceptions" : ("Not_Enabled_Error",
+                                                           "Cython_Conversion_Error",
+                                                           "Compilation_Error")},
        "pythonjit.cross_compile" : {"arguments" : ("iterable of str", "iterable of str"),
                                     "keywords" : {"mode" : "str",
                                                   "version" : "str",
                                                   "verbosity" : "int",
-                                                  "compile_command" : "str"},
+                                                  "compile_command" : "str",
+                                                  "jobs" : "int",
+                                                  "object_cache" : "directory str",
+                                                  "bundle" : "filename str",
+                                                  "declarations" : "iterable of filename str",
+                                                  "build_profile" : "str",
+                                                  "training_command" : "str"},
                                     "returns" : ("list of str", ),
                                     "exceptions" : ("Pyx_Conversion_Error",
                                                     "Cython_Conversion_Error",
-                                                    "Compilation_Error")},
+                                                    "Compilation_Error",
+                                                    "ValueError")},
+        "pythonjit.object_cache_stats" : {"arguments" : None,
+                                          "keywords" : {"object_cache" : "directory str"},
+                                          "returns" : ("dict", ),
+                                          "exceptions" : None},
+        "pythonjit.usage_policy" : {"arguments" : None,
+                                    "keywords" : {"min_imports" : "int",
+                                                  "min_cpu_time" : "float"},
+                                    "returns" : ("callable", ),
+                                    "exceptions" : None},
+        "pythonjit.module_usage" : {"arguments" : None,
+                                    "returns" : ("dict", ),
+                                    "exceptions" : ("Not_Enabled_Error", )},
+        "pythonjit.import_overhead" : {"arguments" : None,
+                                       "keywords" : {"count" : "int"},
+                                       "returns" : ("dict", ),
+                                       "exceptions" : ("Not_Enabled_Error", )},
+        "pythonjit.stats" : {"arguments" : None,
+                             "keywords" : {"db_name" : "filename str"},
+                             "returns" : ("dict", ),
+                             "exceptions" : None},
+        "pythonjit.compile_failures" : {"arguments" : None,
+                                        "keywords" : {"db_name" : "filename str"},
+                                        "returns" : ("dict", ),
+                                        "exceptions" : None},
+        "pythonjit.export_cache_bundle" : {"arguments" : ("filename str", ),
+                                           "keywords" : {"db_name" : "filename str",
+                                                         "code_dir" : "directory str",
+                                                         "artifact_dir" : "directory str"},
+                                           "returns" : ("int", ),
+                                           "exceptions" : None},
+        "pythonjit.collect_garbage" : {"arguments" : None,
+                                       "keywords" : {"db_name" : "filename str",
+                                                     "code_dir" : "directory str",
+                                                     "artifact_dir" : "directory str",
+                                                     "max_cache_size" : "int"},
+                                       "returns" : ("dict", ),
+                                       "exceptions" : None},
         "pythonjit.get_file_path" : {"arguments" : ("str", ),
                                      "returns" : ("str", ),
                                      "exceptions" : ("Not_Enabled_Error", )}
@@ -0,0 +1,156 @@
+""" Compares importing a package whose modules are compiled separately with importing the same package compiled into a single bundle.
+
+Running `python benchmarkbundle.py` generates a package with a number of submodules in a temporary directory and compiles it twice:
+
+- separately, with one shared library per module (what `pythonjit.enable()` does by default)
+- as a bundle, with one shared library for the whole package (what `pythonjit.enable(bundle_packages=...)` does)
+
+Every submodule of the package is then imported in a fresh python process for each layout. Both layouts are loaded by `_bundleimporter.Bundle_Importer`, so only the layout of the compiled files differs.
+The time taken by the imports and the growth of the resident set size (RSS) of the process are reported."""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+import pythonjit._artifacts
+import pythonjit._compile
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-n", "--modules", help="The number of submodules to generate (default=100)", type=int, default=100)
+parser.add_argument("-r", "--repeat", help="The number of times to repeat each measurement (default=5)", type=int, default=5)
+parser.add_argument("-j", "--jobs", help="Number of processes used to compile the separate modules; 0 uses one process per CPU (default=0)", type=int, default=0)
+
+PACKAGE_NAME = "benchmark_package"
+MODULE_SOURCE = """import math
+
+class Point_{number}(object):
+
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+
+    def distance(self, other):
+        return math.sqrt((self.x - other.x) ** 2 + (self.y - other.y) ** 2)
+
+def function_{number}(values):
+    return sum(value * {number} for value in values if value % 2)
+
+TABLE = dict((str(number), number) for number in range({number}))
+"""
+
+# runs in a fresh process; prints [seconds, RSS growth in kilobytes]
+IMPORT_SCRIPT = """
+import json
+import sys
+import timeit
+
+import pythonjit._bundleimporter
+
+def resident_memory():
+    try:
+        with open("/proc/self/status", 'r') as _file:
+            for line in _file:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except IOError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+modules = json.loads(sys.argv[1])
+importer = pythonjit._bundleimporter.Bundle_Importer()
+for module_name, (filename, package_path) in modules.items():
+    importer.add_module(module_name, filename, package_path)
+sys.meta_path.insert(0, importer)
+memory = resident_memory()
+start = timeit.default_timer()
+for module_name in sorted(modules):
+    __import__(module_name)
+seconds = timeit.default_timer() - start
+print(json.dumps([seconds, resident_memory() - memory]))
+"""
+
+def create_package(directory, count):
+    """ usage: create_package(directory, count) => list of (module_name, source file path)
+
+        Writes a package with count submodules into directory. """
+    package_dir = os.path.join(directory, PACKAGE_NAME)
+    os.mkdir(package_dir)
+    sources = [(PACKAGE_NAME, os.path.join(package_dir, "__init__.py"))]
+    open(sources[0][1], 'w').close()
+    for number in range(count):
+        module_name = "module_{}".format(number)
+        _path = os.path.join(package_dir, module_name + ".py")
+        with open(_path, 'w') as _file:
+            _file.write(MODULE_SOURCE.format(number=number))
+        sources.append(("{}.{}".format(PACKAGE_NAME, module_name), _path))
+    return sources
+
+def package_path(_path):
+    """ Returns the __path__ of the module in the source file indicated by _path, or None if it is not a package. """
+    return [os.path.dirname(_path)] if os.path.basename(_path) == "__init__.py" else None
+
+def compile_separately(sources, directory, jobs):
+    """ usage: compile_separately(sources, directory, jobs) => dict of module_name : (filename, package path)
+
+        Compiles each module into its own shared library in directory. """
+    output_names = [os.path.join(directory, module_name) for module_name, _path in sources]
+    compiled = pythonjit._compile.cross_compile([_path for module_name, _path in sources], output_names,
+                                                jobs=jobs)
+    return dict((module_name, (filename, package_path(_path))) for
+                (module_name, _path), filename in zip(sources, compiled))
+
+def compile_as_bundle(sources, directory):
+    """ usage: compile_as_bundle(sources, directory) => dict of module_name : (filename, package path)
+
+        Compiles every module into one shared library in directory, and links it once for every module (like Import_Hook does). """
+    bundle = pythonjit._compile.compile_bundle([_path for module_name, _path in sources],
+                                               os.path.join(directory, PACKAGE_NAME))
+    store = pythonjit._artifacts.Artifact_Store(directory)
+    modules = dict()
+    for module_name, _path in sources:
+        filename = os.path.join(directory, "links", "{}.{}".format(module_name, pythonjit._compile.SHARED_LIBRARY))
+        store.link(bundle, filename)
+        modules[module_name] = (filename, package_path(_path))
+    return modules
+
+def time_imports(modules):
+    """ usage: time_imports(modules) => (seconds, kilobytes)
+
+        Imports every module in a new python process, and returns the time taken and the growth of its resident set size. """
+    environment = dict(os.environ)
+    library_dir = os.path.dirname(os.path.dirname(os.path.abspath(pythonjit._compile.__file__)))
+    environment["PYTHONPATH"] = os.pathsep.join(item for item in (library_dir, environment.get("PYTHONPATH")) if item)
+    output = subprocess.check_output([sys.executable, "-c", IMPORT_SCRIPT, json.dumps(modules)],
+                                     env=environment)
+    return tuple(json.loads(output.strip().splitlines()[-1]))
+
+def main():
+    """ Command line program, `main` accepts no arguments. See `python benchmarkbundle.py -h` for usage documentation """
+    args = parser.parse_args()
+    directory = tempfile.mkdtemp()
+    try:
+        sources = create_package(directory, args.modules)
+        layouts = []
+        for name, function, arguments in (("separate", compile_separately, (args.jobs, )),
+                                          ("bundle", compile_as_bundle, ())):
+            output_dir = os.path.join(directory, name)
+            os.mkdir(output_dir)
+            print("Compiling {} modules ({})".format(len(sources), name))
+            layouts.append((name, function(sources, output_dir, *arguments)))
+
+        print("Importing {} modules (best of {}):".format(len(sources), args.repeat))
+        for name, modules in layouts:
+            results = [time_imports(modules) for count in range(args.repeat)]
+            seconds = min(result[0] for result in results)
+            kilobytes = min(result[1] for result in results)
+            print("    {:<10} {:8.1f}ms {:8.1f}us per import {:8} kB RSS growth".format(
+                  name, seconds * 1000, seconds * 1000000 / len(sources), kilobytes))
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    main()
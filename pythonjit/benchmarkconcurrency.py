@@ -0,0 +1,138 @@
+""" Measures many processes importing modules against one cache database at the same time.
+
+Running `python benchmarkconcurrency.py` generates a number of small modules in a temporary directory and records them in a temporary cache as if they had already been compiled (see benchmarkstartup.py). A number of processes are then started at the same time. Each of them repeatedly creates an `Import_Hook` for the shared cache database, calls `find_module` for every module and closes the hook, which writes the import counts and counters of the round to the database in one transaction.
+
+The same workload is run against two databases:
+
+- rollback journal: the database settings of earlier versions of pythonjit (the default rollback journal, deferred transactions and a 5 second busy timeout)
+- WAL: `Cache_Database` as it is used by `Import_Hook`
+
+For each database the number of rounds that failed (e.g. with "database is locked"), the total time, and the median and slowest round are reported, next to the time of a round in a single process. Rounds that take much longer than a single process's round are processes that waited for each other."""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import pythonjit._cythonhook
+import pythonjit.benchmarkstartup
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-p", "--processes", help="The number of processes that use the database at the same time (default=16)", type=int, default=16)
+parser.add_argument("-r", "--rounds", help="The number of rounds each process runs (default=20)", type=int, default=20)
+parser.add_argument("-n", "--modules", help="The number of modules to generate (default=200)", type=int, default=200)
+
+# runs in a fresh process; prints {"rounds" : [seconds, ...], "errors" : [message, ...]}
+WORKER_SCRIPT = """
+import json
+import sys
+import time
+import timeit
+
+import pythonjit._cythonhook
+import pythonjit._database
+
+options = json.loads(sys.argv[1])
+sys.path.insert(0, options["source_dir"])
+if options["legacy"]:
+    import sqlite3
+
+    def open_database(self, database_name, text_factory=None):
+        connection = sqlite3.connect(database_name)
+        connection.text_factory = text_factory
+        connection.execute("PRAGMA journal_mode=DELETE")
+        return connection, connection.cursor()
+    pythonjit._database.Cache_Database.open_database = open_database
+time.sleep(max(0, options["start_at"] - time.time()))
+rounds, errors = [], []
+for number in range(options["rounds"]):
+    start = timeit.default_timer()
+    try:
+        hook = pythonjit._cythonhook.Import_Hook(database_name=options["database_name"],
+                                                 code_dir=options["code_dir"], flush_interval=None)
+        try:
+            for module_name in options["modules"]:
+                hook.find_module(module_name, None)
+            hook.close()
+        finally:
+            sys.meta_path.remove(hook)
+            hook.database.delete()
+    except Exception as error:
+        errors.append("{}: {}".format(type(error).__name__, error))
+    rounds.append(timeit.default_timer() - start)
+print(json.dumps({"rounds" : rounds, "errors" : errors}))
+"""
+
+def run_workers(options, processes):
+    """ usage: run_workers(options, processes) => (seconds, list of round times, list of errors)
+
+        Starts processes worker processes (see WORKER_SCRIPT) with options, which begin their rounds at the same moment.
+        Returns the time from that moment until the last worker finished, and the round times and errors of all workers. """
+    environment = dict(os.environ)
+    library_dir = os.path.dirname(os.path.dirname(os.path.abspath(pythonjit._cythonhook.__file__)))
+    environment["PYTHONPATH"] = os.pathsep.join(item for item in (library_dir, environment.get("PYTHONPATH")) if item)
+    options = dict(options, start_at=time.time() + 1 + .05 * processes) # leaves time for every worker to start python
+    workers = [subprocess.Popen([sys.executable, "-c", WORKER_SCRIPT, json.dumps(options)],
+                                stdout=subprocess.PIPE, env=environment) for number in range(processes)]
+    rounds, errors = [], []
+    for worker in workers:
+        output = worker.communicate()[0]
+        if worker.returncode:
+            errors.append("worker exited with status {}".format(worker.returncode))
+            continue
+        result = json.loads(output.strip().splitlines()[-1])
+        rounds.extend(result["rounds"])
+        errors.extend(result["errors"])
+    return time.time() - options["start_at"], rounds, errors
+
+def benchmark_database(directory, module_names, legacy, processes, rounds):
+    """ usage: benchmark_database(directory, module_names, legacy, processes, rounds) => (single round, (seconds, round times, errors))
+
+        Prepares a cache in directory for module_names, and runs rounds rounds in one process and then in processes processes at the same time (see run_workers).
+        legacy selects the database settings of earlier versions of pythonjit.
+        Returns the median round time of the single process, and the result of the concurrent run. """
+    source_dir = os.path.join(directory, "source")
+    os.mkdir(directory)
+    os.mkdir(source_dir)
+    pythonjit.benchmarkstartup.create_modules(source_dir, len(module_names))
+    options = {"source_dir" : source_dir, "database_name" : os.path.join(directory, "cache.db"),
+               "code_dir" : os.path.join(directory, "compiled"), "modules" : module_names, "legacy" : legacy,
+               "rounds" : rounds}
+    sys.path.insert(0, source_dir)
+    try:
+        pythonjit.benchmarkstartup.prepare_cache(source_dir, module_names, options["database_name"],
+                                                 options["code_dir"])
+    finally:
+        sys.path.remove(source_dir)
+    single_round = median(run_workers(options, 1)[1])
+    return single_round, run_workers(options, processes)
+
+def median(values):
+    """ Returns the median of a non empty list of values. """
+    values = sorted(values)
+    return values[len(values) // 2]
+
+def main():
+    """ Command line program, `main` accepts no arguments. See `python benchmarkconcurrency.py -h` for usage documentation """
+    args = parser.parse_args()
+    module_names = ["benchmark_module_{}".format(number) for number in range(args.modules)]
+    directory = tempfile.mkdtemp()
+    try:
+        print("{} processes x {} rounds of {} imports against one cache database:".format(args.processes, args.rounds,
+                                                                                         args.modules))
+        for name, legacy in (("rollback journal", True), ("WAL", False)):
+            single_round, (seconds, rounds, errors) = benchmark_database(os.path.join(directory, name.split()[0]),
+                                                                         module_names, legacy, args.processes,
+                                                                         args.rounds)
+            print("    {:<18} {:6} failed rounds {:8.1f}ms total {:8.1f}ms median round {:8.1f}ms slowest round ({:.1f}ms in one process)".format(
+                  name, len(errors), seconds * 1000, median(rounds) * 1000, max(rounds) * 1000, single_round * 1000))
+            for error in sorted(set(errors)):
+                print("        {}".format(error))
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+""" Measures how much time Import_Hook spends checking modules that are already compiled (a warm startup).
+
+Running `python benchmarkstartup.py` generates a number of small modules in a temporary directory, records them in a temporary cache as if they had already been compiled, and then times `Import_Hook.find_module` for each of them.
+
+Two hooks are compared:
+
+- `Import_Hook`, which reads the cache database into memory once when it is created
+- `Query_Import_Hook`, which issues a database query for every import (the behavior of earlier versions of pythonjit)
+
+The number of SQLite statements each hook executes is reported alongside the timings: those that load the cache when the hook is created, and those executed afterwards, by the imports and by closing the hook (which writes pending changes). A warm startup with `Import_Hook` should execute none after the load.
+
+A sample application (a package whose modules import each other and some of the standard library) is then started in fresh python processes, in three scenarios:
+
+- interpreted: without pythonjit
+- cold: with pythonjit enabled and an empty cache, so every module is compiled during startup
+- warm: with pythonjit enabled and the cache left by the cold runs
+
+For each scenario the time taken by `import` of the application is reported, along with the time spent in the import hook and the part of it spent compiling (see `pythonjit.import_overhead`). Every cold run starts from a new, empty cache directory, so the results do not depend on earlier runs."""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import timeit
+
+import pythonjit._artifacts
+import pythonjit._cythonhook
+import pythonjit._database
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-n", "--modules", help="The number of modules to generate (default=1000)", type=int, default=1000)
+parser.add_argument("-r", "--repeat", help="The number of times to repeat each measurement (default=5)", type=int, default=5)
+parser.add_argument("-a", "--application_modules", help="The number of modules in the sample application; 0 skips the application benchmark (default=20)", type=int, default=20)
+
+APPLICATION_PACKAGE = "sample_application"
+APPLICATION_MODULE = """import collections
+import json
+import re
+{previous}
+PATTERN = re.compile(r"[a-z]+_{number}")
+
+class Record_{number}(object):
+
+    def __init__(self, name, values):
+        self.name = name
+        self.values = values
+
+    def encode(self):
+        return json.dumps({{"name" : self.name, "values" : self.values}})
+
+def count_words_{number}(text):
+    return collections.Counter(PATTERN.findall(text))
+"""
+
+# runs in a fresh process; prints [seconds, import_overhead() or None]
+STARTUP_SCRIPT = """
+import json
+import sys
+import timeit
+
+options = json.loads(sys.argv[1])
+sys.path.insert(0, options["directory"])
+if options["cache_dir"] is not None:
+    import os
+    import pythonjit
+    cache_dir = options["cache_dir"]
+    pythonjit.enable(db_name=os.path.join(cache_dir, "cache.db"), code_dir=os.path.join(cache_dir, "compiled"),
+                     artifact_dir=os.path.join(cache_dir, "artifacts"),
+                     object_cache=os.path.join(cache_dir, "objects"), types_dir=None)
+start = timeit.default_timer()
+__import__(options["package"])
+seconds = timeit.default_timer() - start
+overhead = pythonjit.import_overhead() if options["cache_dir"] is not None else None
+print(json.dumps([seconds, overhead]))
+"""
+
+class Counting_Cursor(object):
+    """ Wraps a sqlite3 cursor and counts the statements executed through it. """
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self.count = 0
+
+    def execute(self, *args):
+        self.count += 1
+        return self.cursor.execute(*args)
+
+    def executemany(self, *args):
+        self.count += 1
+        return self.cursor.executemany(*args)
+
+    def __getattr__(self, attribute):
+        return getattr(self.cursor, attribute)
+
+class Query_Import_Hook(pythonjit._cythonhook.Import_Hook):
+    """ Import_Hook that queries the database for every import and writes every change immediately. """
+
+    def load_manifest(self):
+        return dict()
+
+    def lookup(self, module_name):
+        fields = [field.split()[0] for field in self.database.database_structure["Source_Info"]]
+        row = self.database.query("Source_Info", retrieve_fields=fields, where={"module_name" : module_name})
+        return dict(zip(fields, row)) if row else None
+
+    def update_db(self, module_name, source_digest, path, signature, artifact_key, dependencies=()):
+        super(Query_Import_Hook, self).update_db(module_name, source_digest, path, signature, artifact_key,
+                                                 dependencies)
+        self.flush()
+
+def create_modules(directory, count):
+    """ usage: create_modules(directory, count) => list of module names
+
+        Writes count small modules into directory. """
+    module_names = []
+    for number in range(count):
+        module_name = "benchmark_module_{}".format(number)
+        with open(os.path.join(directory, module_name + ".py"), 'w') as _file:
+            _file.write("def function(x):\n    return x + {}\n".format(number))
+        module_names.append(module_name)
+    return module_names
+
+def prepare_cache(source_dir, module_names, database_name, code_dir):
+    """ Records the modules in the cache database and creates placeholder compiled files for them,
+        so that the hook considers every module up to date. """
+    hook = pythonjit._cythonhook.Import_Hook(database_name=database_name, code_dir=code_dir,
+                                             flush_interval=None)
+    try:
+        for module_name in module_names:
+            _path = os.path.join(source_dir, module_name + ".py")
+            output_path = hook.get_output_path(_path)
+            pythonjit._artifacts.make_directory(os.path.dirname(output_path))
+            open("{}.{}".format(output_path, hook.library_type), 'w').close()
+            source_digest = hook.obtain_source_digest(_path)
+            hook.update_db(module_name, source_digest, _path,
+                           pythonjit._cythonhook.source_signature(_path),
+                           hook.build_key(module_name, source_digest))
+        hook.flush()
+    finally:
+        sys.meta_path.remove(hook)
+        hook.database.delete()
+
+def time_startup(hook_type, module_names, database_name, code_dir):
+    """ usage: time_startup(hook_type, module_names, database_name, code_dir) => (seconds, load statements, statements)
+
+        Creates a hook of hook_type, calls find_module for every module in module_names and closes the hook.
+        Returns the time taken (including creating the hook), the number of SQLite statements executed while the hook was created, and the number executed by the imports and close.
+        Statements are counted on every connection that the hook's database opens (see Counting_Cursor), in any thread. """
+    cursors = []
+    open_database = pythonjit._database.Cache_Database.open_database
+
+    def counting_open_database(database, database_name, text_factory=None):
+        connection, cursor = open_database(database, database_name, text_factory)
+        cursors.append(Counting_Cursor(cursor))
+        return connection, cursors[-1]
+    pythonjit._database.Cache_Database.open_database = counting_open_database
+    try:
+        start = timeit.default_timer()
+        hook = hook_type(database_name=database_name, code_dir=code_dir)
+        try:
+            load_statements = sum(cursor.count for cursor in cursors)
+            for module_name in module_names:
+                hook.find_module(module_name, None)
+            hook.close()
+            seconds = timeit.default_timer() - start
+        finally:
+            sys.meta_path.remove(hook)
+            hook.database.delete()
+    finally:
+        pythonjit._database.Cache_Database.open_database = open_database
+    return seconds, load_statements, sum(cursor.count for cursor in cursors) - load_statements
+
+def create_application(directory, count):
+    """ usage: create_application(directory, count) => None
+
+        Writes the sample application, a package with count modules, into directory.
+        Each module imports the one before it; the package imports all of them. """
+    package_dir = os.path.join(directory, APPLICATION_PACKAGE)
+    os.mkdir(package_dir)
+    for number in range(count):
+        previous = "from {} import module_{}\n".format(APPLICATION_PACKAGE, number - 1) if number else ''
+        with open(os.path.join(package_dir, "module_{}.py".format(number)), 'w') as _file:
+            _file.write(APPLICATION_MODULE.format(number=number, previous=previous))
+    with open(os.path.join(package_dir, "__init__.py"), 'w') as _file:
+        _file.write(''.join("from {} import module_{}\n".format(APPLICATION_PACKAGE, number) for
+                            number in range(count)))
+
+def time_application(directory, cache_dir):
+    """ usage: time_application(directory, cache_dir) => (seconds, import overhead)
+
+        Imports the sample application in directory in a new python process, with pythonjit enabled and its caches in cache_dir, or interpreted if cache_dir is None.
+        Returns the time the import took and the result of pythonjit.import_overhead (None when interpreted). """
+    environment = dict(os.environ)
+    library_dir = os.path.dirname(os.path.dirname(os.path.abspath(pythonjit._cythonhook.__file__)))
+    environment["PYTHONPATH"] = os.pathsep.join(item for item in (library_dir, environment.get("PYTHONPATH")) if item)
+    options = {"directory" : directory, "cache_dir" : cache_dir, "package" : APPLICATION_PACKAGE}
+    output = subprocess.check_output([sys.executable, "-c", STARTUP_SCRIPT, json.dumps(options)],
+                                     env=environment)
+    return tuple(json.loads(output.strip().splitlines()[-1]))
+
+def benchmark_application(directory, count, repeat):
+    """ usage: benchmark_application(directory, count, repeat) => list of (scenario, seconds, import overhead)
+
+        Times the startup of a sample application with count modules, interpreted and with a cold and a warm cache (see time_application).
+        Each scenario is run repeat times, and the fastest run is returned. """
+    application_dir = os.path.join(directory, "application")
+    os.mkdir(application_dir)
+    create_application(application_dir, count)
+    results = [("interpreted", ) + min(time_application(application_dir, None) for number in range(repeat))]
+    cold_runs = []
+    for number in range(repeat):
+        cache_dir = os.path.join(directory, "cache_{}".format(number))
+        cold_runs.append(time_application(application_dir, cache_dir))
+    results.append(("cold", ) + min(cold_runs))
+    results.append(("warm", ) + min(time_application(application_dir, cache_dir) for number in range(repeat)))
+    return results
+
+def main():
+    """ Command line program, `main` accepts no arguments. See `python benchmarkstartup.py -h` for usage documentation """
+    args = parser.parse_args()
+    directory = tempfile.mkdtemp()
+    try:
+        source_dir = os.path.join(directory, "source")
+        os.mkdir(source_dir)
+        database_name = os.path.join(directory, "cache.db")
+        code_dir = os.path.join(directory, "compiled")
+        module_names = create_modules(source_dir, args.modules)
+        prepare_cache(source_dir, module_names, database_name, code_dir)
+        sys.path.insert(0, source_dir)
+
+        print("Warm startup with {} compiled modules (best of {}):".format(args.modules, args.repeat))
+        for hook_type in (Query_Import_Hook, pythonjit._cythonhook.Import_Hook):
+            results = [time_startup(hook_type, module_names, database_name, code_dir) for
+                       count in range(args.repeat)]
+            seconds, load_statements, statements = min(results)
+            print("    {:<20} {:8.1f}ms total {:8.1f}us per import {:6} SQLite statements to load {:6} after".format(
+                  hook_type.__name__, seconds * 1000, seconds * 1000000 / args.modules, load_statements, statements))
+
+        if args.application_modules > 0:
+            print("Sample application with {} modules (best of {}):".format(args.application_modules, args.repeat))
+            for scenario, seconds, overhead in benchmark_application(directory, args.application_modules,
+                                                                     args.repeat):
+                line = "    {:<12} {:8.1f}ms import".format(scenario, seconds * 1000)
+                if overhead is not None:
+                    line += " {:8.1f}ms in the hook ({:.1f}ms compiling) {:6.1f}us per import for {} imports".format(
+                            overhead["seconds"] * 1000, overhead["compile_seconds"] * 1000,
+                            overhead["per_import"] * 1000000, overhead["imports"])
+                print(line)
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+""" Benchmarks functions of a module interpreted and compiled, and keeps the results so that performance regressions can be spotted. See `python benchmarksuite.py -h` for usage.
+
+Benchmarks are functions that take no arguments. They are registered in the module that defines them with the `register` decorator:
+
+    from pythonjit.benchmarksuite import register
+
+    @register
+    def benchmark_sum():
+        return sum(x * x for x in range(10000))
+
+or named on the command line with `-f`.
+
+The module is compiled with the chosen build profile (see `pythonjit.BUILD_PROFILES`), and then imported in two fresh python processes: one loads the source (interpreted) and one loads the compiled library. Each benchmark is run a number of warmup times and then timed over a number of trials. The median and the spread (interquartile range) of the time per call are reported, along with the speedup of the compiled module.
+
+The results are stored in the Benchmark_Results table of the cache database with the build profile and the toolchain (python ABI, Cython and compiler versions). When a benchmark is slower than the previous result for the same build profile by more than the tolerance, it is reported as a regression and the program exits with status 1.
+
+    python benchmarksuite.py mymodule.py -P fast -t 20"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import cython
+
+import pythonjit._artifacts
+import pythonjit._compile
+import pythonjit._cythonhook
+import pythonjit._database
+
+parser = argparse.ArgumentParser()
+parser.add_argument("source_filename", help="The python module that contains the benchmarks")
+parser.add_argument("-f", "--function", help="Benchmark this function of the module instead of the registered benchmarks; may be given several times", action="append", dest="functions")
+parser.add_argument("-P", "--profile", help="The build profile to compile with: {} (default={})".format(', '.join(sorted(pythonjit._compile.BUILD_PROFILES)), pythonjit._compile.DEFAULT_PROFILE), choices=sorted(pythonjit._compile.BUILD_PROFILES), default=pythonjit._compile.DEFAULT_PROFILE)
+parser.add_argument("-T", "--training_command", help="A shell command that exercises the compiled module, for the pgo profile")
+parser.add_argument("-t", "--trials", help="The number of timed trials (default=10)", type=int, default=10)
+parser.add_argument("-w", "--warmup", help="The number of untimed calls before the trials (default=2)", type=int, default=2)
+parser.add_argument("-n", "--number", help="The number of calls per trial (default=1)", type=int, default=1)
+parser.add_argument("-d", "--db_name", help="The database to store results in (default={})".format(pythonjit._cythonhook.DEFAULT_DB), default=pythonjit._cythonhook.DEFAULT_DB)
+parser.add_argument("--tolerance", help="The slowdown relative to the previous result that counts as a regression (default=0.1)", type=float, default=.1)
+parser.add_argument("--no_store", help="Do not store the results", action="store_true")
+
+BENCHMARKS = []
+
+# runs in a fresh process; prints a dictionary of function name : list of seconds per call
+TRIAL_SCRIPT = """
+import imp
+import json
+import sys
+import timeit
+
+import pythonjit.benchmarksuite
+
+options = json.loads(sys.argv[1])
+sys.path.insert(0, options["directory"])
+if options["library"] is None:
+    module = imp.load_source(options["module_name"], options["source_file"])
+else:
+    module = imp.load_dynamic(options["module_name"], options["library"])
+if options["functions"]:
+    functions = [(name, getattr(module, name)) for name in options["functions"]]
+else:
+    functions = [(function.__name__, function) for function in pythonjit.benchmarksuite.BENCHMARKS]
+results = dict()
+for name, function in functions:
+    for count in range(options["warmup"]):
+        function()
+    timings = results[name] = []
+    for trial in range(options["trials"]):
+        start = timeit.default_timer()
+        for count in range(options["number"]):
+            function()
+        timings.append((timeit.default_timer() - start) / options["number"])
+print(json.dumps(results))
+"""
+
+def register(function):
+    """ usage: @register => function
+
+        Decorator that registers a function that takes no arguments as a benchmark of its module. """
+    BENCHMARKS.append(function)
+    return function
+
+def percentile(values, fraction):
+    """ Returns the value at fraction (0.0 to 1.0) of the sorted values, interpolating between neighbours. """
+    values = sorted(values)
+    position = (len(values) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+def summarize(timings):
+    """ usage: summarize(timings) => dict
+
+        Returns the median, spread (interquartile range), minimum and number of trials of a list of timings. """
+    return {"median" : percentile(timings, .5), "spread" : percentile(timings, .75) - percentile(timings, .25),
+            "min" : min(timings), "trials" : len(timings)}
+
+def toolchain():
+    """ Returns a string that identifies the python ABI, Cython version and compiler that modules are compiled with. """
+    try:
+        compiler = subprocess.check_output(["gcc", "--version"], stderr=subprocess.STDOUT).splitlines()[0]
+    except (OSError, subprocess.CalledProcessError, IndexError):
+        compiler = "unknown compiler"
+    return "{}; Cython {}; {}".format(pythonjit._artifacts.python_abi(), cython.__version__, compiler)
+
+def run_trials(source_file, library, functions, trials, warmup, number):
+    """ usage: run_trials(source_file, library, functions, trials, warmup, number) => dict of name : timings
+
+        Imports the module in source_file in a new python process, from the compiled file library, or interpreted if library is None, and times its benchmarks. """
+    module_name = os.path.splitext(os.path.basename(source_file))[0]
+    options = {"module_name" : module_name, "source_file" : os.path.abspath(source_file),
+               "directory" : os.path.dirname(os.path.abspath(source_file)), "library" : library,
+               "functions" : functions, "trials" : trials, "warmup" : warmup, "number" : number}
+    environment = dict(os.environ)
+    library_dir = os.path.dirname(os.path.dirname(os.path.abspath(pythonjit._compile.__file__)))
+    environment["PYTHONPATH"] = os.pathsep.join(item for item in (library_dir, environment.get("PYTHONPATH")) if item)
+    output = subprocess.check_output([sys.executable, "-c", TRIAL_SCRIPT, json.dumps(options)], env=environment)
+    return json.loads(output.strip().splitlines()[-1])
+
+def run_benchmarks(source_file, functions=None, build_profile=pythonjit._compile.DEFAULT_PROFILE, trials=10,
+                   warmup=2, number=1, training_command=None):
+    """ usage: run_benchmarks(source_file, functions=None, build_profile=DEFAULT_PROFILE, trials=10,
+                              warmup=2, number=1, training_command=None) => dict of name : result
+
+        Compiles the module in source_file with build_profile, and times its benchmarks interpreted and compiled (see run_trials).
+        functions is a list of names of functions in the module to benchmark, or None for the functions registered with register.
+        Each result is a dictionary with the interpreted and compiled summaries (see summarize) and the speedup of the compiled median over the interpreted median. """
+    directory = tempfile.mkdtemp()
+    try:
+        module_name = os.path.splitext(os.path.basename(source_file))[0]
+        library = pythonjit._compile.cross_compile([source_file], [os.path.join(directory, module_name)],
+                                                   build_profile=build_profile,
+                                                   training_command=training_command)[0]
+        interpreted = run_trials(source_file, None, functions, trials, warmup, number)
+        compiled = run_trials(source_file, library, functions, trials, warmup, number)
+    finally:
+        shutil.rmtree(directory)
+    results = dict()
+    for name in sorted(interpreted):
+        result = results[name] = {"interpreted" : summarize(interpreted[name]),
+                                  "compiled" : summarize(compiled[name])}
+        result["speedup"] = (result["interpreted"]["median"] / result["compiled"]["median"] if
+                             result["compiled"]["median"] else 0.0)
+    return results
+
+def previous_result(database, benchmark, build_profile):
+    """ Returns the most recent Benchmark_Results row (as a dictionary) for benchmark and build_profile, or None. """
+    fields = [field.split()[0] for field in database.database_structure["Benchmark_Results"]]
+    rows = [dict(zip(fields, row)) for row in database.query_all("Benchmark_Results", fields)]
+    rows = [row for row in rows if row["benchmark"] == benchmark and row["build_profile"] == build_profile]
+    return max(rows, key=lambda row: row["recorded_at"]) if rows else None
+
+def store_result(database, benchmark, build_profile, toolchain, result):
+    """ Adds a result (see run_benchmarks) for benchmark to the Benchmark_Results table. """
+    database.insert_into("Benchmark_Results", (benchmark, build_profile, toolchain, time.time(),
+                                               result["interpreted"]["median"], result["interpreted"]["spread"],
+                                               result["compiled"]["median"], result["compiled"]["spread"],
+                                               result["speedup"]))
+
+def main():
+    """ Command line program, `main` accepts no arguments. See `python benchmarksuite.py -h` for usage documentation """
+    args = parser.parse_args()
+    if args.profile == "pgo" and not args.training_command:
+        parser.error("the pgo profile requires --training_command")
+    module_name = os.path.splitext(os.path.basename(args.source_filename))[0]
+    print("Benchmarking {} (build profile: {}, {} trials of {} calls)".format(
+          module_name, args.profile, args.trials, args.number))
+    results = run_benchmarks(args.source_filename, args.functions, args.profile, args.trials, args.warmup,
+                             args.number, args.training_command)
+    if not results:
+        print("No benchmarks; register functions with pythonjit.benchmarksuite.register or use -f")
+        return
+    database = pythonjit._database.Cache_Database(database_name=args.db_name)
+    _toolchain = toolchain()
+    regressions = []
+    print("    {:<30} {:>12} {:>10} {:>12} {:>10} {:>8}".format("benchmark", "interpreted", "spread",
+                                                               "compiled", "spread", "speedup"))
+    for name, result in sorted(results.items()):
+        benchmark = "{}.{}".format(module_name, name)
+        print("    {:<30} {:10.3f}ms {:8.3f}ms {:10.3f}ms {:8.3f}ms {:7.2f}x".format(
+              name, result["interpreted"]["median"] * 1000, result["interpreted"]["spread"] * 1000,
+              result["compiled"]["median"] * 1000, result["compiled"]["spread"] * 1000, result["speedup"]))
+        previous = previous_result(database, benchmark, args.profile)
+        if previous is not None and result["compiled"]["median"] > previous["compiled_median"] * (1 + args.tolerance):
+            regressions.append(benchmark)
+            print("        regression: {:.3f}ms before".format(previous["compiled_median"] * 1000))
+            if previous["toolchain"] != _toolchain:
+                print("        toolchain changed from: {}".format(previous["toolchain"]))
+        if not args.no_store:
+            store_result(database, benchmark, args.profile, _toolchain, result)
+    if regressions:
+        print("{} regression(s) against the previous {} results".format(len(regressions), args.profile))
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -13,6 +13,10 @@ parser.add_argument("-m", "--mode", help="Specifies a file extension (pyd, so, e
 parser.add_argument("-v", "--verbosity", help="Increase output verbosity; Options are 0 (default) and 2", type=int)
 parser.add_argument("-p", "--python_version", help="Sets the python version to 2 or 3 (default=2)", type=int)
 parser.add_argument("-c", "--compile_command", help="Specifies the command used to execute the compiler; See `cross_compile` docs")
+parser.add_argument("-j", "--jobs", help="Number of files to compile in parallel; 0 uses one process per CPU (default=1)", type=int)
+parser.add_argument("-P", "--profile", help="The build profile to compile with: {} (overrides --compile_command)".format(', '.join(sorted(pythonjit.BUILD_PROFILES))), choices=sorted(pythonjit.BUILD_PROFILES))
+parser.add_argument("-t", "--training_command", help="A shell command that exercises the compiled files, for profile guided optimization (required by the pgo profile)")
+parser.add_argument("-b", "--bundle", help="Compile all source files into one shared library with this name (without the file extension)")
 
 def main():
     """Command line program, `main` accepts no arguments. See `python compile.py -h for usage documentation"""
@@ -29,7 +33,10 @@ def main():
     version = args.python_version or '2'
     verbosity = args.verbosity or 0
     compile_command = args.compile_command or pythonjit._compile.COMPILE_COMMAND
-    pythonjit.cross_compile(source_files, output_files, mode, version, verbosity, compile_command)
+    jobs = 1 if args.jobs is None else args.jobs
+    pythonjit.cross_compile(source_files, output_files, mode, version, verbosity, compile_command, jobs,
+                            bundle=args.bundle, build_profile=args.profile,
+                            training_command=args.training_command)
 if not cython.compiled:
      main.__doc__ += '\n' + parser.format_help() #doesn't work when compiled
 
@@ -0,0 +1,148 @@
+""" Compiles the modules that an application imports ahead of time. See `python compileapp.py -h` for usage.
+
+compile.py compiles a list of files, and compilestdlib.py compiles every module in a directory. compileapp.py starts from the entry point of an application (a script, or the name of a module), and finds the modules it imports, the modules those import, and so on, across the standard library and site-packages, with the standard library's modulefinder (see find_reachable_modules). Exactly those modules are compiled into code_dir, in parallel, and recorded in the cache database, so that the first start of the application with `pythonjit.enable` and the same cache finds every module compiled and up to date. For example, in a Docker build step:
+
+    python -m pythonjit.compileapp app/main.py -j 0
+
+and in the application:
+
+    pythonjit.enable()
+
+The application has to enable pythonjit with the same cache (db_name, code_dir and artifact_dir) and build configuration (version and build_profile) that its modules were compiled with.
+
+Imports are found by reading the source, without running the application. Modules that are only imported by a computed name (e.g. plugins loaded with `__import__`) are not found; they are compiled when they are first imported, as usual. pythonjit, Cython, and the modules that `import pythonjit` loads (e.g. os and re) are left out, because they are imported before pythonjit is enabled and never go through the import hook (see modules_to_compile)."""
+import os
+import sys
+import argparse
+import subprocess
+import modulefinder
+
+import pythonjit
+import pythonjit._cythonhook
+import pythonjit.compilestdlib
+
+EXCLUDES = ("pythonjit", "Cython", "cython", "pyximport")
+# runs in a fresh process; prints the names of the modules that are loaded once pythonjit is imported
+PRELOADED_SCRIPT = """
+import sys
+import pythonjit
+print('\\n'.join(sys.modules))
+"""
+
+parser = argparse.ArgumentParser()
+parser.add_argument("entry_point", help="The script that starts the application, or the name of its main module with --module")
+parser.add_argument("-m", "--module", help="entry_point is the name of a module (as in python -m) instead of a script", action="store_true")
+parser.add_argument("-x", "--exclude", help="Comma separated names of packages and modules that should not be compiled, in addition to {}".format(', '.join(EXCLUDES)), default='')
+parser.add_argument("-l", "--list", help="Print the modules that would be compiled, without compiling them", action="store_true")
+parser.add_argument("-j", "--jobs", help="Number of modules to compile in parallel; 0 uses one process per CPU (default=0)", type=int, default=0)
+parser.add_argument("-v", "--verbosity", help="The verbosity level to pass to pythonjit.enable (default=0)", type=int, default=0)
+parser.add_argument("-d", "--db_name", help="The cache database to record the compiled modules in (default={})".format(pythonjit._cythonhook.DEFAULT_DB), default=pythonjit._cythonhook.DEFAULT_DB)
+parser.add_argument("-c", "--code_dir", help="The directory to place the compiled files in (default={})".format(pythonjit.CODE_DIR), default=pythonjit.CODE_DIR)
+parser.add_argument("-a", "--artifact_dir", help="The directory to store compiled files in (default={})".format(pythonjit._cythonhook.ARTIFACT_DIR), default=pythonjit._cythonhook.ARTIFACT_DIR)
+parser.add_argument("-P", "--profile", help="The build profile to compile with: {} (default={})".format(', '.join(sorted(pythonjit.BUILD_PROFILES)), pythonjit._compile.DEFAULT_PROFILE), choices=sorted(pythonjit.BUILD_PROFILES), default=pythonjit._compile.DEFAULT_PROFILE)
+
+def find_reachable_modules(entry_point, module=False, path=None, excludes=EXCLUDES):
+    """ usage: find_reachable_modules(entry_point, module=False, path=None, excludes=compileapp.EXCLUDES) => list of (module_name, file_path)
+
+        Returns the modules with python source files that the application started by entry_point imports, directly or through other modules, sorted by name.
+        entry_point is the file name of a script, or the name of a module if module is True. The script (which runs as __main__) is not part of the result; a module is.
+        path is the module search path of the application. If it is None, sys.path is used, with its first entry replaced by the directory of the script, or the current directory for a module, as python does when it starts the application.
+        excludes is an iterable of names of packages and modules that are left out, together with the modules that only they import.
+
+        Imports are found by modulefinder.ModuleFinder, which reads the import statements of each module (including those inside functions and try blocks) without running them. Packages are named after the package (e.g. "json"), like the modules they are imported as. """
+    if path is None:
+        path = [os.getcwd() if module else os.path.dirname(os.path.abspath(entry_point))] + sys.path[1:]
+    finder = modulefinder.ModuleFinder(path, excludes=list(excludes))
+    if module:
+        finder.import_hook(entry_point)
+    else:
+        finder.run_script(entry_point)
+    modules = []
+    for module_name, found in sorted(finder.modules.items()):
+        filename = found.__file__
+        if module_name == "__main__" or not filename or os.path.splitext(filename)[1] != ".py":
+            continue # the script itself, builtin, frozen and extension modules
+        modules.append((module_name, os.path.abspath(filename)))
+    return modules
+
+def preloaded_modules():
+    """ Returns the set of names of the modules that a new python process has loaded once it has imported pythonjit. """
+    environment = dict(os.environ)
+    library_dir = os.path.dirname(os.path.dirname(os.path.abspath(pythonjit.__file__)))
+    environment["PYTHONPATH"] = os.pathsep.join(item for item in (library_dir, environment.get("PYTHONPATH")) if item)
+    return set(subprocess.check_output([sys.executable, "-c", PRELOADED_SCRIPT], env=environment).split())
+
+def modules_to_compile(entry_point, module=False, path=None, excludes=EXCLUDES):
+    """ usage: modules_to_compile(entry_point, module=False, path=None, excludes=compileapp.EXCLUDES) => list of (module_name, file_path)
+
+        Returns the modules that the application started by entry_point imports (see find_reachable_modules), without those that are loaded by `import pythonjit` (see preloaded_modules). The application imports those before it can enable pythonjit, so they are never imported through the import hook. """
+    preloaded = preloaded_modules()
+    return [(module_name, _path) for module_name, _path in find_reachable_modules(entry_point, module, path, excludes) if
+            module_name not in preloaded]
+
+def up_to_date(hook, module_name, _path):
+    """ Returns True if hook would load the compiled version of module_name from code_dir without compiling it (see Import_Hook.check_module). """
+    old_info, source_digest, signature = hook.check_source(module_name, _path)
+    if not old_info or old_info["source_digest"] != source_digest:
+        return False
+    declarations = hook.find_declarations(module_name, source_digest)
+    dependencies = hook.check_dependencies(_path, old_info, declarations)
+    artifact_key = hook.build_key(module_name, source_digest, declarations, dependencies)
+    return (old_info.get("artifact_key") == artifact_key and hook.find_compiled_file(_path) is not None and
+            (old_info.get("source_file") == _path or hook.is_linked(_path, artifact_key)))
+
+def compile_application(entry_point, module=False, path=None, excludes=EXCLUDES, jobs=0, **kwargs):
+    """ usage: compile_application(entry_point, module=False, path=None, excludes=compileapp.EXCLUDES, jobs=0,
+                                   **kwargs) => (compiled, failed, skipped)
+
+        Compiles the modules that the application started by entry_point imports (see modules_to_compile) into code_dir, and records them in the cache database.
+        jobs is the number of modules to compile in parallel; 0 uses one process per CPU.
+        kwargs are passed to `pythonjit.enable` (see pythonjit.enable for available options), and should be those the application enables pythonjit with.
+
+        Modules whose compiled version is already up to date are skipped. Failures are recorded (see pythonjit.compile_failures), and the application imports those modules interpreted (or raises the error, unless ignore_compilation_failure is True).
+        compiled and failed are lists of (module_name, seconds), and skipped is a list of (module_name, "up to date"). """
+    modules = modules_to_compile(entry_point, module, path, excludes)
+    kwargs.setdefault("verbosity", 0)
+    pythonjit.enable(**kwargs)
+    try:
+        hook = pythonjit._STORAGE[0]
+        skipped = []
+        pending = []
+        for module_name, _path in modules:
+            if up_to_date(hook, module_name, _path):
+                skipped.append((module_name, "up to date"))
+            else:
+                pending.append((module_name, _path))
+        print("{} reachable modules: {} to compile, {} up to date".format(len(modules), len(pending), len(skipped)))
+        compiled = []
+        failed = []
+        for module_name, error, seconds in hook.precompile(pending, jobs):
+            if error is None:
+                compiled.append((module_name, seconds))
+            else:
+                failed.append((module_name, seconds))
+            print("{} {} ({:.2f}s)".format("Compiled" if error is None else "Failed", module_name, seconds))
+            if error is not None and kwargs["verbosity"]:
+                print(error)
+    finally:
+        pythonjit.disable()
+    return compiled, failed, skipped
+
+def main():
+    """ Command line program, `main` accepts no arguments. See `python compileapp.py -h` for usage documentation """
+    args = parser.parse_args()
+    excludes = EXCLUDES + tuple(name.strip() for name in args.exclude.split(',') if name.strip())
+    if args.list:
+        for module_name, _path in modules_to_compile(args.entry_point, args.module, excludes=excludes):
+            print("{:<60} {}".format(module_name, _path))
+        return
+    compiled, failed, skipped = compile_application(args.entry_point, args.module, excludes=excludes, jobs=args.jobs,
+                                                    verbosity=args.verbosity, db_name=args.db_name,
+                                                    code_dir=args.code_dir, artifact_dir=args.artifact_dir,
+                                                    build_profile=args.profile)
+    pythonjit.compilestdlib.print_summary(compiled, failed, skipped)
+    if failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+""" Command line program that lists the modules that failed to compile, with the error output of cython or the compiler. See `python compilefailures.py -h` for usage.
+
+`pythonjit.enable` records compilation failures in the cache database, and does not compile a module that failed again until its source or the build configuration changes. Clearing a failure (e.g. after installing a missing header) makes the next import try again.
+
+    python compilefailures.py -m mymodule --clear """
+import argparse
+import datetime
+
+import pythonjit
+import pythonjit._cythonhook
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-d", "--db_name", help="The cache database to read (default={})".format(pythonjit._cythonhook.DEFAULT_DB), default=pythonjit._cythonhook.DEFAULT_DB)
+parser.add_argument("-m", "--module", help="Only show this module; may be given several times", action="append", dest="modules")
+parser.add_argument("-q", "--quiet", help="Do not show the error output", action="store_true")
+parser.add_argument("--clear", help="Forget the listed failures, so that the modules are compiled again", action="store_true")
+
+def format_failure(module_name, failure, show_output=True):
+    """ Returns the lines that describe a failure (see pythonjit.compile_failures). """
+    lines = ["{} ({} failed at {:%Y-%m-%d %H:%M:%S})".format(module_name, failure["stage"],
+                                                            datetime.datetime.fromtimestamp(failure["failed_at"])),
+             "    source: {}".format(failure["source_file"]),
+             "    {}".format(failure["message"])]
+    if show_output and failure["output"]:
+        lines.extend("        " + line for line in failure["output"].rstrip().splitlines())
+    return lines
+
+def show_failures(database, modules=None, show_output=True, clear=False):
+    """ Prints the failures recorded in database (only those of modules, if given), and deletes them if clear is True. """
+    failures = pythonjit._cythonhook.compile_failures(database)
+    if modules:
+        failures = dict((module_name, failure) for module_name, failure in failures.items() if
+                        module_name in modules)
+    for module_name, failure in sorted(failures.items()):
+        for line in format_failure(module_name, failure, show_output):
+            print(line)
+    print("{} recorded failure(s)".format(len(failures)))
+    if clear and failures:
+        with database.transaction():
+            for module_name in failures:
+                database.delete_from("Compile_Failures", where={"module_name" : module_name})
+        print("Cleared {} failure(s)".format(len(failures)))
+
+def main():
+    """ Command line program, `main` accepts no arguments. See `python compilefailures.py -h` for usage documentation """
+    args = parser.parse_args()
+    pythonjit._query_database(lambda database: show_failures(database, args.modules, not args.quiet, args.clear),
+                              args.db_name)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+""" Command line program that reports the compile telemetry recorded by `pythonjit.enable` in the cache database. See `python compilereport.py -h` for usage.
+
+The report shows the cache hit rate, the time spent checking source digests, the total time spent in each stage of compilation and the modules that took the longest to compile (see `pythonjit.stats`).
+
+    python compilereport.py -n 20 """
+import argparse
+
+import pythonjit
+import pythonjit._cythonhook
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-d", "--db_name", help="The cache database to report on (default={})".format(pythonjit._cythonhook.DEFAULT_DB), default=pythonjit._cythonhook.DEFAULT_DB)
+parser.add_argument("-n", "--count", help="The number of slowest modules to list (default=10)", type=int, default=10)
+
+STAGES = ("pyx_seconds", "cython_seconds", "gcc_seconds", "training_seconds")
+
+def format_size(size):
+    """ Returns size (in bytes) as a string in kB. """
+    return "{:.1f}kB".format((size or 0) / 1024.0)
+
+def report(stats, count=10):
+    """ usage: report(stats, count=10) => list of lines
+
+        Returns the lines of a report on stats (as returned by pythonjit.stats), listing the count slowest modules. """
+    lookups = stats["hits"] + stats["misses"] + stats["stale"]
+    lines = ["Imports checked: {}  hits: {}  misses: {}  stale: {}  hit rate: {:.1%}".format(
+             lookups, stats["hits"], stats["misses"], stats["stale"], stats["hit_rate"]),
+             "Compilations: {}  failed: {}  reused from the artifact store: {}".format(
+             stats["compiles"], stats["compile_failures"], stats["artifact_hits"]),
+             "Digest checks: {} ({} hashed) in {:.1f}ms, {} dependency scans".format(
+             stats["digest_checks"], stats["digests_computed"], stats["digest_seconds"] * 1000,
+             stats["dependency_scans"]),
+             "Import hook: {} imports in {:.1f}ms, {:.1f}ms of it compiling, {:.1f}us per import otherwise".format(
+             stats["hook_calls"], stats["hook_seconds"] * 1000, stats["hook_compile_seconds"] * 1000,
+             (stats["hook_seconds"] - stats["hook_compile_seconds"]) * 1000000 / stats["hook_calls"] if
+             stats["hook_calls"] else 0.0)]
+    modules = stats["modules"]
+    total = sum(entry["total_seconds"] or 0 for entry in modules.values())
+    lines.append("Compile time of the latest compilation of {} modules: {:.2f}s".format(len(modules), total))
+    for stage in STAGES:
+        seconds = sum(entry[stage] or 0 for entry in modules.values())
+        lines.append("    {:<10} {:8.2f}s {:6.1%}".format(stage.split('_')[0], seconds,
+                                                         seconds / total if total else 0.0))
+    if modules:
+        lines.append("Slowest modules:")
+        lines.append("    {:<40} {:>8} {:>8} {:>8} {:>8} {:>10} {:>10}".format(
+                     "module", "total", "pyx", "cython", "gcc", "C size", "size"))
+        slowest = sorted(modules.items(), key=lambda item: item[1]["total_seconds"] or 0, reverse=True)
+        for module_name, entry in slowest[:count]:
+            lines.append("    {:<40} {:7.2f}s {:7.2f}s {:7.2f}s {:7.2f}s {:>10} {:>10}".format(
+                         module_name, entry["total_seconds"] or 0, entry["pyx_seconds"] or 0,
+                         entry["cython_seconds"] or 0, entry["gcc_seconds"] or 0,
+                         format_size(entry["c_size"]), format_size(entry["library_size"])))
+    return lines
+
+def main():
+    """ Command line program, `main` accepts no arguments. See `python compilereport.py -h` for usage documentation """
+    args = parser.parse_args()
+    for line in report(pythonjit.stats(args.db_name), args.count):
+        print(line)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+""" Command line program that runs a compile server: a long running process that compiles modules for the processes that use pythonjit. See `python compileserver.py -h` for usage.
+
+Processes that call `pythonjit.enable(compile_server=socket_path)` ask the server for the compiled version of a module instead of running cython and the compiler themselves (see `_compileclient`). This saves every short lived process (test runners, cron jobs, command line tools) from loading Cython and compiling on its own.
+
+The server compiles with its own compile command for the build profile that a client names (see _compile.BUILD_PROFILES), and never runs a command supplied by a client; modules built with a custom compile command, or with profile guided optimization, are compiled by the processes themselves. The socket can only be used by the user that runs the server.
+
+The server compiles modules in a pool of worker processes, which keep Cython loaded between compilations. Different modules are compiled in parallel, and a module that several processes ask for at the same time is compiled once. Compiled files are kept in the server's Artifact_Store. The compile stats and failures are recorded in the server's cache database, and a module that failed to compile is not compiled again until its build key changes.
+
+    python compileserver.py -j 4
+
+The server runs until it is interrupted or terminated."""
+import os
+import sys
+import json
+import time
+import Queue
+import signal
+import socket
+import thread
+import argparse
+import threading
+import traceback
+import multiprocessing
+import SocketServer
+
+import pythonjit._artifacts
+import pythonjit._compile
+import pythonjit._compileclient
+import pythonjit._cythonhook
+import pythonjit._database
+import pythonjit._dependencies
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-s", "--socket", help="The Unix domain socket to listen on (default={})".format(pythonjit._compileclient.SOCKET_PATH), default=pythonjit._compileclient.SOCKET_PATH)
+parser.add_argument("-d", "--db_name", help="The cache database to record compile stats and failures in (default={})".format(pythonjit._cythonhook.DEFAULT_DB), default=pythonjit._cythonhook.DEFAULT_DB)
+parser.add_argument("-a", "--artifact_dir", help="The directory to store compiled files in (default={})".format(pythonjit._cythonhook.ARTIFACT_DIR), default=pythonjit._cythonhook.ARTIFACT_DIR)
+parser.add_argument("-o", "--object_cache", help="The object cache directory; an empty string disables the object cache (default={})".format(pythonjit._cythonhook.OBJECT_CACHE), default=pythonjit._cythonhook.OBJECT_CACHE)
+parser.add_argument("-j", "--jobs", help="The number of worker processes; 0 uses one process per CPU (default=0)", type=int, default=0)
+parser.add_argument("-v", "--verbosity", help="0 is silent, 1 prints each compilation, 2 also prints the output of the tools (default=0)", type=int, default=0)
+
+class Request_Handler(SocketServer.StreamRequestHandler):
+    """ Reads one request from the connection and writes the reply (see _compileclient). """
+
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            return
+        request = json.loads(line)
+        if not request: # an empty request checks that the server is running
+            self.wfile.write("{}\n")
+            return
+        try:
+            reply = self.server.build(request)
+        except Exception:
+            if self.server.verbosity:
+                traceback.print_exc()
+            reply = {"artifact_key" : None}
+        self.wfile.write(json.dumps(reply) + '\n')
+
+class Compile_Server(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    """ usage: Compile_Server(socket_path=_compileclient.SOCKET_PATH, database_name=_cythonhook.DEFAULT_DB,
+                              artifact_dir=_cythonhook.ARTIFACT_DIR, object_cache=_cythonhook.OBJECT_CACHE,
+                              jobs=0, verbosity=0) => compile_server
+
+        Listens on the Unix domain socket socket_path, which only the user running the server can connect to, and compiles the modules that clients request into an Artifact_Store in artifact_dir.
+        Modules are compiled with the command of the build profile named in the request (see _compile.build_command). Requests for the "pgo" profile, an unknown profile or python version are refused with ValueError.
+        Each connection is handled in its own thread. Compilations run in a pool of jobs worker processes (one per CPU if jobs is 0), and requests for a build key that is already being compiled wait for that compilation.
+        Compile stats and failures are written to the database by the thread that calls serve (see record). """
+    daemon_threads = True
+
+    def __init__(self, socket_path=pythonjit._compileclient.SOCKET_PATH,
+                 database_name=pythonjit._cythonhook.DEFAULT_DB,
+                 artifact_dir=pythonjit._cythonhook.ARTIFACT_DIR,
+                 object_cache=pythonjit._cythonhook.OBJECT_CACHE, jobs=0, verbosity=0):
+        self.verbosity = verbosity
+        self.object_cache = object_cache
+        self.library_type = pythonjit._compile.SHARED_LIBRARY
+        self.compile_commands = dict((profile, pythonjit._compile.build_command(profile)) for
+                                     profile in pythonjit._compile.BUILD_PROFILES if profile != "pgo")
+        self.artifacts = pythonjit._artifacts.Artifact_Store(artifact_dir)
+        self.database = pythonjit._database.Cache_Database(database_name=database_name)
+        fields = [field.split()[0] for field in self.database.database_structure["Compile_Failures"]]
+        self.failures = dict((row[0], dict(zip(fields[1:], row[1:]))) for
+                             row in self.database.query_all("Compile_Failures", fields))
+        self.building = dict()
+        self.lock = thread.allocate_lock()
+        self.records = Queue.Queue()
+        # the workers are forked before the socket is opened, so that they do not hold it open
+        self.pool = multiprocessing.Pool(jobs or multiprocessing.cpu_count(), start_worker)
+        pythonjit._artifacts.make_directory(os.path.dirname(os.path.abspath(socket_path)))
+        if os.path.exists(socket_path):
+            try:
+                pythonjit._compileclient.Compile_Client(socket_path).request({})
+            except socket.error: # left behind by a server that did not exit cleanly
+                os.remove(socket_path)
+            else:
+                self.pool.terminate()
+                raise ValueError("A compile server is already listening on {}".format(socket_path))
+        SocketServer.UnixStreamServer.__init__(self, socket_path, Request_Handler)
+
+    def server_bind(self):
+        """ Binds the socket with permissions for the user running the server only. The umask is set while binding, so that the socket is never open to other users. """
+        umask = os.umask(0o177)
+        try:
+            SocketServer.UnixStreamServer.server_bind(self)
+        finally:
+            os.umask(umask)
+        os.chmod(self.server_address, 0o600)
+
+    def build(self, request):
+        """ usage: build(request) => reply
+
+            Returns the reply (see _compileclient) to a request for a compiled module, compiling the module if the Artifact_Store does not have it. """
+        module_name, _path = request["module_name"], request["source_file"]
+        declarations, version, profile = request["declarations"], request["version"], request["build_profile"]
+        if profile not in self.compile_commands:
+            raise ValueError("Build profile {} is not compiled by the server".format(profile))
+        if version not in ('2', '3'):
+            raise ValueError("Invalid version {}".format(version))
+        compile_command = self.compile_commands[profile]
+        source_digest = pythonjit._cythonhook.file_digest(_path)
+        dependencies = pythonjit._cythonhook.scan_dependencies(_path, declarations)
+        artifact_key = pythonjit._artifacts.build_key(source_digest, module_name, version,
+                                                      self.library_type, compile_command,
+                                                      pythonjit._cythonhook.file_digest(declarations) if
+                                                      declarations else None,
+                                                      pythonjit._compile.profile_signature(profile),
+                                                      pythonjit._dependencies.dependencies_digest(dependencies))
+        reply = {"artifact_key" : artifact_key}
+        if artifact_key != request["artifact_key"]:
+            return reply
+        artifact = self.artifacts.get_path(artifact_key, self.library_type)
+        if not os.path.isfile(artifact):
+            with self.lock:
+                failure = self.failures.get(module_name)
+                if failure is not None and failure["artifact_key"] == artifact_key:
+                    reply.update(error=failure["message"], stage=failure["stage"], output=failure["output"])
+                    return reply
+                compiling = artifact_key not in self.building
+                if compiling:
+                    if self.verbosity:
+                        print("Cross compiling: {}".format(module_name))
+                    arguments = (module_name, _path, artifact, version, self.verbosity, compile_command,
+                                 self.object_cache, declarations, None)
+                    self.building[artifact_key] = (self.pool.apply_async(pythonjit._cythonhook._compile_module,
+                                                                         (arguments, )), threading.Event())
+                result, finished = self.building[artifact_key]
+            if compiling:
+                try:
+                    error, seconds, stats = result.get()[1:]
+                    with self.lock:
+                        self.record(module_name, _path, source_digest, artifact_key, error, seconds, stats)
+                finally:
+                    with self.lock:
+                        del self.building[artifact_key]
+                    finished.set()
+            else: # an AsyncResult only wakes one of the threads waiting for it
+                finished.wait()
+                error, seconds, stats = result.get()[1:]
+            if error is not None:
+                reply.update(error=str(error), stage=("cython" if
+                                                      isinstance(error, pythonjit._compile.Cython_Conversion_Error)
+                                                      else "compiler"),
+                             output=error.output)
+                return reply
+        reply["artifact"] = artifact
+        return reply
+
+    def record(self, module_name, _path, source_digest, artifact_key, error, seconds, stats):
+        """ Records the outcome of a compilation in failures, and queues it to be written to the database by serve.
+            Called with lock held. """
+        if error is None:
+            self.failures.pop(module_name, None)
+        else:
+            self.failures[module_name] = {"artifact_key" : artifact_key, "source_file" : _path,
+                                          "source_digest" : source_digest,
+                                          "stage" : ("cython" if
+                                                     isinstance(error, pythonjit._compile.Cython_Conversion_Error)
+                                                     else "compiler"),
+                                          "message" : str(error), "output" : error.output,
+                                          "failed_at" : time.time()}
+        self.records.put((module_name, artifact_key, error is None, seconds, stats))
+
+    def write_records(self, records):
+        """ Writes the compile stats and failures of records (as queued by record) to the database in a single transaction. """
+        failure_fields = [field.split()[0] for field in self.database.database_structure["Compile_Failures"]]
+        counters = {"compiles" : 0, "compile_failures" : 0}
+        with self.database.transaction():
+            for module_name, artifact_key, compiled, seconds, stats in records:
+                if compiled:
+                    counters["compiles"] += 1
+                    self.database.delete_from("Compile_Failures", where={"module_name" : module_name})
+                    if stats:
+                        self.database.insert_or_replace("Compile_Stats", (module_name, artifact_key, time.time(), seconds) +
+                                                        tuple(stats.get(name, 0) for
+                                                              name in pythonjit._compile.COMPILE_STATS))
+                else:
+                    counters["compile_failures"] += 1
+                    with self.lock:
+                        entry = self.failures.get(module_name)
+                    if entry is not None:
+                        self.database.insert_or_replace("Compile_Failures", (module_name, ) +
+                                                        tuple(entry[field] for field in failure_fields[1:]))
+            self.database.add_to_counters(counters)
+
+    def serve(self, poll_interval=.5):
+        """ Handles requests until the process is interrupted or terminated, writing the outcome of compilations to the database as they finish.
+            The socket is removed and the worker processes are stopped when the server stops. """
+        thread.start_new_thread(self.serve_forever, (poll_interval, ))
+        try:
+            while True:
+                try:
+                    records = [self.records.get(timeout=poll_interval)]
+                except Queue.Empty:
+                    continue
+                while not self.records.empty():
+                    records.append(self.records.get())
+                self.write_records(records)
+        finally:
+            self.shutdown()
+            self.server_close()
+            self.pool.terminate()
+            records = []
+            while not self.records.empty():
+                records.append(self.records.get())
+            if records:
+                self.write_records(records)
+            if os.path.exists(self.server_address):
+                os.remove(self.server_address)
+
+def start_worker():
+    """ Sets up the signals of a worker process: SIGINT is ignored, so that interrupting the server does not interrupt the compilations, and SIGTERM (which the server stops the workers with) is not handled by terminate. """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+def terminate(signal_number, frame):
+    """ Stops the server when the process is terminated. """
+    raise KeyboardInterrupt()
+
+def main():
+    """ Command line program, `main` accepts no arguments. See `python compileserver.py -h` for usage documentation """
+    args = parser.parse_args()
+    try:
+        server = Compile_Server(args.socket, args.db_name, args.artifact_dir, args.object_cache or None, args.jobs,
+                                args.verbosity)
+    except ValueError as error:
+        sys.exit(str(error))
+    signal.signal(signal.SIGTERM, terminate)
+    print("Compile server listening on {}".format(args.socket))
+    try:
+        server.serve()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
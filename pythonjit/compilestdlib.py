@@ -1,116 +1,143 @@
 """ Compiles python standard library modules ahead of time. """
-import argparse # cannot compile anyways because it uses "const" as a variable name
+import argparse
+import os
 
 import pythonjit
 
 parser = argparse.ArgumentParser()
 parser.add_argument("python_dir", help="The location of the python standard library files")
-parser.add_argument("-v", "--verbosity", help="The verbosity level to pass to pythonjit.enable")
+parser.add_argument("-v", "--verbosity", help="The verbosity level to pass to pythonjit.enable", type=int)
 parser.add_argument("-db", "--database", help="The database file to use")
 parser.add_argument("-cd", "--code_dir", help="The directory to place the compiled files")
+parser.add_argument("-j", "--jobs", help="Number of modules to compile in parallel; 0 uses one process per CPU (default=1)", type=int)
+parser.add_argument("--restart", help="Discard the progress of a previous, interrupted run", action="store_true")
 
-DONT_COMPILE = ("antigravity", "this",# importing causes them to run, no benefit to compiling them anyways
-                "test.regrtest",      # test.regrtest causes RuntimeError for some reason (apparently not supposed to import it anyways)
-                "lib2to3.pgen.conv",  # causes ImportError: no module named pgen2
-                "lib2to3.pgen2.conv", # ImportError
-                "glib.__init__",      # NameError (references/imports a compiled module with a different name)
-                "apt.auth",           # gcc chokes on the cross compiled variant
-                "gobject.__init__",   # NameError
-                "keyring.backends._OS_X_API", # OSError (probably won't happen if actually running OSX)
-                "keyring.tests.test_backend", # ImportError: No module named pytest
+DONT_COMPILE = ("apt.auth",           # gcc chokes on the cross compiled variant
                 "wstools.XMLSchema",  # has an actual bug in it; Cython finds an undefined variable at line 2971
-                "keyring.devpi_client", # ImportError: no module named pluggy
                 "wstools.tests.test_t1",# main not defined (probably some metaprogramming hack going on)
-                "setuptools",         # uses "include" as a variable name
-                "Cython.Compiler.Main", # uses "include" as a variable name
-                "Cython.Utils",       # uses "include" as a variable name
-                "Cython.Compiler.PyrexTypes", # uses "signed" as a variable name
-                "Cython.Compiler.Code", # uses "include" as a variable name
                 "Cython.Compiler.TypeSlots",  # undeclared name not builtin
-                "pygtkcompat",     # ImportError
-                "gtk.dsextras",       # ImportError
-                "gtk.compat",         # TypeError (it tries to __init__ a module without a name argument)
-                "PyQt4.uic.uiparser", # uses "include" as a variable name
-                "PyQt4.uic.pyuic",    # runs code not wrapped in if __name__ == "__main__":; it uses a parser and complains about this programs options
-                "defusedxml.lxml",    # ImportError
-                "setuptools.lib2to3_ex", # ImportError
                 "SOAPpy.Errors",      # undeclared name not builtin
                 "SOAPpy.NS",          # undeclared name
                 "SOAPpy.Parser",      # Empty declarator (unclosed paranthesis?)
-                "SOAPpy.Types",       # calls repr with wrong number of arguments,
-                "SOAPpy.GSIServer",   # ImportError
-                "encodings.mbcs",     # ImportError
-                "distutils.msvc9compiler", # ImportError (may work if running Windows)
-                "distutils.command.bdist_msi",  # ImportError
-                "distutils.command.install_egg_info",   # NameError
-                "xml.etree.ElementInclude", # uses "include" as a variable name
-                "test.support.__init__") # must be imported from test package
+                "SOAPpy.Types")       # calls repr with wrong number of arguments
 
 IGNORE_PACKAGES = ("gtk-2.0", "gtk-2.0.gio", "PyQt4.uic.widget-plugins",
                    "lib2to3", "lib-tk", "plat-x86_64-linux-gnu")
 
+def find_modules(python_dir, dont_compile=DONT_COMPILE, ignore_packages=IGNORE_PACKAGES):
+    """ usage: find_modules(python_dir, dont_compile=compilestdlib.DONT_COMPILE,
+                            ignore_packages=compilestdlib.IGNORE_PACKAGES) => list of (module_name, file_path)
+
+        Walks python_dir and returns the modules that compile_stdlib should compile.
+        Packages are named after the package (e.g. "json"), not the __init__ module. """
+    modules = []
+    python_dir = os.path.normpath(python_dir) # e.g. without the trailing separator of the default
+    for dirname, path, filenames in os.walk(python_dir):
+        package = os.path.relpath(dirname, python_dir)
+        package = package.split(os.path.sep) if package != os.curdir else []
+        if package and package[0] == "dist-packages":
+            del package[0]
+        package = '.'.join(package)
+        if package in ignore_packages:
+            continue
+        if package == "gtk-2.0.gtk":
+            package = "gtk"
+
+        for filename in sorted(filenames):
+            module_name, extension = os.path.splitext(filename)
+            if extension != ".py":
+                continue
+            if package:
+                module_name = '.'.join((package, module_name))
+            if module_name in dont_compile:
+                continue
+            if module_name.endswith(".__init__"):
+                module_name = package
+            if module_name in dont_compile:
+                continue
+            modules.append((module_name, os.path.join(dirname, filename)))
+    return modules
+
 def compile_stdlib(python_dir="/usr/lib/python2.7/",
                    dont_compile=DONT_COMPILE,
                    ignore_packages=IGNORE_PACKAGES,
+                   jobs=1, restart=False,
                    **kwargs):
     """ usage: compile_stdlib(python_dir="/usr/lib/python2.7/",
                               dont_compile=compilestdlib.DONT_COMPILE,
-                              ignore_packages=compilestdlib.IGNORE_PACKAGES
+                              ignore_packages=compilestdlib.IGNORE_PACKAGES,
+                              jobs=1, restart=False,
                               **kwargs) => None
 
         Compiles all python files in python_dir (recursively)
         python_dir is a string indicating a directory
         dont_compile is an iterable of fully-qualified (package.module.module) module names that should be not be compiled
         ignore_packages is an iterable of package names that should not have any of their modules compiled
-        kwargs are passed to `pythonjit.enable` (see pythonjit.enable for available options)"""
+        jobs is the number of modules to compile in parallel; 0 uses one process per CPU
+        restart is a boolean that indicates whether to discard the progress of a previous run
+        kwargs are passed to `pythonjit.enable` (see pythonjit.enable for available options)
+
+        Module sources are compiled directly; they are not imported.
+        Progress is checkpointed in the cache database after every module, so an interrupted run resumes where it stopped when compile_stdlib is called again.
+        Modules that compiled or failed in a previous run are skipped unless their source changed.
+        Failures are recorded with their error output (see pythonjit.compile_failures), so imports do not try to compile a module that failed again until its source or the toolchain changes.
+        A summary of compiled, failed and skipped modules is printed at the end."""
     print("Compiling all python standard library modules (this will take a while...)")
-    kwargs.setdefault("ignore_compilation_failure", True) # modules in the standard library that don't compile can't really be helped (yet)
+    kwargs.setdefault("verbosity", 0)
     pythonjit.enable(**kwargs)
-    import importlib # importing here so they get compiled
-    import os
-    import traceback
-    import sys
-    _root_dir_length = len(python_dir.split(os.path.sep))
-    for dirname, path, filenames in os.walk(python_dir):
-        package = dirname.split(os.path.sep)[_root_dir_length:]
-        if package and package[0] == "dist-packages":
-            del package[0]
-        package = '.'.join(package)
-        if package in ignore_packages:
-            continue
-        if package == "gtk-2.0.gtk":
-            package = "gtk"
+    try:
+        hook = pythonjit._STORAGE[0]
+        database = hook.database
+        if restart:
+            database.drop_table("Compile_Progress")
+            database.create_table("Compile_Progress", database.database_structure["Compile_Progress"])
+        progress = dict((module_name, (source_digest, status)) for module_name, source_digest, status in
+                        database.query_all("Compile_Progress", ("module_name", "source_digest", "status")))
 
-        print('-' * 80)
-        if package:
-            print("Compiling package: {}".format(package))
-        else:
-            print("Compiling entries in {}".format(dirname))
-    #    raw_input()
-        for filename in filenames:
-            module_name, extension = os.path.splitext(filename)
-            #if module_name == "__main__":
-            #    module_name = "main"
-            if package:
-                module_name = '.'.join((package, module_name))
+        modules = []
+        digests = dict()
+        skipped = []
+        for module_name, _path in find_modules(python_dir, dont_compile, ignore_packages):
+            source_digest = hook.obtain_source_digest(_path)
+            if progress.get(module_name, (None, None))[0] == source_digest:
+                skipped.append((module_name, progress[module_name][1]))
+            else:
+                modules.append((module_name, _path))
+                digests[module_name] = source_digest
+        print("{} modules to compile, {} already done".format(len(modules), len(skipped)))
+
+        compiled = []
+        failed = []
+        try:
+            for module_name, error, seconds in hook.precompile(modules, jobs):
+                if error is None:
+                    status = "compiled"
+                    compiled.append((module_name, seconds))
+                else:
+                    status = "failed"
+                    failed.append((module_name, seconds))
+                print("{} {} ({:.2f}s)".format(status.capitalize(), module_name, seconds))
+                if error is not None and kwargs["verbosity"]:
+                    print(error)
+                database.insert_or_replace("Compile_Progress", (module_name, digests[module_name],
+                                                                status, seconds))
+        except KeyboardInterrupt:
+            print("Interrupted; run compile_stdlib again to resume")
+    finally:
+        pythonjit.disable()
+    print_summary(compiled, failed, skipped)
 
-            if extension == ".py" and module_name not in dont_compile:
-                print("Compiling: {}".format(module_name))
-                try:
-                    importlib.import_module(module_name)
-                except ImportError:
-                    if "__main__" in module_name:
-                        module_name = module_name.replace("__main__", "main")
-                        print("Trying again; Compiling {} instead".format(module_name))
-                        importlib.import_module(module_name)
-                    elif kwargs["verbosity"]:
-                        print(traceback.format_exc())
-                except ValueError:
-                    if module_name == "ctypes.wintypes" and "win" not in sys.platform:
-                        continue
-                    else:
-                        raise
-    pythonjit.disable()
+def print_summary(compiled, failed, skipped):
+    """ Prints the outcome of a compile_stdlib run.
+        compiled and failed are lists of (module_name, seconds), skipped is a list of (module_name, previous status). """
+    print('-' * 80)
+    print("Compiled: {}  Failed: {}  Skipped: {}".format(len(compiled), len(failed), len(skipped)))
+    for title, entries in (("Compiled", compiled), ("Failed", failed)):
+        if entries:
+            print('-' * 80)
+            print("{} (slowest first):".format(title))
+            for module_name, seconds in sorted(entries, key=lambda entry: entry[1], reverse=True):
+                print("    {:<60} {:8.2f}s".format(module_name, seconds))
 
 if __name__ == "__main__":
     args = parser.parse_args()
@@ -123,4 +150,5 @@ if __name__ == "__main__":
         kwargs["db_name"] = args.database
     if args.code_dir:
         kwargs["code_dir"] = args.code_dir
-    compile_stdlib(args.python_dir, **kwargs)
+    jobs = 1 if args.jobs is None else args.jobs
+    compile_stdlib(args.python_dir, jobs=jobs, restart=args.restart, **kwargs)
@@ -0,0 +1,33 @@
+""" Command line program that writes the compiled modules of a cache to a cache bundle. See `python exportcache.py -h` for usage.
+
+A cache bundle is a single archive with the compiled files of the modules recorded in the cache database, the digests of the source files they were compiled from, and the python ABI and platform they were compiled for (see `pythonjit.export_cache_bundle`). It lets a machine without Cython or a C compiler use modules compiled on another machine:
+
+    python exportcache.py app.pjbundle
+
+and on the target machine:
+
+    pythonjit.enable(cache_bundle="app.pjbundle")
+
+Modules whose installed source file differs from the one the bundle was made from are not loaded from the bundle."""
+import sys
+import argparse
+
+import pythonjit
+import pythonjit._cythonhook
+
+parser = argparse.ArgumentParser()
+parser.add_argument("filename", help="The file name of the cache bundle to write")
+parser.add_argument("-d", "--db_name", help="The cache database whose modules are exported (default={})".format(pythonjit._cythonhook.DEFAULT_DB), default=pythonjit._cythonhook.DEFAULT_DB)
+parser.add_argument("-c", "--code_dir", help="The directory of compiled modules (default={})".format(pythonjit.CODE_DIR), default=pythonjit.CODE_DIR)
+parser.add_argument("-a", "--artifact_dir", help="The directory of stored compiled files (default={})".format(pythonjit._cythonhook.ARTIFACT_DIR), default=pythonjit._cythonhook.ARTIFACT_DIR)
+
+def main():
+    """ Command line program, `main` accepts no arguments. See `python exportcache.py -h` for usage documentation """
+    args = parser.parse_args()
+    count = pythonjit.export_cache_bundle(args.filename, args.db_name, args.code_dir, args.artifact_dir)
+    if not count:
+        sys.exit("No compiled modules found in {}".format(args.db_name))
+    print("Wrote {} module(s) to {}".format(count, args.filename))
+
+if __name__ == "__main__":
+    main()
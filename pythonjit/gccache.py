@@ -0,0 +1,52 @@
+""" Command line program that removes the files of the cache that are no longer needed. See `python gccache.py -h` for usage.
+
+code_dir holds a compiled file for every source file that was ever imported with pythonjit enabled, including the sources of deleted virtualenvs, old checkouts and temporary directories. This program removes compiled files whose source file no longer exists or has changed, stored compiled files that are no longer used and temporary files, and reports the bytes reclaimed (see `pythonjit.collect_garbage`). With a size limit, the compiled files that were used least recently are removed until the cache fits:
+
+    python gccache.py -m 2G
+
+`pythonjit.enable(max_cache_size=...)` does the same in a background thread."""
+import sys
+import argparse
+
+import pythonjit
+import pythonjit._cythonhook
+
+UNITS = {'K' : 1024, 'M' : 1024 ** 2, 'G' : 1024 ** 3}
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-d", "--db_name", help="The cache database (default={})".format(pythonjit._cythonhook.DEFAULT_DB), default=pythonjit._cythonhook.DEFAULT_DB)
+parser.add_argument("-c", "--code_dir", help="The directory of compiled modules (default={})".format(pythonjit.CODE_DIR), default=pythonjit.CODE_DIR)
+parser.add_argument("-a", "--artifact_dir", help="The directory of stored compiled files (default={})".format(pythonjit._cythonhook.ARTIFACT_DIR), default=pythonjit._cythonhook.ARTIFACT_DIR)
+parser.add_argument("-m", "--max_cache_size", help="The size in bytes (or with a K, M or G suffix) that the cache should not grow beyond; least recently used compiled files are removed until it fits (default=no limit)", default=None)
+
+def parse_size(size):
+    """ Returns the number of bytes indicated by size, a string of digits with an optional K, M or G suffix. """
+    size = size.strip().upper()
+    if size[-1:] in UNITS:
+        return int(float(size[:-1]) * UNITS[size[-1]])
+    return int(size)
+
+def format_size(size):
+    """ Returns size (in bytes) as a string in the largest unit that it is at least one of. """
+    for unit in "GMK":
+        if size >= UNITS[unit]:
+            return "{:.1f}{}B".format(float(size) / UNITS[unit], unit)
+    return "{}B".format(size)
+
+def main():
+    """ Command line program, `main` accepts no arguments. See `python gccache.py -h` for usage documentation """
+    args = parser.parse_args()
+    try:
+        max_cache_size = parse_size(args.max_cache_size) if args.max_cache_size is not None else None
+    except ValueError:
+        sys.exit("Invalid size: {}".format(args.max_cache_size))
+    report = pythonjit.collect_garbage(args.db_name, args.code_dir, args.artifact_dir, max_cache_size)
+    if report is None:
+        sys.exit("Another process is collecting garbage in {}".format(args.code_dir))
+    print("Removed {} orphaned and {} stale compiled files, {} unused artifacts, {} temporary files and {} least recently used files".format(
+          report["orphans"], report["stale"], report["artifacts"], report["temporary_files"], report["evicted"]))
+    print("Removed {} cache entries".format(len(report["removed_entries"])))
+    print("Reclaimed {}; the cache is now {}".format(format_size(report["bytes_reclaimed"]), format_size(report["cache_size"])))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+""" Command line program that runs a python script while tracing the types used by its modules, and writes Cython declarations for them. See `python tracetypes.py -h` for usage.
+
+The declarations are augmenting .pxd files in the types directory (see `pythonjit.enable(trace_types=True)`), which `pythonjit.enable` uses the next time the traced modules are compiled. Running the script again merges the new observations with the earlier ones.
+
+    python tracetypes.py -m mypackage myscript.py --some-argument """
+import argparse
+import os
+import runpy
+import sys
+
+import pythonjit._typetrace
+
+parser = argparse.ArgumentParser()
+parser.add_argument("script", help="The python script to run")
+parser.add_argument("arguments", help="Arguments for the script", nargs=argparse.REMAINDER)
+parser.add_argument("-m", "--module", help="Trace this module or package; may be given several times (default: every module outside the standard library)", action="append", dest="modules")
+parser.add_argument("-d", "--types_dir", help="The directory to keep traced types in (default={})".format(pythonjit._typetrace.TYPES_DIR), default=pythonjit._typetrace.TYPES_DIR)
+
+def main():
+    """ Command line program, `main` accepts no arguments. See `python tracetypes.py -h` for usage documentation """
+    args = parser.parse_args()
+    tracer = pythonjit._typetrace.Type_Tracer(modules=set(args.modules) if args.modules else None)
+    sys.argv = [args.script] + args.arguments
+    sys.path[0] = os.path.dirname(os.path.abspath(args.script))
+    tracer.start()
+    try:
+        runpy.run_path(args.script, run_name="__main__")
+    finally:
+        tracer.stop()
+        for module_name, pxd_file, conflicts in tracer.save(args.types_dir):
+            print("{}: {}".format(module_name, pxd_file or "nothing to declare"))
+            for function_name, name, types in conflicts:
+                print("    {}: {} was seen as {}, left untyped".format(function_name, name, ', '.join(types)))
+
+if __name__ == "__main__":
+    main()